@@ -15,6 +15,7 @@
 # limitations under the License.
 
 import argparse
+import json
 import os
 import sys
 import yaml
@@ -30,8 +31,12 @@ def _add_path(path):
 
 _add_path(_root)
 
-from charmhelpers.core.host import service_pause, service_resume
-from charmhelpers.core.hookenv import action_fail
+from charmhelpers.core.hookenv import (
+    action_fail,
+    action_get,
+    action_set,
+    relation_ids,
+)
 from charmhelpers.core.unitdata import HookData, kv
 from charmhelpers.contrib.openstack.utils import (
     get_os_codename_package,
@@ -40,17 +45,38 @@ from charmhelpers.contrib.openstack.utils import (
 )
 from lib.swift_storage_utils import (
     assess_status,
+    devstore_devices,
+    remember_benchmarks,
+    start_drain,
     REQUIRED_INTERFACES,
-    SWIFT_SVCS,
+    swift_services,
+)
+from lib.swift_storage_services import (
+    start_services,
+    stop_services,
+)
+from lib.swift_storage_benchmark import (
+    benchmark_devices as run_benchmarks,
+    find_outliers,
+    MiB,
+)
+from lib.swift_storage_capacity import (
+    capacity_report,
+    STORAGE_MOUNT_PATH,
+)
+from lib.swift_storage_profiler import (
+    load_traces,
+    summarise,
 )
 from hooks.swift_storage_hooks import (
     CONFIGS,
+    swift_storage_relation_joined,
 )
 
 
 def _get_services():
     """Return a list of services that need to be (un)paused."""
-    services = SWIFT_SVCS[:]
+    services = swift_services()
     # Before Icehouse there was no swift-container-sync
     _os_release = get_os_codename_package("swift-container")
     if CompareOpenStackReleases(_os_release) < "icehouse":
@@ -72,12 +98,14 @@ def get_action_parser(actions_yaml_path, action_name,
 def pause(args):
     """Pause all the swift services.
 
+    Background daemons are stopped first, then the servers once their
+    connections have drained or drain-timeout seconds have passed.
+
     @raises Exception if any services fail to stop
     """
-    for service in args.services:
-        stopped = service_pause(service)
-        if not stopped:
-            raise Exception("{} didn't stop cleanly.".format(service))
+    failed = stop_services(args.services, action_get('drain-timeout'))
+    if failed:
+        raise Exception("{} didn't stop cleanly.".format(", ".join(failed)))
     with HookData()():
         kv().set('unit-paused', True)
     set_os_workload_status(CONFIGS, REQUIRED_INTERFACES,
@@ -87,21 +115,95 @@ def pause(args):
 def resume(args):
     """Resume all the swift services.
 
+    The servers are started first, then the background daemons once the
+    servers listen on their ports.
+
     @raises Exception if any services fail to start
     """
-    for service in args.services:
-        started = service_resume(service)
-        if not started:
-            raise Exception("{} didn't start cleanly.".format(service))
+    failed = start_services(args.services, action_get('listen-timeout'))
+    if failed:
+        raise Exception("{} didn't start cleanly.".format(", ".join(failed)))
     with HookData()():
         kv().set('unit-paused', False)
     set_os_workload_status(CONFIGS, REQUIRED_INTERFACES,
                            charm_func=assess_status)
 
 
+def hook_profile_summary(args):
+    """Summarise the slowest hooks, phases and commands recorded while the
+    profile-hooks option was enabled.
+    """
+    traces = load_traces()
+    if not traces:
+        action_set({'message': 'No hook traces found, is profile-hooks '
+                               'enabled?'})
+        return
+    summary = summarise(traces, limit=action_get('limit'))
+    action_set({'traces': len(traces),
+                'hooks': json.dumps(summary['hooks'], sort_keys=True),
+                'phases': json.dumps(summary['phases'], sort_keys=True),
+                'commands': json.dumps(summary['commands'], sort_keys=True)})
+
+
+def device_capacity(args):
+    """Report the space and inode fill of every active storage device, and
+    suggest ring weight changes evening out the fill across devices.
+    """
+    report = capacity_report(devstore_devices())
+    if not report['devices']:
+        action_set({'message': 'No storage devices found in the devstore'})
+        return
+    action_set({'devices': json.dumps(report['devices'], sort_keys=True),
+                'mean-fill': report['mean-fill'],
+                'mean-inode-fill': report['mean-inode-fill']})
+
+
+def benchmark_devices(args):
+    """Benchmark every active storage device in parallel, flagging devices
+    much slower than the others and keeping the results in the devstore.
+    """
+    devices = devstore_devices()
+    if not devices:
+        action_set({'message': 'No storage devices found in the devstore'})
+        return
+    results = run_benchmarks(
+        {d: os.path.join(STORAGE_MOUNT_PATH, d) for d in devices},
+        size=action_get('size') * MiB, duration=action_get('duration'))
+    outliers = find_outliers(results, action_get('outlier-factor'))
+    remember_benchmarks(results, outliers)
+    action_set({'results': json.dumps(results, sort_keys=True),
+                'outliers': json.dumps(outliers, sort_keys=True)})
+    errors = sorted(d for d, r in results.items() if 'error' in r)
+    if errors:
+        action_fail("Unable to benchmark {}".format(", ".join(errors)))
+
+
+def drain_device(args):
+    """Start moving the partitions of a device off it by publishing a
+    reduced weight for it to the proxy. Running the action again on a
+    draining device reduces its weight by another step.
+    """
+    device = os.path.basename(action_get('device'))
+    try:
+        entry = start_drain(device, action_get('step'))
+    except ValueError as e:
+        action_fail(str(e))
+        return
+    for rid in relation_ids('swift-storage'):
+        swift_storage_relation_joined(rid)
+    action_set({'weight': entry['drain-weight'],
+                'partitions': entry['drain-partitions']})
+    set_os_workload_status(CONFIGS, REQUIRED_INTERFACES,
+                           charm_func=assess_status)
+
+
 # A dictionary of all the defined actions to callables (which take
 # parsed arguments).
-ACTIONS = {"pause": pause, "resume": resume}
+ACTIONS = {"pause": pause, "resume": resume,
+           "hook-profile-summary": hook_profile_summary,
+           "device-capacity": device_capacity,
+           "benchmark-devices": benchmark_devices,
+           "drain-device": drain_device}
 
 
 def main(argv):
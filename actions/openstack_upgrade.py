@@ -29,6 +29,11 @@ def _add_path(path):
 _add_path(_root)
 
 
+from charmhelpers.core.hookenv import (
+    action_get,
+    action_set,
+)
+
 from charmhelpers.contrib.openstack.utils import (
     do_action_openstack_upgrade,
 )
@@ -43,6 +48,17 @@ from lib.swift_storage_utils import (
 )
 
 
+def upgrade_with_timings(configs):
+    """Run the upgrade, reporting the time taken by each phase of a staged
+    upgrade in the action results.
+    """
+    timings = do_openstack_upgrade(configs=configs,
+                                   staged=action_get('staged'))
+    if timings:
+        action_set({'timings.{}'.format(name): seconds
+                    for name, seconds in timings.items()})
+
+
 def openstack_upgrade():
     """Upgrade packages to config-set Openstack version.
 
@@ -52,7 +68,7 @@ def openstack_upgrade():
     on config-changed."""
 
     if (do_action_openstack_upgrade('swift',
-                                    do_openstack_upgrade,
+                                    upgrade_with_timings,
                                     CONFIGS)):
         config_changed()
 
@@ -0,0 +1,135 @@
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Scaling benchmarks for the storage, firewall and relation hooks.
+
+Run with 'make bench'. Each benchmark runs the hook code at increasing
+sizes against a FakeNode and fails if the per-item cost at the largest
+size exceeds the per-item cost at a small size by more than the budget,
+which catches accidental O(N^2) behaviour before release.
+"""
+
+import sys
+import unittest
+
+from mock import MagicMock, patch
+
+from benchmarks.harness import (
+    FakeNode,
+    device_names,
+    format_report,
+    measure,
+    peer_addresses,
+)
+
+# python-apt is only available on Ubuntu, and is not used by the code
+# under benchmark.
+sys.modules['apt'] = MagicMock()
+sys.modules['apt_pkg'] = MagicMock()
+
+with patch('charmhelpers.contrib.hardening.harden.harden') as mock_dec:
+    mock_dec.side_effect = (lambda *dargs, **dkwargs: lambda f:
+                            lambda *args, **kwargs: f(*args, **kwargs))
+    with patch('lib.misc_utils.is_paused') as is_paused:
+        with patch('lib.swift_storage_utils.register_configs') as _:
+            import hooks.swift_storage_hooks as hooks
+
+import lib.swift_storage_utils as swift_utils
+
+DEVICE_SIZES = (4, 24, 60, 240)
+# find_block_devices() only recognises sdb-sdz and vda-vdz.
+GUESS_DEVICE_SIZES = (4, 12, 24, 51)
+PEER_SIZES = (3, 30, 300, 2000)
+RING_SIZES = (2 ** 16, 2 ** 20, 2 ** 24)
+
+# Allowed growth of the per-item cost between the smallest measured size
+# above the baseline and the largest one. Linear code keeps the per-item
+# cost flat or shrinking as fixed overheads are amortised.
+SUBPROCESS_BUDGET = 1.5
+TIME_BUDGET = 3.0
+
+
+class ScaleBenchmark(unittest.TestCase):
+
+    def run_sizes(self, title, sizes, node_args, func):
+        measurements = []
+        for size in sizes:
+            with FakeNode(**node_args(size)):
+                hooks.setup_logging()
+                measurements.append(measure(size, func))
+        sys.stderr.write(format_report(title, measurements) + '\n')
+        return measurements
+
+    def assertScales(self, measurements, attr, budget):
+        """Assert the per-item cost of attr grows within budget."""
+        def per_item(m):
+            return float(getattr(m, attr)) / m.size
+
+        reference, largest = measurements[1], measurements[-1]
+        self.assertLessEqual(
+            per_item(largest), per_item(reference) * budget,
+            '%s per item grew from %.6f at size %d to %.6f at size %d' %
+            (attr, per_item(reference), reference.size, per_item(largest),
+             largest.size))
+
+    def assertLinear(self, measurements):
+        self.assertScales(measurements, 'subprocesses', SUBPROCESS_BUDGET)
+        self.assertScales(measurements, 'duration', TIME_BUDGET)
+
+    def test_setup_storage(self):
+        measurements = self.run_sizes(
+            'setup_storage (devices)', DEVICE_SIZES,
+            lambda n: {'devices': device_names(n),
+                       'config': {'block-device': ' '.join(device_names(n))}},
+            swift_utils.setup_storage)
+        self.assertLinear(measurements)
+
+    def test_setup_storage_guess(self):
+        measurements = self.run_sizes(
+            'setup_storage block-device=guess (devices)', GUESS_DEVICE_SIZES,
+            lambda n: {'devices': device_names(n, guessable=True),
+                       'config': {'block-device': 'guess'}},
+            swift_utils.setup_storage)
+        self.assertLinear(measurements)
+
+    def test_setup_ufw(self):
+        measurements = self.run_sizes(
+            'setup_ufw (peers)', PEER_SIZES,
+            lambda n: {'peers': peer_addresses(n)},
+            swift_utils.setup_ufw)
+        self.assertLinear(measurements)
+
+    def test_swift_storage_relation_changed(self):
+        measurements = self.run_sizes(
+            'swift_storage_relation_changed (peers)', PEER_SIZES,
+            lambda n: {'peers': peer_addresses(n), 'ring_size': 2 ** 16},
+            hooks.swift_storage_relation_changed)
+        self.assertLinear(measurements)
+
+    def test_fetch_swift_rings(self):
+        def fetch():
+            swift_utils.fetch_swift_rings(
+                swift_utils.relation_get('rings_url'))
+
+        measurements = self.run_sizes(
+            'fetch_swift_rings (ring bytes)', RING_SIZES,
+            lambda n: {'ring_size': n}, fetch)
+        counts = set(m.subprocesses for m in measurements)
+        self.assertEqual(len(counts), 1,
+                         'Ring fetch subprocesses vary with ring size')
+        self.assertScales(measurements, 'duration', TIME_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
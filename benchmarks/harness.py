@@ -0,0 +1,343 @@
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fake node environment for the charm scale benchmarks.
+
+The hook code is run unmodified against a temporary root holding a fake
+/proc/partitions, sysfs and unit state, and a directory of shell scripts
+standing in for blkid, lsblk, findmnt, ufw and the juju hook tools. Every
+command the charm runs still forks a real process so that the subprocess
+count and wall time reported by the benchmarks reflect the hook's behaviour
+on a real node.
+"""
+
+import http.server
+import io
+import json
+import os
+import shutil
+import stat
+import string
+import tempfile
+import threading
+import time
+
+import yaml
+
+from mock import patch
+
+import charmhelpers.core.hookenv as hookenv
+import charmhelpers.core.unitdata as unitdata
+
+import lib.swift_storage_log
+from lib.swift_storage_profiler import profiler
+
+_path = os.path.dirname(os.path.realpath(__file__))
+CONFIG_YAML = os.path.abspath(os.path.join(_path, '../config.yaml'))
+
+LOCAL_UNIT = 'swift-storage/0'
+STORAGE_RID = 'swift-storage:1'
+
+FAKE_BINARIES = {
+    'blkid': 'exit 2\n',
+    'lsblk': 'echo "NAME=\\"${2##*/}\\" MOUNTPOINT=\\"\\""\n',
+    'findmnt': 'exit 1\n',
+    'losetup': 'exit 0\n',
+    'mkfs.xfs': 'exit 0\n',
+    'mount': 'exit 0\n',
+    'chown': 'exit 0\n',
+    'chmod': 'exit 0\n',
+    'ufw': ('if [ "$1" = "status" ]; then\n'
+            '    echo "Status: active"\n'
+            'fi\n'),
+    'juju-log': 'exit 0\n',
+    'config-get': 'cat "$FAKE_ROOT/config.json"\n',
+    'unit-get': 'echo \'"10.0.0.1"\'\n',
+    'storage-list': 'echo "[]"\n',
+    'relation-ids': ('f="$FAKE_ROOT/relation-ids/$2.json"\n'
+                     '[ -f "$f" ] && cat "$f" || echo "[]"\n'),
+    'relation-list': ('f="$FAKE_ROOT/relations/$3/units.json"\n'
+                      '[ -f "$f" ] && cat "$f" || echo "[]"\n'),
+    # relation-get --format=json [-r rid] attribute|- [unit]
+    'relation-get': ('rid="$JUJU_RELATION_ID"\n'
+                     'shift\n'
+                     'if [ "$1" = "-r" ]; then rid="$2"; shift 2; fi\n'
+                     'unit="${2:-$JUJU_REMOTE_UNIT}"\n'
+                     'attr="$1"\n'
+                     '[ "$attr" = "-" ] && attr=_all\n'
+                     'f="$FAKE_ROOT/relations/$rid/$unit/$attr.json"\n'
+                     '[ -f "$f" ] && cat "$f" || echo null\n'),
+}
+
+
+def device_names(count, guessable=False):
+    """Return count device names.
+
+    Guessable names match the patterns find_block_devices() looks for in
+    /proc/partitions, which limits them to sdb-sdz and vda-vdz.
+    """
+    letters = string.ascii_lowercase
+    if guessable:
+        names = ['sd' + c for c in letters[1:]] + ['vd' + c for c in letters]
+    else:
+        names = ['sd' + a + b for a in letters for b in letters]
+    if count > len(names):
+        raise ValueError('At most %d devices supported' % len(names))
+    return names[:count]
+
+
+def peer_addresses(count):
+    return ['10.1.%d.%d' % (i // 250, i % 250 + 1) for i in range(count)]
+
+
+def default_config():
+    with open(CONFIG_YAML) as f:
+        options = yaml.safe_load(f)['options']
+    return {k: v.get('default') for k, v in options.items()}
+
+
+class _RingRequestHandler(http.server.SimpleHTTPRequestHandler):
+
+    def translate_path(self, path):
+        return os.path.join(self.server.ring_dir,
+                            os.path.basename(path.split('?')[0]))
+
+    def log_message(self, *args):
+        pass
+
+
+class RingServer(object):
+    """Serve ring files from a temporary directory over local HTTP."""
+
+    def __init__(self, ring_dir):
+        self.server = http.server.HTTPServer(('127.0.0.1', 0),
+                                             _RingRequestHandler)
+        self.server.ring_dir = ring_dir
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeNode(object):
+    """Temporary fake storage node to run hook code against.
+
+    :param devices: names of the block devices present on the node
+    :param peers: addresses of the storage peers published by the proxy
+    :param proxies: number of swift-proxy units related to the node
+    :param ring_size: size in bytes of each ring file served to the node
+    :param config: charm config overrides
+    """
+
+    def __init__(self, devices=(), peers=(), proxies=3, ring_size=0,
+                 config=None):
+        self.devices = list(devices)
+        self.peers = list(peers)
+        self.proxies = proxies
+        self.ring_size = ring_size
+        self.config = default_config()
+        self.config.update(config or {})
+        self.root = None
+        self.ring_server = None
+        self._patches = []
+        self._environ = None
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def _write(self, relpath, content):
+        path = self.path(relpath)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def _write_json(self, relpath, data):
+        return self._write(relpath, json.dumps(data))
+
+    def _install_binaries(self):
+        for name, body in FAKE_BINARIES.items():
+            path = self._write(os.path.join('bin', name),
+                               '#!/bin/sh\n' + body)
+            os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+
+    def _install_block_devices(self):
+        lines = ['major minor  #blocks  name', '']
+        for i, dev in enumerate(self.devices):
+            lines.append('   8 %5d 3907018584 %s' % (i * 16, dev))
+            self._write(os.path.join('sys/class/block', dev, 'size'),
+                        '7814037168\n')
+            self._write(os.path.join('sys/class/block', dev,
+                                     'queue/rotational'), '1\n')
+        self._write('proc/partitions', '\n'.join(lines) + '\n')
+
+    def _install_relations(self):
+        proxies = ['swift-proxy/%d' % i for i in range(self.proxies)]
+        self._write_json('relation-ids/swift-storage.json', [STORAGE_RID])
+        self._write_json(os.path.join('relations', STORAGE_RID,
+                                      'units.json'), proxies)
+        settings = {
+            'rings_url': self.ring_server.url,
+            'swift_hash': 'benchmark-hash',
+            'timestamp': '1550000000.0',
+            'rsync_allowed_hosts': ' '.join(self.peers),
+        }
+        for i, unit in enumerate(proxies):
+            unit_settings = dict(settings,
+                                 **{'private-address': '10.0.0.%d' % (i + 2)})
+            for key, value in unit_settings.items():
+                self._write_json(os.path.join('relations', STORAGE_RID, unit,
+                                              key + '.json'), value)
+            self._write_json(os.path.join('relations', STORAGE_RID, unit,
+                                          '_all.json'), unit_settings)
+
+    def _install_rings(self):
+        ring_dir = self.path('rings')
+        os.makedirs(ring_dir)
+        for server in ('account', 'object', 'container'):
+            with open(os.path.join(ring_dir, server + '.ring.gz'), 'wb') as f:
+                f.write(os.urandom(self.ring_size))
+        os.makedirs(self.path('etc/swift'))
+        return ring_dir
+
+    def _open(self, path, *args, **kwargs):
+        # Redirect reads of node state into the fake root.
+        if isinstance(path, str) and path.startswith(('/proc/', '/sys/',
+                                                      '/etc/default/')):
+            path = self.path(path.lstrip('/'))
+        return io.open(path, *args, **kwargs)
+
+    def _is_block_device(self, path):
+        return os.path.isdir(self.path('sys/class/block',
+                                       os.path.basename(path)))
+
+    def _patch(self, target, new=None, **kwargs):
+        if new is not None:
+            kwargs['new'] = new
+        p = patch(target, **kwargs)
+        p.start()
+        self._patches.append(p)
+
+    def __enter__(self):
+        self.root = tempfile.mkdtemp(prefix='swift-storage-bench')
+        self._install_binaries()
+        self._install_block_devices()
+        self.ring_server = RingServer(self._install_rings()).__enter__()
+        self._install_relations()
+        self._write_json('config.json', self.config)
+        self._write('etc/default/rsync', 'RSYNC_ENABLE=false\n')
+        os.makedirs(self.path('var/lib/juju/swift_storage'))
+
+        self._environ = dict(os.environ)
+        os.environ.update({
+            'PATH': self.path('bin') + os.pathsep + os.environ['PATH'],
+            'FAKE_ROOT': self.root,
+            'CHARM_DIR': self.root,
+            'UNIT_STATE_DB': self.path('unit-state.db'),
+            'JUJU_UNIT_NAME': LOCAL_UNIT,
+            'JUJU_RELATION_ID': STORAGE_RID,
+            'JUJU_REMOTE_UNIT': 'swift-proxy/0',
+            'JUJU_MODEL_UUID': 'benchmark',
+        })
+        for module in ('lib.swift_storage_utils', 'lib.swift_storage_context'):
+            self._patch(module + '.open', self._open, create=True)
+        for module in ('lib.swift_storage_utils', 'lib.misc_utils'):
+            self._patch(module + '.is_block_device', self._is_block_device)
+        self._patch('lib.swift_storage_utils.mkdir', lambda *a, **kw: None)
+        self._patch('lib.swift_storage_utils.fstab_add', lambda *a, **kw: None)
+        self._patch('lib.swift_storage_utils.KV_DB_PATH',
+                    self.path('var/lib/juju/swift_storage/charm_kvdata.db'))
+        self._patch('lib.swift_storage_utils.SWIFT_CONF_DIR',
+                    self.path('etc/swift'))
+        self.reset_caches()
+        return self
+
+    def __exit__(self, *args):
+        lib.swift_storage_log.flush()
+        for p in reversed(self._patches):
+            p.stop()
+        self._patches = []
+        os.environ.clear()
+        os.environ.update(self._environ)
+        self.ring_server.__exit__()
+        self.reset_caches()
+        shutil.rmtree(self.root)
+
+    @staticmethod
+    def reset_caches():
+        """Forget state cached by charmhelpers between hook runs."""
+        hookenv.cache.clear()
+        hookenv._cache_config = None
+        unitdata._KV = None
+
+
+class Measurement(object):
+    """Wall time and subprocesses of a single benchmark run."""
+
+    def __init__(self, size, duration, commands):
+        self.size = size
+        self.duration = duration
+        self.commands = commands
+
+    @property
+    def subprocesses(self):
+        return len(self.commands)
+
+    def by_command(self):
+        counts = {}
+        for cmd in self.commands:
+            name = os.path.basename(cmd['argv'][0])
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+
+def measure(size, func, *args, **kwargs):
+    """Run func, recording its wall time and every subprocess it runs.
+
+    Buffered log messages are flushed inside the measurement since the
+    juju-log calls they result in are part of the cost of a hook.
+    """
+    profiler.enable('benchmark')
+    start = time.time()
+    try:
+        func(*args, **kwargs)
+        lib.swift_storage_log.flush()
+    finally:
+        duration = time.time() - start
+        commands = list(profiler.commands)
+        profiler.disable()
+    return Measurement(size, duration, commands)
+
+
+def format_report(title, measurements):
+    lines = ['', title,
+             '%8s %10s %12s  %s' % ('size', 'seconds', 'subprocesses',
+                                    'commands')]
+    for m in measurements:
+        commands = ' '.join('%s=%d' % (k, v)
+                            for k, v in sorted(m.by_command().items()))
+        lines.append('%8d %10.3f %12d  %s' %
+                     (m.size, m.duration, m.subprocesses, commands))
+    return '\n'.join(lines)
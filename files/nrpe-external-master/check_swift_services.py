@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2019 Canonical
+# All Rights Reserved
+
+"""Check the state of all swift daemons in a single pass.
+
+On systemd the state of every service is read with one 'systemctl show'
+call, otherwise from the swift-init pid files and /proc.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+STATUS_OK = 0
+STATUS_WARN = 1
+STATUS_CRIT = 2
+STATUS_UNKNOWN = 3
+
+PID_DIR = '/var/run/swift'
+SYSTEMD_PROPERTIES = ['Id', 'ActiveState', 'SubState', 'MainPID',
+                      'NRestarts']
+
+
+def init_is_systemd():
+    return os.path.isdir('/run/systemd/system')
+
+
+def parse_systemctl_show(output):
+    """Parse the output of 'systemctl show' for several units.
+
+    @returns list of dicts of property -> value, one per unit
+    """
+    units = []
+    for block in output.strip().split('\n\n'):
+        props = {}
+        for line in block.splitlines():
+            key, sep, value = line.partition('=')
+            if sep:
+                props[key] = value
+        if props:
+            units.append(props)
+    return units
+
+
+def systemd_states(services):
+    """Read the state of services from systemd in one call.
+
+    @returns dict of service -> (running, description, restarts)
+    """
+    units = ['{}.service'.format(s) for s in services]
+    output = subprocess.check_output(
+        ['systemctl', 'show', '--property=' + ','.join(SYSTEMD_PROPERTIES)] +
+        units, universal_newlines=True)
+    states = {}
+    for props in parse_systemctl_show(output):
+        service = props.get('Id', '')
+        if service.endswith('.service'):
+            service = service[:-len('.service')]
+        if service not in services:
+            continue
+        active = props.get('ActiveState', 'unknown')
+        sub = props.get('SubState', 'unknown')
+        try:
+            restarts = int(props['NRestarts'])
+        except (KeyError, ValueError):
+            # NRestarts is only available from systemd 235
+            restarts = None
+        states[service] = (active == 'active' and sub == 'running',
+                           '{} ({})'.format(active, sub), restarts)
+    return states
+
+
+def pid_file(service, pid_dir=PID_DIR):
+    """Return the swift-init pid file of a service, e.g. swift-object ->
+    object-server.pid, swift-object-auditor -> object-auditor.pid.
+    """
+    name = service[len('swift-'):] if service.startswith('swift-') else \
+        service
+    if '-' not in name:
+        name += '-server'
+    return os.path.join(pid_dir, name + '.pid')
+
+
+def pid_states(services, pid_dir=PID_DIR):
+    """Read the state of services from their pid files.
+
+    @returns dict of service -> (running, description, restarts)
+    """
+    states = {}
+    for service in services:
+        try:
+            with open(pid_file(service, pid_dir)) as f:
+                pid = int(f.read().strip())
+        except (IOError, ValueError):
+            states[service] = (False, 'not running (no pid file)', None)
+            continue
+        if os.path.exists('/proc/{}'.format(pid)):
+            states[service] = (True, 'running (pid {})'.format(pid), None)
+        else:
+            states[service] = (False, 'not running (stale pid {})'.format(
+                pid), None)
+    return states
+
+
+def format_perfdata(states):
+    perfdata = []
+    for service in sorted(states):
+        running, _, restarts = states[service]
+        perfdata.append("'{}_up'={};;;0;1".format(service, int(running)))
+        if restarts is not None:
+            perfdata.append("'{}_restarts'={}c".format(service, restarts))
+    return ' '.join(perfdata)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('services', nargs='+', help='Services to check')
+    parser.add_argument('--pid-dir', default=PID_DIR,
+                        help='swift-init pid file directory, used when '
+                             'systemd is not the init system')
+    args = parser.parse_args(argv)
+
+    try:
+        if init_is_systemd():
+            states = systemd_states(args.services)
+        else:
+            states = pid_states(args.services, args.pid_dir)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print('UNKNOWN: unable to read service states: {}'.format(e))
+        return STATUS_UNKNOWN
+
+    missing = [s for s in args.services if s not in states]
+    failed = ['{} is {}'.format(s, states[s][1]) for s in args.services
+              if s in states and not states[s][0]]
+    perfdata = format_perfdata(states)
+    if perfdata:
+        perfdata = ' | ' + perfdata
+    if failed:
+        print('CRITICAL: {}{}'.format(';'.join(failed), perfdata))
+        return STATUS_CRIT
+    if missing:
+        print('UNKNOWN: no state for {}{}'.format(', '.join(missing),
+                                                  perfdata))
+        return STATUS_UNKNOWN
+    print('OK: {} services running{}'.format(len(states), perfdata))
+    return STATUS_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -4,18 +4,101 @@
 # All Rights Reserved
 # Author: Jacek Nykis
 
+import os
 import sys
 import json
-import urllib
+import socket
+import struct
+import threading
+import time
+import urllib.error
+import urllib.request
 import argparse
 import hashlib
+import http.client
 import datetime
+import collections
 
 STATUS_OK = 0
 STATUS_WARN = 1
 STATUS_CRIT = 2
 STATUS_UNKNOWN = 3
 
+# Seconds allowed for a single recon request and for the whole plugin run.
+REQUEST_TIMEOUT = 5
+DEADLINE = 10
+
+# Replication pass history used by the trend checks. One fixed size record
+# is appended per completed replication pass; the file is compacted back to
+# HISTORY_RECORDS records once it holds twice as many.
+HISTORY_FILE = '/var/lib/nagios/swift_storage_replication.dat'
+HISTORY_RECORDS = 1024
+TREND_WINDOW = 6
+# sampled, replication_last, duration, attempted, success, failure, port,
+# replication type index
+HISTORY_RECORD = struct.Struct('<ddfIIIHBx')
+# Stored in place of counters missing from the recon data.
+COUNTER_UNSET = 2 ** 32 - 1
+
+ReplicationPass = collections.namedtuple(
+    'ReplicationPass', ['sampled', 'last', 'duration', 'attempted',
+                        'success', 'failure', 'port', 'repl'])
+
+
+def fetch_json(url, timeout=REQUEST_TIMEOUT):
+    """Fetch and decode a recon endpoint.
+
+    @returns (data, error, latency) where error is None on success
+    """
+    data = None
+    error = None
+    start = time.time()
+    try:
+        data = json.loads(urllib.request.urlopen(url, timeout=timeout).read())
+    except urllib.error.URLError:
+        error = "Can't open url: {}".format(url)
+    except socket.timeout:
+        error = "Timed out reading url: {}".format(url)
+    except (OSError, http.client.HTTPException) as e:
+        error = "Error reading url: {}: {!r}".format(url, e)
+    except ValueError:
+        error = "Can't parse status data"
+    return (data, error, time.time() - start)
+
+
+def fetch_all(urls, timeout=REQUEST_TIMEOUT, deadline=DEADLINE):
+    """Fetch several recon endpoints concurrently.
+
+    Each request is given at most timeout seconds and the whole batch at most
+    deadline seconds; requests still running once the deadline has passed
+    are reported as timed out. Worker threads are daemonic so that a hung
+    server can never stop the plugin from exiting.
+
+    @returns dict of url -> (data, error, latency)
+    """
+    results = {}
+    end = time.time() + deadline
+
+    def _fetch(url):
+        remaining = max(end - time.time(), 0.1)
+        results[url] = fetch_json(url, timeout=min(timeout, remaining))
+
+    threads = []
+    for url in set(urls):
+        thread = threading.Thread(target=_fetch, args=(url,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join(max(end - time.time(), 0))
+
+    for url in urls:
+        if url not in results:
+            results[url] = (None, "Timed out fetching url: {}".format(url),
+                            None)
+    return results
+
 
 def generate_md5(filename):
     with open(filename, 'rb') as f:
@@ -28,19 +111,21 @@ def generate_md5(filename):
     return md5.hexdigest()
 
 
-def check_md5(base_url):
+def md5_urls(base_url):
+    return [base_url + "ringmd5"]
+
+
+def check_md5(base_url, responses=None):
     url = base_url + "ringmd5"
     ringfiles = ["/etc/swift/object.ring.gz",
                  "/etc/swift/account.ring.gz",
                  "/etc/swift/container.ring.gz"]
     results = []
-    try:
-        data = urllib.request.urlopen(url).read()
-        ringmd5_info = json.loads(data)
-    except urllib.error.URLError:
-        return [(STATUS_UNKNOWN, "Can't open url: {}".format(url))]
-    except ValueError:
-        return [(STATUS_UNKNOWN, "Can't parse status data")]
+    if responses is None:
+        responses = fetch_all([url])
+    ringmd5_info, error, _ = responses[url]
+    if error:
+        return [(STATUS_UNKNOWN, error)]
 
     for ringfile in ringfiles:
         try:
@@ -91,19 +176,22 @@ def repl_last_timestamp(repl_info):
     return (delta, repl_failures)
 
 
-def check_replication(base_url, limits):
-    types = ["account", "object", "container"]
+REPLICATION_TYPES = ["account", "object", "container"]
+
+
+def replication_urls(base_url):
+    return [base_url + "replication/" + repl for repl in REPLICATION_TYPES]
+
+
+def check_replication(base_url, limits, responses=None):
     results = []
-    for repl in types:
+    if responses is None:
+        responses = fetch_all(replication_urls(base_url))
+    for repl in REPLICATION_TYPES:
         url = base_url + "replication/" + repl
-        try:
-            data = urllib.request.urlopen(url).read()
-            repl_info = json.loads(data)
-        except urllib.error.URLError:
-            results.append((STATUS_UNKNOWN, "Can't open url: {}".format(url)))
-            continue
-        except ValueError:
-            results.append((STATUS_UNKNOWN, "Can't parse status data"))
+        repl_info, error, _ = responses[url]
+        if error:
+            results.append((STATUS_UNKNOWN, error))
             continue
 
         delta, repl_failures = repl_last_timestamp(repl_info)
@@ -143,43 +231,495 @@ def check_replication(base_url, limits):
         return [(STATUS_OK, "OK")]
 
 
-if __name__ == '__main__':
+def read_history(path, max_records=HISTORY_RECORDS):
+    """Read the most recent replication passes from the history file.
+
+    Only the tail of the file is read; a partially written trailing record
+    is ignored.
+
+    @returns list of ReplicationPass, oldest first
+    """
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            size -= size % HISTORY_RECORD.size
+            offset = max(size - max_records * HISTORY_RECORD.size, 0)
+            f.seek(offset)
+            data = f.read(size - offset)
+    except (IOError, OSError):
+        return []
+
+    passes = []
+    for record in HISTORY_RECORD.iter_unpack(data):
+        sampled, last, duration, attempted, success, failure, port, repl = \
+            record
+        if repl >= len(REPLICATION_TYPES):
+            continue
+        counters = [None if c == COUNTER_UNSET else c
+                    for c in (attempted, success, failure)]
+        passes.append(ReplicationPass(sampled, last, duration, *counters,
+                                      port=port,
+                                      repl=REPLICATION_TYPES[repl]))
+    return passes
+
+
+def append_history(path, passes, max_records=HISTORY_RECORDS):
+    """Append replication passes to the history file.
+
+    Once the file holds twice max_records records it is atomically
+    rewritten with the latest max_records, so appends stay cheap and the
+    file bounded.
+    """
+    def _counter(value):
+        if value is None or not 0 <= value < COUNTER_UNSET:
+            return COUNTER_UNSET
+        return int(value)
+
+    data = b''.join(
+        HISTORY_RECORD.pack(p.sampled, p.last, p.duration,
+                            _counter(p.attempted), _counter(p.success),
+                            _counter(p.failure), p.port,
+                            REPLICATION_TYPES.index(p.repl))
+        for p in passes)
+    with open(path, 'ab') as f:
+        # drop a record left partially written by an interrupted run
+        size = f.seek(0, os.SEEK_END)
+        if size % HISTORY_RECORD.size:
+            f.truncate(size - size % HISTORY_RECORD.size)
+        f.write(data)
+        size = f.tell()
+
+    if size >= 2 * max_records * HISTORY_RECORD.size:
+        with open(path, 'rb') as f:
+            f.seek(size - max_records * HISTORY_RECORD.size)
+            data = f.read(max_records * HISTORY_RECORD.size)
+        tmp = '{}.{}'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, path)
+
+
+def record_replication(base_url, port, responses, history):
+    """Return the replication passes completed since the last recorded one.
+
+    @param history: list of ReplicationPass already recorded
+    """
+    latest = {}
+    for p in history:
+        if p.port == port:
+            latest[p.repl] = p.last
+
+    passes = []
+    now = time.time()
+    for repl in REPLICATION_TYPES:
+        repl_info, error, _ = responses[base_url + "replication/" + repl]
+        if error or not repl_info:
+            continue
+        last = (repl_info.get('replication_last') or
+                repl_info.get('object_replication_last'))
+        if not last or latest.get(repl) == last:
+            continue
+        duration = (repl_info.get('replication_time') or
+                    repl_info.get('object_replication_time'))
+        if duration is None:
+            duration = float('nan')
+        stats = repl_info.get('replication_stats') or {}
+        passes.append(ReplicationPass(now, last, duration,
+                                      stats.get('attempted'),
+                                      stats.get('success'),
+                                      stats.get('failure'), port, repl))
+    return passes
+
+
+def check_trends(history, port, window, args):
+    """Alert on replication failure rate, pass duration growth and
+    success rate drop over the last window passes of each type.
+
+    @param args: namespace with failure_rate, duration_growth and
+                 success_drop (warn, crit) limits, each optional
+    """
+    def _mean(values):
+        return sum(values) / len(values)
+
+    results = []
+    for repl in REPLICATION_TYPES:
+        passes = [p for p in history
+                  if p.port == port and p.repl == repl][-window:]
+        if not passes:
+            continue
+        latest, previous = passes[-1], passes[:-1]
+
+        failures = [p.failure for p in passes if p.failure is not None]
+        if args.failure_rate and failures:
+            results.extend(check_threshold(
+                int(_mean(failures)), args.failure_rate,
+                "'" + repl + "' replication averaging {} failures per "
+                "pass"))
+
+        durations = sorted(p.duration for p in previous
+                           if p.duration == p.duration)
+        if (args.duration_growth and durations and
+                latest.duration == latest.duration):
+            median = durations[len(durations) // 2]
+            if median > 0:
+                growth = int(100 * (latest.duration - median) / median)
+                results.extend(check_threshold(
+                    growth, args.duration_growth,
+                    "'" + repl + "' replication pass duration grew {}%"))
+
+        def _success_rate(p):
+            if p.attempted and p.success is not None:
+                return 100.0 * p.success / p.attempted
+            return None
+
+        rates = [r for r in map(_success_rate, previous) if r is not None]
+        latest_rate = _success_rate(latest)
+        if args.success_drop and rates and latest_rate is not None:
+            drop = int(_mean(rates) - latest_rate)
+            results.extend(check_threshold(
+                drop, args.success_drop,
+                "'" + repl + "' replication success rate dropped {} "
+                "points"))
+    return results or [(STATUS_OK, "OK")]
+
+
+def check_threshold(value, limits, message):
+    """Compare value against a (warn, crit) pair of limits.
+
+    @returns list of (status, message) tuples, empty if below both limits
+    """
+    if value >= limits[1]:
+        return [(STATUS_CRIT, message.format(value))]
+    elif value >= limits[0]:
+        return [(STATUS_WARN, message.format(value))]
+    return []
+
+
+def check_unmounted(base_url, limits, responses=None):
+    url = base_url + "unmounted"
+    if responses is None:
+        responses = fetch_all([url])
+    unmounted, error, _ = responses[url]
+    if error:
+        return [(STATUS_UNKNOWN, error)]
+
+    devices = sorted(d.get('device', '?') for d in unmounted)
+    results = check_threshold(len(devices), limits,
+                              "{} unmounted devices")
+    if results:
+        status, message = results[0]
+        return [(status, "{} ({})".format(message, ', '.join(devices)))]
+    return [(STATUS_OK, "OK")]
+
+
+def check_async(base_url, limits, responses=None):
+    url = base_url + "async"
+    if responses is None:
+        responses = fetch_all([url])
+    async_info, error, _ = responses[url]
+    if error:
+        return [(STATUS_UNKNOWN, error)]
+
+    pendings = async_info.get('async_pending')
+    if pendings is None:
+        return [(STATUS_UNKNOWN, "async pendings counter is NULL "
+                                 "(check syslog)")]
+    return (check_threshold(pendings, limits, "{} async pendings") or
+            [(STATUS_OK, "OK")])
+
+
+def check_diskusage(base_url, limits, responses=None):
+    """Check per-device fill and the skew between fullest and emptiest disk.
+
+    @param limits: (fill_warn, fill_crit, skew_warn, skew_crit) in percent
+    """
+    url = base_url + "diskusage"
+    if responses is None:
+        responses = fetch_all([url])
+    diskusage, error, _ = responses[url]
+    if error:
+        return [(STATUS_UNKNOWN, error)]
+
+    fill = {}
+    for disk in diskusage:
+        # unmounted or errored devices are reported by check_unmounted
+        if disk.get('mounted') is not True or not disk.get('size'):
+            continue
+        fill[disk['device']] = 100.0 * disk['used'] / disk['size']
+
+    results = []
+    for device in sorted(fill):
+        results.extend(check_threshold(
+            int(fill[device]), limits[:2],
+            "device " + device + " is {}% full"))
+    if len(fill) > 1:
+        skew = int(max(fill.values()) - min(fill.values()))
+        results.extend(check_threshold(skew, limits[2:],
+                                       "disk fill skew is {}%"))
+    return results or [(STATUS_OK, "OK")]
+
+
+def check_quarantined(base_url, limits, responses=None):
+    url = base_url + "quarantined"
+    if responses is None:
+        responses = fetch_all([url])
+    quarantined, error, _ = responses[url]
+    if error:
+        return [(STATUS_UNKNOWN, error)]
+
+    results = []
+    for kind in ('objects', 'containers', 'accounts'):
+        results.extend(check_threshold(quarantined.get(kind) or 0, limits,
+                                       "{} quarantined " + kind))
+    return results or [(STATUS_OK, "OK")]
+
+
+def check_driveaudit(base_url, limits, responses=None):
+    url = base_url + "driveaudit"
+    if responses is None:
+        responses = fetch_all([url])
+    driveaudit, error, _ = responses[url]
+    if error:
+        return [(STATUS_UNKNOWN, error)]
+
+    errors = driveaudit.get('drive_audit_errors')
+    if errors is None:
+        # swift-drive-audit has never run on this node
+        return [(STATUS_OK, "OK")]
+    return (check_threshold(errors, limits, "{} drive audit errors") or
+            [(STATUS_OK, "OK")])
+
+
+def sharding_progress(sharding_info):
+    """Summarise the container sharder recon stats.
+
+    @returns dict of counter -> value, 0 for counters swift did not report
+    """
+    stats = (sharding_info.get('sharding_stats') or {}).get('sharding') or {}
+    in_progress = (stats.get('sharding_in_progress') or {}).get('all') or []
+    cleaved = stats.get('cleaved') or {}
+    return {
+        'in_progress': len(in_progress),
+        'candidates': (stats.get('sharding_candidates') or {}).get(
+            'found') or 0,
+        'cleaved': cleaved.get('success') or 0,
+        'cleave_failures': cleaved.get('failure') or 0,
+    }
+
+
+def check_sharding(base_url, limits, responses=None):
+    """Check the time since the last container sharder pass and report
+    cleave failures.
+
+    @param limits: (lag_warn, lag_crit) in seconds
+    """
+    url = base_url + "sharding"
+    if responses is None:
+        responses = fetch_all([url])
+    sharding_info, error, _ = responses[url]
+    if error:
+        return [(STATUS_UNKNOWN, error)]
+
+    last = sharding_info.get('sharding_last')
+    if not last:
+        return [(STATUS_CRIT, "container sharding not running "
+                              "(check syslog)")]
+    results = check_threshold(int(time.time() - last), limits,
+                              "container sharding lag is {} seconds")
+    failures = sharding_progress(sharding_info)['cleave_failures']
+    if failures:
+        results.append((STATUS_WARN,
+                        "{} container cleave failures".format(failures)))
+    return results or [(STATUS_OK, "OK")]
+
+
+def sharding_perfdata(base_url, responses):
+    """Render container sharding progress as nagios perfdata."""
+    sharding_info, error, _ = responses[base_url + "sharding"]
+    if error:
+        return ''
+    progress = sharding_progress(sharding_info)
+    return ' '.join("'sharding_{}'={};;;0".format(counter, progress[counter])
+                    for counter in sorted(progress))
+
+
+# Checks of node wide recon data, which only need querying on one server.
+# List of (argument name, check function, recon endpoint).
+NODE_CHECKS = [
+    ('check_unmounted', check_unmounted, 'unmounted'),
+    ('check_async', check_async, 'async'),
+    ('check_diskusage', check_diskusage, 'diskusage'),
+    ('check_quarantined', check_quarantined, 'quarantined'),
+    ('check_driveaudit', check_driveaudit, 'driveaudit'),
+    ('check_sharding', check_sharding, 'sharding'),
+]
+
+
+def format_perfdata(responses, base_urls):
+    """Render per-endpoint latency as nagios perfdata."""
+    perfdata = []
+    for base_url, label in base_urls:
+        for url in sorted(u for u in responses if u.startswith(base_url)):
+            latency = responses[url][2]
+            if latency is None:
+                continue
+            endpoint = url[len(base_url):].replace('/', '_')
+            perfdata.append("'{}_{}'={:.3f}s;;;0".format(label, endpoint,
+                                                         latency))
+    return ' '.join(perfdata)
+
+
+def main():
     parser = argparse.ArgumentParser(description='Check swift-storage health')
     parser.add_argument('-H', '--host', dest='host', default='localhost',
                         help='Hostname to query')
-    parser.add_argument('-p', '--port', dest='port', default='6000', type=int,
-                        help='Port number')
+    parser.add_argument('-p', '--port', dest='ports', default=[6000],
+                        type=int, nargs='+',
+                        help='Port number(s) of the servers to query')
     parser.add_argument('-r', '--replication', dest='check_replication',
                         type=int, nargs=4, help='Check replication status',
                         metavar=('lag_warn', 'lag_crit', 'failures_warn',
                                  'failures_crit'))
     parser.add_argument('-m', '--md5', dest='check_md5', action='store_true',
                         help='Compare server rings md5sum with local copy')
+    parser.add_argument('-u', '--unmounted', dest='check_unmounted',
+                        type=int, nargs=2, metavar=('warn', 'crit'),
+                        help='Check number of unmounted devices')
+    parser.add_argument('-a', '--async', dest='check_async',
+                        type=int, nargs=2, metavar=('warn', 'crit'),
+                        help='Check number of async pendings')
+    parser.add_argument('-d', '--diskusage', dest='check_diskusage',
+                        type=int, nargs=4,
+                        metavar=('fill_warn', 'fill_crit', 'skew_warn',
+                                 'skew_crit'),
+                        help='Check per-device fill and fill skew between '
+                             'devices (percent)')
+    parser.add_argument('-q', '--quarantined', dest='check_quarantined',
+                        type=int, nargs=2, metavar=('warn', 'crit'),
+                        help='Check number of quarantined objects, '
+                             'containers and accounts')
+    parser.add_argument('--driveaudit', dest='check_driveaudit',
+                        type=int, nargs=2, metavar=('warn', 'crit'),
+                        help='Check number of drive audit errors')
+    parser.add_argument('--sharding', dest='check_sharding', type=int,
+                        nargs=2, metavar=('lag_warn', 'lag_crit'),
+                        help='Check time since the last container sharder '
+                             'pass (seconds) and report sharding progress')
+    parser.add_argument('--failure-rate', dest='failure_rate', type=int,
+                        nargs=2, metavar=('warn', 'crit'),
+                        help='Check mean replication failures per pass')
+    parser.add_argument('--duration-growth', dest='duration_growth',
+                        type=int, nargs=2, metavar=('warn', 'crit'),
+                        help='Check growth of the last replication pass '
+                             'duration over the median (percent)')
+    parser.add_argument('--success-drop', dest='success_drop', type=int,
+                        nargs=2, metavar=('warn', 'crit'),
+                        help='Check drop of the last replication pass '
+                             'success rate below the mean (percent points)')
+    parser.add_argument('--window', dest='window', type=int,
+                        default=TREND_WINDOW,
+                        help='Number of replication passes the trend '
+                             'checks consider')
+    parser.add_argument('--history', dest='history', default=HISTORY_FILE,
+                        help='Replication pass history file')
+    parser.add_argument('-t', '--timeout', dest='deadline', type=float,
+                        default=DEADLINE,
+                        help='Seconds allowed for all recon requests')
+    parser.add_argument('--request-timeout', dest='request_timeout',
+                        type=float, default=REQUEST_TIMEOUT,
+                        help='Seconds allowed for each recon request')
     args = parser.parse_args()
 
-    if not args.check_replication and not args.check_md5:
-        print('You must use -r or -m switch')
+    node_checks = [(check, endpoint, getattr(args, name))
+                   for name, check, endpoint in NODE_CHECKS
+                   if getattr(args, name)]
+    check_trend = (args.failure_rate or args.duration_growth or
+                   args.success_drop)
+    if (not args.check_replication and not args.check_md5 and
+            not node_checks and not check_trend):
+        print('You must use at least one of the -r, -m, -u, -a, -d, -q, '
+              '--driveaudit, --sharding, --failure-rate, --duration-growth '
+              'or --success-drop switches')
         sys.exit(STATUS_UNKNOWN)
 
-    base_url = "http://{}:{}/recon/".format(args.host, args.port)
+    ports = sorted(set(args.ports), key=args.ports.index)
+    base_urls = [("http://{}:{}/recon/".format(args.host, port), str(port))
+                 for port in ports]
+    urls = []
+    for base_url, _ in base_urls:
+        if args.check_replication or check_trend:
+            urls.extend(replication_urls(base_url))
+        if args.check_md5:
+            urls.extend(md5_urls(base_url))
+    for _, endpoint, _ in node_checks:
+        urls.append(base_urls[0][0] + endpoint)
+    responses = fetch_all(urls, timeout=args.request_timeout,
+                          deadline=args.deadline)
+
     results = []
-    if args.check_replication:
-        results.extend(check_replication(base_url, args.check_replication))
-    if args.check_md5:
-        results.extend(check_md5(base_url))
+    if check_trend:
+        history = read_history(args.history)
+        passes = []
+        for base_url, port in base_urls:
+            passes.extend(record_replication(base_url, int(port), responses,
+                                             history))
+        if passes:
+            try:
+                append_history(args.history, passes)
+            except (IOError, OSError) as e:
+                results.append((STATUS_UNKNOWN,
+                                "Can't write replication history: "
+                                "{}".format(e)))
+            history.extend(passes)
+
+    for base_url, port in base_urls:
+        port_results = []
+        if args.check_replication:
+            port_results.extend(check_replication(base_url,
+                                                  args.check_replication,
+                                                  responses))
+        if args.check_md5:
+            port_results.extend(check_md5(base_url, responses))
+        if check_trend:
+            if not args.check_replication:
+                # otherwise already reported by check_replication
+                port_results.extend(
+                    (STATUS_UNKNOWN, responses[url][1])
+                    for url in replication_urls(base_url)
+                    if responses[url][1])
+            port_results.extend(check_trends(history, int(port), args.window,
+                                             args))
+        if len(base_urls) > 1:
+            port_results = [(status, "port {}: {}".format(port, msg))
+                            for status, msg in port_results]
+        results.extend(port_results)
+
+    for check, _, limits in node_checks:
+        results.extend(check(base_urls[0][0], limits, responses))
+
+    perfdata = format_perfdata(responses, base_urls)
+    if args.check_sharding:
+        perfdata = ' '.join(p for p in (
+            perfdata, sharding_perfdata(base_urls[0][0], responses)) if p)
+    if perfdata:
+        perfdata = ' | ' + perfdata
 
     crits = ';'.join([i[1] for i in results if i[0] == STATUS_CRIT])
     warns = ';'.join([i[1] for i in results if i[0] == STATUS_WARN])
     unknowns = ';'.join([i[1] for i in results if i[0] == STATUS_UNKNOWN])
     if crits:
-        print("CRITICAL: {}".format(crits))
+        print("CRITICAL: {}{}".format(crits, perfdata))
         sys.exit(STATUS_CRIT)
     elif warns:
-        print("WARNING: {}".format(warns))
+        print("WARNING: {}{}".format(warns, perfdata))
         sys.exit(STATUS_WARN)
     elif unknowns:
-        print("UNKNOWN: {}".format(unknowns))
+        print("UNKNOWN: {}{}".format(unknowns, perfdata))
         sys.exit(STATUS_UNKNOWN)
     else:
-        print("OK")
+        print("OK{}".format(perfdata))
         sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
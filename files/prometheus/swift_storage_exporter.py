@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Write swift-storage node metrics in the node_exporter textfile format.
+
+Run periodically from the systemd timer installed by the swift-storage
+charm. The output file is replaced atomically so that node_exporter never
+reads a partially written file.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import sys
+import tempfile
+import urllib.error
+import urllib.request
+
+REQUEST_TIMEOUT = 5
+OUTPUT_FILE = 'swift_storage.prom'
+DEVSTORE = '/var/lib/juju/swift_storage/charm_kvdata.db'
+HOOK_STATS = '/var/lib/juju/swift_storage/hook-stats.json'
+RING_DIR = '/etc/swift'
+REPLICATION_TYPES = ['account', 'container', 'object']
+REPLICATION_STATS = ['attempted', 'success', 'failure']
+
+
+class Metrics(object):
+    """Collection of metric samples grouped by metric name."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, name, value, help_text, mtype='gauge', **labels):
+        if value is None:
+            return
+        metric = self.metrics.setdefault(name, {'help': help_text,
+                                                'type': mtype,
+                                                'samples': []})
+        metric['samples'].append((labels, value))
+
+    def render(self):
+        lines = []
+        for name in sorted(self.metrics):
+            metric = self.metrics[name]
+            lines.append('# HELP {} {}'.format(name, metric['help']))
+            lines.append('# TYPE {} {}'.format(name, metric['type']))
+            for labels, value in metric['samples']:
+                if labels:
+                    label_str = ','.join(
+                        '{}="{}"'.format(k, str(labels[k]).replace('"', r'\"'))
+                        for k in sorted(labels))
+                    lines.append('{}{{{}}} {}'.format(name, label_str,
+                                                      float(value)))
+                else:
+                    lines.append('{} {}'.format(name, float(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def fetch_json(url, timeout=REQUEST_TIMEOUT):
+    """Fetch and decode a recon endpoint, returning None on any error."""
+    try:
+        data = urllib.request.urlopen(url, timeout=timeout).read()
+        return json.loads(data.decode('utf-8'))
+    except (urllib.error.URLError, socket.timeout, ValueError):
+        return None
+
+
+def generate_md5(filename):
+    with open(filename, 'rb') as f:
+        md5 = hashlib.md5()
+        while True:
+            buffer = f.read(2 ** 20)
+            if not buffer:
+                break
+            md5.update(buffer)
+    return md5.hexdigest()
+
+
+def collect_replication(metrics, base_url):
+    for repl in REPLICATION_TYPES:
+        info = fetch_json(base_url + 'replication/' + repl)
+        metrics.add('swift_storage_recon_up', int(info is not None),
+                    'Whether the recon endpoint could be read',
+                    endpoint='replication/' + repl)
+        if not info:
+            continue
+        last = (info.get('replication_last') or
+                info.get('object_replication_last'))
+        duration = (info.get('replication_time') or
+                    info.get('object_replication_time'))
+        metrics.add('swift_storage_replication_last_timestamp_seconds', last,
+                    'Time the last replication pass completed', type=repl)
+        metrics.add('swift_storage_replication_duration_seconds', duration,
+                    'Duration of the last replication pass', type=repl)
+        stats = info.get('replication_stats') or {}
+        for stat in REPLICATION_STATS:
+            metrics.add('swift_storage_replication_stats', stats.get(stat),
+                        'Replication counters of the last pass',
+                        type=repl, stat=stat)
+
+
+def collect_async(metrics, base_url):
+    info = fetch_json(base_url + 'async')
+    metrics.add('swift_storage_recon_up', int(info is not None),
+                'Whether the recon endpoint could be read',
+                endpoint='async')
+    if info:
+        metrics.add('swift_storage_async_pending', info.get('async_pending'),
+                    'Number of async pending container updates')
+
+
+def collect_diskusage(metrics, base_url):
+    info = fetch_json(base_url + 'diskusage')
+    metrics.add('swift_storage_recon_up', int(info is not None),
+                'Whether the recon endpoint could be read',
+                endpoint='diskusage')
+    for disk in info or []:
+        device = disk.get('device')
+        mounted = disk.get('mounted') is True
+        metrics.add('swift_storage_device_mounted', int(mounted),
+                    'Whether the device is mounted', device=device)
+        if not mounted:
+            continue
+        for key in ('size', 'used', 'avail'):
+            metrics.add('swift_storage_device_{}_bytes'.format(key),
+                        disk.get(key),
+                        'Device {} in bytes'.format(key), device=device)
+
+
+def collect_ringmd5(metrics, base_url, ring_dir=RING_DIR):
+    info = fetch_json(base_url + 'ringmd5')
+    metrics.add('swift_storage_recon_up', int(info is not None),
+                'Whether the recon endpoint could be read',
+                endpoint='ringmd5')
+    if not info:
+        return
+    for ringfile in sorted(info):
+        local = os.path.join(ring_dir, os.path.basename(ringfile))
+        try:
+            match = int(generate_md5(local) == info[ringfile])
+        except IOError:
+            match = 0
+        metrics.add('swift_storage_ring_md5_match', match,
+                    'Whether the local ring matches the one loaded by the '
+                    'server', ring=os.path.basename(ringfile))
+
+
+def collect_devstore(metrics, path=DEVSTORE):
+    """Report the devices recorded in the charm devstore."""
+    if not os.path.exists(path):
+        return
+    try:
+        conn = sqlite3.connect(path)
+        try:
+            row = conn.execute("SELECT data FROM kv WHERE key = 'devices'"
+                               ).fetchone()
+        finally:
+            conn.close()
+        # the charm stores the devstore JSON encoded in the JSON encoded kv
+        # store, as devstore_safe_load() expects it
+        devstore = json.loads(row[0]) if row else None
+        devstore = json.loads(devstore) if devstore else {}
+    except (sqlite3.Error, TypeError, ValueError):
+        return
+    if not isinstance(devstore, dict):
+        return
+    for key in sorted(devstore):
+        status = devstore[key].get('status') or 'unknown'
+        metrics.add('swift_storage_devstore_device_active',
+                    int(status == 'active'),
+                    'Whether the device is active in the charm devstore',
+                    device=key.split('@')[0], status=status)
+
+
+def collect_hook_stats(metrics, path=HOOK_STATS):
+    try:
+        with open(path) as f:
+            stats = json.load(f)
+    except (IOError, ValueError):
+        return
+    for hook in sorted(stats):
+        metrics.add('swift_storage_hook_duration_seconds',
+                    stats[hook].get('duration'),
+                    'Duration of the last run of the charm hook', hook=hook)
+        metrics.add('swift_storage_hook_last_run_timestamp_seconds',
+                    stats[hook].get('timestamp'),
+                    'Time the charm hook last ran', hook=hook)
+
+
+def write_textfile(content, output_dir, filename=OUTPUT_FILE):
+    """Atomically replace output_dir/filename with content."""
+    fd, tmp = tempfile.mkstemp(dir=output_dir, prefix='.' + filename)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, os.path.join(output_dir, filename))
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def collect(host, port, devstore=DEVSTORE, hook_stats=HOOK_STATS,
+            ring_dir=RING_DIR):
+    metrics = Metrics()
+    base_url = 'http://{}:{}/recon/'.format(host, port)
+    collect_replication(metrics, base_url)
+    collect_async(metrics, base_url)
+    collect_diskusage(metrics, base_url)
+    collect_ringmd5(metrics, base_url, ring_dir)
+    collect_devstore(metrics, devstore)
+    collect_hook_stats(metrics, hook_stats)
+    return metrics
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-o', '--output-dir', required=True,
+                        help='node_exporter textfile collector directory')
+    parser.add_argument('-H', '--host', default='localhost',
+                        help='Hostname of the swift servers')
+    parser.add_argument('-p', '--port', default=6000, type=int,
+                        help='Port of a swift server with recon enabled')
+    parser.add_argument('--devstore', default=DEVSTORE,
+                        help='Path to the charm devstore database')
+    parser.add_argument('--hook-stats', default=HOOK_STATS,
+                        help='Path to the charm hook statistics')
+    args = parser.parse_args(argv)
+
+    metrics = collect(args.host, args.port, args.devstore, args.hook_stats)
+    write_textfile(metrics.render(), args.output_dir)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
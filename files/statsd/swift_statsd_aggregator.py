@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local statsd pre-aggregator for the swift storage daemons.
+
+Swift daemons send every metric sample as its own UDP packet. This sidecar
+receives them on localhost, sums counters, keeps the last value of gauges and
+summarises timers over a flush interval, then forwards the aggregates
+upstream in a few multi-metric packets.
+"""
+
+import argparse
+import asyncio
+import logging
+import socket
+import sys
+
+DEFAULT_FLUSH_INTERVAL = 10
+# Keep forwarded datagrams under a typical ethernet MTU.
+MAX_PACKET_SIZE = 1432
+
+
+class Aggregator(object):
+    """Accumulate statsd samples between two flushes."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+
+    def add_line(self, line):
+        """Parse a single 'name:value|type[|@rate]' statsd line.
+
+        Malformed lines are ignored.
+        """
+        try:
+            name, rest = line.split(':', 1)
+            fields = rest.split('|')
+            value = float(fields[0])
+            mtype = fields[1]
+            rate = 1.0
+            if len(fields) > 2 and fields[2].startswith('@'):
+                rate = float(fields[2][1:]) or 1.0
+        except (ValueError, IndexError):
+            return False
+
+        if mtype == 'c':
+            self.counters[name] = self.counters.get(name, 0.0) + value / rate
+        elif mtype == 'ms':
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1.0 / rate, 1, value, value, value]
+            else:
+                timer[0] += 1.0 / rate
+                timer[1] += 1
+                timer[2] += value
+                timer[3] = min(timer[3], value)
+                timer[4] = max(timer[4], value)
+        elif mtype == 'g':
+            self.gauges[name] = value
+        else:
+            return False
+        return True
+
+    def add_packet(self, data):
+        for line in data.decode('utf-8', 'replace').splitlines():
+            if line:
+                self.add_line(line)
+
+    def lines(self):
+        """Render the accumulated samples as statsd lines."""
+        lines = []
+        for name in sorted(self.counters):
+            lines.append('{}:{:g}|c'.format(name, self.counters[name]))
+        for name in sorted(self.gauges):
+            lines.append('{}:{:g}|g'.format(name, self.gauges[name]))
+        for name in sorted(self.timers):
+            count, samples, total, lowest, highest = self.timers[name]
+            # count is scaled up by the sample rates, the mean is over the
+            # samples actually received.
+            lines.append('{}.count:{:g}|c'.format(name, count))
+            lines.append('{}.mean:{:g}|g'.format(name, total / samples))
+            lines.append('{}.lower:{:g}|g'.format(name, lowest))
+            lines.append('{}.upper:{:g}|g'.format(name, highest))
+        return lines
+
+    def packets(self, max_size=MAX_PACKET_SIZE):
+        """Group lines into newline separated datagrams of at most max_size
+        bytes.
+        """
+        packet = []
+        size = 0
+        for line in self.lines():
+            data = line.encode('utf-8')
+            if packet and size + len(data) + 1 > max_size:
+                yield b'\n'.join(packet)
+                packet = []
+                size = 0
+            packet.append(data)
+            size += len(data) + 1
+        if packet:
+            yield b'\n'.join(packet)
+
+
+class StatsdProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, aggregator):
+        self.aggregator = aggregator
+
+    def datagram_received(self, data, addr):
+        self.aggregator.add_packet(data)
+
+
+def flush(loop, aggregator, upstream, sock, interval):
+    """Forward aggregates upstream and schedule the next flush."""
+    packets = list(aggregator.packets())
+    aggregator.reset()
+    for packet in packets:
+        try:
+            sock.sendto(packet, upstream)
+        except OSError as exc:
+            logging.warning('Failed to forward metrics to %s:%s: %s',
+                            upstream[0], upstream[1], exc)
+            break
+    loop.call_later(interval, flush, loop, aggregator, upstream, sock,
+                    interval)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--listen-host', default='127.0.0.1')
+    parser.add_argument('--listen-port', type=int, default=8125)
+    parser.add_argument('--upstream-host', required=True)
+    parser.add_argument('--upstream-port', type=int, default=8125)
+    parser.add_argument('--flush-interval', type=float,
+                        default=DEFAULT_FLUSH_INTERVAL)
+    args = parser.parse_args(argv)
+
+    upstream = socket.getaddrinfo(args.upstream_host, args.upstream_port,
+                                  type=socket.SOCK_DGRAM)[0]
+    sock = socket.socket(upstream[0], socket.SOCK_DGRAM)
+    sock.setblocking(False)
+
+    aggregator = Aggregator()
+    loop = asyncio.get_event_loop()
+    listen = loop.create_datagram_endpoint(
+        lambda: StatsdProtocol(aggregator),
+        local_addr=(args.listen_host, args.listen_port))
+    transport, _ = loop.run_until_complete(listen)
+    loop.call_later(args.flush_interval, flush, loop, aggregator,
+                    upstream[4], sock, args.flush_interval)
+    try:
+        loop.run_forever()
+    finally:
+        transport.close()
+        loop.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -16,6 +16,8 @@
 
 import base64
 import copy
+import functools
+import hashlib
 import json
 import os
 import shutil
@@ -23,6 +25,7 @@ import sys
 import socket
 import subprocess
 import tempfile
+import time
 
 from subprocess import CalledProcessError
 
@@ -40,26 +43,55 @@ _add_path(_root)
 
 from lib.swift_storage_utils import (
     PACKAGES,
-    RESTART_MAP,
     SWIFT_SVCS,
     do_openstack_upgrade,
     ensure_swift_directories,
     fetch_swift_rings,
     register_configs,
+    restart_map,
     save_script_rc,
     setup_storage,
     assert_charm_supports_ipv6,
     setup_rsync,
     remember_devices,
+    device_classes,
+    device_metadata,
+    devstore_devices,
+    drain_weights,
+    encode_device_metadata,
+    ring_devices,
+    object_device_ports,
+    update_drains,
     REQUIRED_INTERFACES,
     assess_status,
     ensure_devs_tracked,
     VERSION_PACKAGE,
     setup_ufw,
+    storage_ports,
     revoke_access,
+    configure_prometheus_exporter,
+    configure_statsd_aggregator,
+    record_hook_duration,
+    report_slow_devices,
+    report_worker_plan,
+    storage_device_names,
+    swift_services,
+    configure_replication_servers,
 )
 
 from lib.misc_utils import pause_aware_restart_on_change
+from lib.swift_storage_context import (
+    parse_storage_policies,
+    replication_ip,
+    replication_servers_enabled,
+)
+from lib.swift_storage_profiler import phase, profiler
+
+import lib.misc_utils
+import lib.swift_storage_context
+import lib.swift_storage_log
+import lib.swift_storage_services
+import lib.swift_storage_utils
 
 from charmhelpers.core.hookenv import (
     Hooks, UnregisteredHookError,
@@ -93,6 +125,7 @@ from charmhelpers.core.sysctl import create as create_sysctl
 
 from charmhelpers.payload.execd import execd_preinstall
 
+from charmhelpers.contrib.openstack import templating
 from charmhelpers.contrib.openstack.utils import (
     configure_installation_source,
     openstack_upgrade_available,
@@ -122,6 +155,17 @@ NAGIOS_PLUGINS = '/usr/local/lib/nagios/plugins'
 SUDOERS_D = '/etc/sudoers.d'
 STORAGE_MOUNT_PATH = '/srv/node'
 UFW_DIR = '/etc/ufw'
+# (name, description) of the recon checks enabled by the matching
+# nagios-<name>-check-params option
+NRPE_RECON_CHECKS = [
+    ('unmounted', 'unmounted devices'),
+    ('async', 'async pendings'),
+    ('diskusage', 'disk usage and fill skew'),
+    ('quarantined', 'quarantined objects'),
+    ('driveaudit', 'drive audit errors'),
+    ('replication-trend', 'replication trends'),
+    ('sharding', 'container sharding'),
+]
 
 
 def add_ufw_gre_rule(ufw_rules_path):
@@ -209,13 +253,14 @@ def install():
 
 
 @hooks.hook('config-changed')
-@pause_aware_restart_on_change(RESTART_MAP)
+@pause_aware_restart_on_change(restart_map)
 @harden()
 def config_changed():
-    if config('enable-firewall'):
-        initialize_ufw()
-    else:
-        ufw.disable()
+    with phase('initialize_ufw'):
+        if config('enable-firewall'):
+            initialize_ufw()
+        else:
+            ufw.disable()
 
     if config('ephemeral-unmount'):
         umount(config('ephemeral-unmount'), persist=True)
@@ -230,21 +275,32 @@ def config_changed():
     if not config('action-managed-upgrade') and \
             openstack_upgrade_available('swift'):
         status_set('maintenance', 'Running openstack upgrade')
-        do_openstack_upgrade(configs=CONFIGS)
+        with phase('openstack_upgrade'):
+            do_openstack_upgrade(configs=CONFIGS)
 
     install_vaultlocker()
 
-    configure_storage()
+    with phase('configure_storage'):
+        configure_storage()
+
+    configure_statsd_aggregator()
+    configure_replication_servers()
 
-    CONFIGS.write_all()
+    with phase('write_configs'):
+        CONFIGS.write_all()
 
     save_script_rc()
     if relations_of_type('nrpe-external-master'):
-        update_nrpe_config()
+        with phase('update_nrpe_config'):
+            update_nrpe_config()
+
+    configure_prometheus_exporter()
 
     sysctl_dict = config('sysctl')
     if sysctl_dict:
-        create_sysctl(sysctl_dict, '/etc/sysctl.d/50-swift-storage-charm.conf')
+        with phase('create_sysctl'):
+            create_sysctl(sysctl_dict,
+                          '/etc/sysctl.d/50-swift-storage-charm.conf')
 
     add_to_updatedb_prunepath(STORAGE_MOUNT_PATH)
 
@@ -279,13 +335,40 @@ def swift_storage_relation_joined(rid=None):
         'container_port': config('container-server-port'),
         'account_port': config('account-server-port'),
     }
+    # without replication servers the proxy falls back to the server ports
+    rel_settings['replication_ip'] = replication_ip()
+    for server in ('object', 'container', 'account'):
+        rel_settings['{}_replication_port'.format(server)] = (
+            config('{}-replication-port'.format(server))
+            if replication_servers_enabled() else
+            config('{}-server-port'.format(server)))
 
     db = kv()
-    devs = db.get('prepared-devices', [])
-    devs = [os.path.basename(d) for d in devs]
+    # drained devices stay prepared so that they are not reformatted, but
+    # are no longer offered to the rings
+    drained = devstore_devices(status='inactive')
+    prepared = [d for d in db.get('prepared-devices', [])
+                if os.path.basename(d) not in drained]
+    devs = [os.path.basename(d) for d in prepared]
     rel_settings['device'] = ':'.join(devs)
     # Keep a reference of devices we are adding to the ring
     remember_devices(devs)
+    for ring, ring_devs in ring_devices(device_classes(prepared)).items():
+        rel_settings['{}_devices'.format(ring)] = ':'.join(ring_devs)
+    rel_settings['device_info'] = encode_device_metadata(
+        device_metadata(prepared))
+    weights = drain_weights()
+    rel_settings['device_weight'] = (encode_device_metadata(weights)
+                                     if weights else None)
+    rel_settings['object_device_ports'] = None
+    if config('object-servers-per-port'):
+        allocated = set(db.get('object-device-ports', {}).values())
+        device_ports = object_device_ports(devs)
+        rel_settings['object_device_ports'] = encode_device_metadata(
+            device_ports)
+        # open the ports of newly added devices before they reach the rings
+        if set(device_ports.values()) - allocated:
+            setup_ufw()
 
     rel_settings['private-address'] = get_relation_ip('swift-storage')
 
@@ -293,7 +376,7 @@ def swift_storage_relation_joined(rid=None):
 
 
 @hooks.hook('swift-storage-relation-changed')
-@pause_aware_restart_on_change(RESTART_MAP)
+@pause_aware_restart_on_change(restart_map)
 def swift_storage_relation_changed():
     setup_ufw()
     rings_url = relation_get('rings_url')
@@ -311,7 +394,12 @@ def swift_storage_relation_changed():
     #              message and hope that the good rings_url us waiting to be
     #              consumed.
     try:
-        fetch_swift_rings(rings_url)
+        policies = parse_storage_policies(relation_get('storage_policies'))
+    except ValueError as e:
+        log("Ignoring storage_policies: {}".format(e), level=WARNING)
+        policies = []
+    try:
+        fetch_swift_rings(rings_url, [index for index, _ in policies])
     except CalledProcessError:
         log("Failed to sync rings from {} - no longer available from that "
             "unit?".format(rings_url), level=WARNING)
@@ -319,12 +407,9 @@ def swift_storage_relation_changed():
 
 @hooks.hook('swift-storage-relation-departed')
 def swift_storage_relation_departed():
-    ports = [config('object-server-port'),
-             config('container-server-port'),
-             config('account-server-port')]
     removed_client = ingress_address()
     if removed_client:
-        for port in ports:
+        for port in storage_ports():
             revoke_access(removed_client, port)
 
 
@@ -370,6 +455,12 @@ def update_nrpe_config():
     rsync(os.path.join(os.getenv('CHARM_DIR'), 'files', 'nrpe-external-master',
                        'check_swift_service'),
           os.path.join(NAGIOS_PLUGINS, 'check_swift_service'))
+    rsync(os.path.join(os.getenv('CHARM_DIR'), 'files', 'nrpe-external-master',
+                       'check_swift_services.py'),
+          os.path.join(NAGIOS_PLUGINS, 'check_swift_services.py'))
+    rsync(os.path.join(os.getenv('CHARM_DIR'), 'lib',
+                       'swift_storage_diskstats.py'),
+          os.path.join(NAGIOS_PLUGINS, 'check_swift_disk_latency.py'))
     rsync(os.path.join(os.getenv('CHARM_DIR'), 'files', 'sudo',
                        'swift-storage'),
           os.path.join(SUDOERS_D, 'swift-storage'))
@@ -379,29 +470,94 @@ def update_nrpe_config():
     current_unit = nrpe.get_nagios_unit_name()
     nrpe_setup = nrpe.NRPE(hostname=hostname)
 
-    # check the rings and replication
+    # check the rings and replication on every server in one invocation
+    ports = ' '.join(str(config('%s-server-port' % server))
+                     for server in ['object', 'container', 'account'])
     nrpe_setup.add_check(
         shortname='swift_storage',
         description='Check swift storage ring hashes and replication'
                     ' {%s}' % current_unit,
-        check_cmd='check_swift_storage.py {}'.format(
-            config('nagios-check-params'))
+        check_cmd='check_swift_storage.py -p {} {}'.format(
+            ports, config('nagios-check-params'))
+    )
+    # recon disk health checks; node wide so only the object server is
+    # queried
+    sharding = 'swift-container-sharder' in swift_services()
+    for name, description in NRPE_RECON_CHECKS:
+        shortname = 'swift_storage_{}'.format(name.replace('-', '_'))
+        params = config('nagios-{}-check-params'.format(name))
+        if name == 'sharding' and not sharding:
+            params = None
+        if params:
+            nrpe_setup.add_check(
+                shortname=shortname,
+                description='Check swift storage {} {{{}}}'.format(
+                    description, current_unit),
+                check_cmd='check_swift_storage.py -p {} {}'.format(
+                    config('object-server-port'), params)
+            )
+        else:
+            nrpe_setup.remove_check(shortname=shortname)
+    devices = storage_device_names()
+    if config('nagios-disk-latency-check-params') and devices:
+        nrpe_setup.add_check(
+            shortname='swift_storage_disk_latency',
+            description='Check swift storage device latency outliers '
+                        '{%s}' % current_unit,
+            check_cmd='check_swift_disk_latency.py -d {} {}'.format(
+                ' '.join(devices),
+                config('nagios-disk-latency-check-params'))
+        )
+    else:
+        nrpe_setup.remove_check(shortname='swift_storage_disk_latency')
+    # a single check reading the state of every swift daemon at once
+    # replaces the per service checks of earlier charm versions
+    for svc in SWIFT_SVCS:
+        nrpe_setup.remove_check(shortname=svc)
+    nrpe_setup.add_check(
+        shortname='swift_services',
+        description='Check swift storage services {%s}' % current_unit,
+        check_cmd='check_swift_services.py {}'.format(
+            ' '.join(swift_services()))
     )
-    nrpe.add_init_service_checks(nrpe_setup, SWIFT_SVCS, current_unit)
     nrpe_setup.write()
 
 
+def harden_on_config_change(f):
+    """Like harden() but only hardens when the charm config has changed
+    since the last time the decorated hook hardened the unit.
+    """
+    hardened = harden()(f)
+
+    @functools.wraps(f)
+    def _harden(*args, **kwargs):
+        digest = hashlib.sha256(json.dumps(
+            config(), sort_keys=True).encode('UTF-8')).hexdigest()
+        db = kv()
+        key = 'hardened-config-{}'.format(f.__name__)
+        if db.get(key) == digest:
+            return f(*args, **kwargs)
+        result = hardened(*args, **kwargs)
+        db.set(key, digest)
+        db.flush()
+        return result
+    return _harden
+
+
 @hooks.hook('update-status')
-@harden()
+@harden_on_config_change
 def update_status():
     log('Updating status.')
+    if update_drains():
+        for rid in relation_ids('swift-storage'):
+            swift_storage_relation_joined(rid)
 
 
 @hooks.hook('pre-series-upgrade')
 def pre_series_upgrade():
     log("Running prepare series upgrade hook", "INFO")
     if not is_unit_paused_set():
-        for service in SWIFT_SVCS:
+        for service in swift_services():
             stopped = service_stop(service)
             if not stopped:
                 raise Exception("{} didn't stop cleanly.".format(service))
@@ -415,23 +571,50 @@ def post_series_upgrade():
     clear_unit_paused()
     clear_unit_upgrading()
     if not is_unit_paused_set():
-        for service in SWIFT_SVCS:
+        for service in swift_services():
             started = service_start(service)
             if not started:
                 raise Exception("{} didn't start cleanly.".format(service))
 
 
+def setup_logging():
+    """Buffer juju-log calls made by the charm and the helpers it uses."""
+    lib.swift_storage_log.install([sys.modules[__name__],
+                                   lib.misc_utils,
+                                   lib.swift_storage_context,
+                                   lib.swift_storage_services,
+                                   lib.swift_storage_utils,
+                                   templating],
+                                  threshold=config('log-level'))
+
+
 def main():
+    setup_logging()
+    hook_name = os.path.basename(sys.argv[0])
+    if config('profile-hooks'):
+        profiler.enable(hook_name)
+    start = time.time()
     try:
-        hooks.execute(sys.argv)
-    except UnregisteredHookError as e:
-        log('Unknown hook {} - skipping.'.format(e))
-    required_interfaces = copy.deepcopy(REQUIRED_INTERFACES)
-    if config('encrypt'):
-        required_interfaces['vault'] = ['secrets-storage']
-    set_os_workload_status(CONFIGS, required_interfaces,
-                           charm_func=assess_status)
-    os_application_version_set(VERSION_PACKAGE)
+        try:
+            hooks.execute(sys.argv)
+        except UnregisteredHookError as e:
+            log('Unknown hook {} - skipping.'.format(e))
+        except BaseException:
+            lib.swift_storage_log.flush()
+            raise
+        finally:
+            record_hook_duration(hook_name, time.time() - start)
+        required_interfaces = copy.deepcopy(REQUIRED_INTERFACES)
+        if config('encrypt'):
+            required_interfaces['vault'] = ['secrets-storage']
+        with phase('assess_status'):
+            set_os_workload_status(CONFIGS, required_interfaces,
+                                   charm_func=assess_status)
+            report_worker_plan()
+            report_slow_devices()
+        os_application_version_set(VERSION_PACKAGE)
+    finally:
+        profiler.write()
 
 
 if __name__ == '__main__':
@@ -1,3 +1,4 @@
+import functools
 import os
 
 from charmhelpers.contrib.storage.linux.utils import (
@@ -18,7 +19,7 @@ from charmhelpers.contrib.storage.linux.lvm import (
 from charmhelpers.core.host import (
     mounts,
     umount,
-    restart_on_change,
+    restart_on_change_helper,
 )
 
 from charmhelpers.core.hookenv import (
@@ -112,10 +113,20 @@ def is_paused():
 
 
 def pause_aware_restart_on_change(restart_map):
-    """Avoids restarting services if config changes when unit is paused."""
+    """Avoids restarting services if config changes when unit is paused.
+
+    :param restart_map: {path: [service, ...]}, or a function returning it
+                        which is called on every run of the decorated
+                        function
+    """
     def wrapper(f):
         if is_paused():
             return f
-        else:
-            return restart_on_change(restart_map)(f)
+
+        @functools.wraps(f)
+        def wrapped_f(*args, **kwargs):
+            return restart_on_change_helper(
+                lambda: f(*args, **kwargs),
+                restart_map() if callable(restart_map) else restart_map)
+        return wrapped_f
     return wrapper
@@ -0,0 +1,171 @@
+import errno
+import mmap
+import os
+import random
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARK_FILE = '.swift-storage-benchmark'
+MiB = 1024 * 1024
+SEQ_BLOCK_SIZE = MiB
+RANDOM_BLOCK_SIZE = 4096
+# Devices are flagged if any of their results is this many times worse
+# than the median of the other devices.
+OUTLIER_FACTOR = 2.0
+METRICS = ('seq-write-mbps', 'seq-read-mbps', 'rand-write-iops',
+           'rand-read-iops')
+MAX_WORKERS = 32
+
+
+def open_direct(path, flags):
+    """Open path bypassing the page cache where the filesystem allows it.
+
+    tmpfs and some other filesystems reject O_DIRECT, in which case the file
+    is opened normally and the caller must flush and drop the cache itself.
+
+    :returns: (fd, direct) where direct tells whether O_DIRECT is in use
+    """
+    o_direct = getattr(os, 'O_DIRECT', 0)
+    if o_direct:
+        try:
+            return os.open(path, flags | o_direct, 0o600), True
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+    return os.open(path, flags, 0o600), False
+
+
+def _drop_cache(fd):
+    os.fsync(fd)
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def _run(fd, direct, op, offsets, buf, deadline):
+    """Run op(fd, buf, offset) over offsets until they or the time run out.
+
+    :returns: (operations done, seconds taken)
+    """
+    start = time.time()
+    done = 0
+    for offset in offsets:
+        op(fd, buf, offset)
+        done += 1
+        if time.time() >= deadline:
+            break
+    if not direct:
+        _drop_cache(fd)
+    return done, max(time.time() - start, 1e-6)
+
+
+def _write(fd, buf, offset):
+    os.lseek(fd, offset, os.SEEK_SET)
+    os.write(fd, buf)
+
+
+def _read(fd, buf, offset):
+    os.lseek(fd, offset, os.SEEK_SET)
+    os.readv(fd, [buf])
+
+
+def benchmark_path(path, size=64 * MiB, duration=5.0, seed=None):
+    """Measure sequential and random read and write performance of the
+    filesystem holding path.
+
+    A file of at most size bytes is written then read sequentially in 1MiB
+    blocks, then read and written at random 4KiB offsets. Each of the four
+    tests stops after duration seconds. Buffers come from mmap so they are
+    page aligned, as O_DIRECT requires.
+
+    :returns: dict of metric -> result, and whether O_DIRECT was used
+    """
+    size = max(SEQ_BLOCK_SIZE, size - size % SEQ_BLOCK_SIZE)
+    filename = os.path.join(path, BENCHMARK_FILE)
+    rng = random.Random(seed)
+    seq_buf = mmap.mmap(-1, SEQ_BLOCK_SIZE)
+    seq_buf.write(os.urandom(SEQ_BLOCK_SIZE))
+    rand_buf = mmap.mmap(-1, RANDOM_BLOCK_SIZE)
+    seq_offsets = range(0, size, SEQ_BLOCK_SIZE)
+    rand_count = size // RANDOM_BLOCK_SIZE
+
+    def rand_offsets():
+        return (rng.randrange(rand_count) * RANDOM_BLOCK_SIZE
+                for _ in range(rand_count))
+
+    results = {}
+    fd, direct = open_direct(filename, os.O_RDWR | os.O_CREAT | os.O_TRUNC)
+    try:
+        done, secs = _run(fd, direct, _write, seq_offsets, seq_buf,
+                          time.time() + duration)
+        # later tests only touch the part of the file which was written
+        size = done * SEQ_BLOCK_SIZE
+        rand_count = size // RANDOM_BLOCK_SIZE
+        results['seq-write-mbps'] = round(size / MiB / secs, 1)
+        done, secs = _run(fd, direct, _read, seq_offsets[:done], seq_buf,
+                          time.time() + duration)
+        results['seq-read-mbps'] = round(done * SEQ_BLOCK_SIZE / MiB / secs,
+                                         1)
+        done, secs = _run(fd, direct, _read, rand_offsets(), rand_buf,
+                          time.time() + duration)
+        results['rand-read-iops'] = round(done / secs, 1)
+        done, secs = _run(fd, direct, _write, rand_offsets(), rand_buf,
+                          time.time() + duration)
+        results['rand-write-iops'] = round(done / secs, 1)
+    finally:
+        os.close(fd)
+        os.remove(filename)
+        seq_buf.close()
+        rand_buf.close()
+    results['direct'] = direct
+    return results
+
+
+def _benchmark(args):
+    path, size, duration = args
+    try:
+        return benchmark_path(path, size, duration)
+    except (IOError, OSError) as e:
+        return {'error': e.strerror or str(e)}
+
+
+def benchmark_devices(paths, size=64 * MiB, duration=5.0):
+    """Benchmark devices concurrently.
+
+    :param paths: dict of device name -> path on the device's filesystem
+    :returns: dict of device name -> benchmark_path() result, or of 'error'
+    """
+    if not paths:
+        return {}
+    devices = sorted(paths)
+    with ThreadPoolExecutor(max_workers=min(len(devices),
+                                            MAX_WORKERS)) as executor:
+        results = executor.map(_benchmark, [(paths[d], size, duration)
+                                            for d in devices])
+        return dict(zip(devices, results))
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def find_outliers(results, factor=OUTLIER_FACTOR):
+    """Find devices performing much worse than the others.
+
+    :returns: dict of device -> list of the metrics it is slow in
+    """
+    measured = {d: r for d, r in results.items() if 'error' not in r}
+    outliers = {}
+    for dev, result in measured.items():
+        slow = []
+        for metric in METRICS:
+            peers = [r[metric] for d, r in measured.items() if d != dev]
+            if peers and result[metric] * factor < _median(peers):
+                slow.append(metric)
+        if slow:
+            outliers[dev] = slow
+    return outliers
@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+
+STORAGE_MOUNT_PATH = '/srv/node'
+# Largest relative weight change suggested at once, so that following the
+# suggestions moves a bounded number of partitions per rebalance.
+MAX_WEIGHT_STEP = 0.25
+# Seconds allowed for reading the usage of all devices; devices not read by
+# then, e.g. hung disks, are reported as timed out.
+USAGE_TIMEOUT = 10
+
+
+def device_usage(path):
+    """Read the space and inode usage of the filesystem mounted on path.
+
+    :returns: dict of usage figures, or of 'error' if path is not mounted or
+              cannot be read
+    """
+    if not os.path.ismount(path):
+        return {'error': 'not mounted'}
+    try:
+        st = os.statvfs(path)
+    except OSError as e:
+        return {'error': e.strerror or str(e)}
+    size = st.f_blocks * st.f_frsize
+    used = (st.f_blocks - st.f_bfree) * st.f_frsize
+    inodes_used = st.f_files - st.f_ffree
+    return {
+        'bytes-total': size,
+        'bytes-used': used,
+        'bytes-avail': st.f_bavail * st.f_frsize,
+        'inodes-total': st.f_files,
+        'inodes-used': inodes_used,
+        'fill': round(float(used) / size, 4) if size else 0.0,
+        'inode-fill': (round(float(inodes_used) / st.f_files, 4)
+                       if st.f_files else 0.0),
+    }
+
+
+def weight_factor(fill, mean_fill, max_step=MAX_WEIGHT_STEP):
+    """Suggest a relative ring weight change bringing fill towards the mean.
+
+    Partitions, and so data, are assigned in proportion to weight, so
+    scaling a device's weight by mean_fill / fill would even out the fill
+    of the node's devices. The change is limited to max_step either way.
+    """
+    if not fill or not mean_fill:
+        return 1.0
+    factor = float(mean_fill) / fill
+    return round(min(1 + max_step, max(1 - max_step, factor)), 3)
+
+
+def read_usage(paths, timeout=USAGE_TIMEOUT):
+    """Read the usage of several filesystems concurrently.
+
+    Worker threads are daemonic and only waited for until timeout seconds
+    have passed, so that a hung disk can hold up neither the other devices
+    nor the process exit.
+
+    :returns: dict of path -> device_usage() result, or of 'error' for
+              paths not read in time
+    """
+    results = {}
+    end = time.time() + timeout
+
+    def _read(path):
+        results[path] = device_usage(path)
+
+    threads = []
+    for path in paths:
+        thread = threading.Thread(target=_read, args=(path,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join(max(end - time.time(), 0))
+
+    return {path: results.get(path, {'error': 'timed out'})
+            for path in paths}
+
+
+def capacity_report(devices, mount_path=STORAGE_MOUNT_PATH,
+                    timeout=USAGE_TIMEOUT):
+    """Report the fill of every device, reading them concurrently so that a
+    slow or hung disk does not hold up the others.
+
+    :param devices: device names mounted under mount_path
+    :param timeout: seconds allowed for reading all devices
+    :returns: dict with per-device usage under 'devices' and the node mean
+              fill and inode fill
+    """
+    paths = [os.path.join(mount_path, d) for d in devices]
+    usage = read_usage(paths, timeout)
+    usage = {d: usage[p] for d, p in zip(devices, paths)}
+
+    measured = [u for u in usage.values() if 'error' not in u]
+    mean_fill = mean_inode_fill = 0.0
+    if measured:
+        mean_fill = sum(u['fill'] for u in measured) / len(measured)
+        mean_inode_fill = (sum(u['inode-fill'] for u in measured) /
+                           len(measured))
+    for u in measured:
+        u['fill-deviation'] = round(u['fill'] - mean_fill, 4)
+        u['inode-fill-deviation'] = round(u['inode-fill'] - mean_inode_fill,
+                                          4)
+        u['weight-factor'] = weight_factor(u['fill'], mean_fill)
+    return {'devices': usage,
+            'mean-fill': round(mean_fill, 4),
+            'mean-inode-fill': round(mean_inode_fill, 4)}
@@ -1,5 +1,16 @@
+import json
+import math
+import multiprocessing
 import re
 
+from charmhelpers.core.host import (
+    get_total_ram,
+    init_is_systemd,
+    is_container,
+)
+
+from charmhelpers.core.unitdata import kv
+
 from charmhelpers.core.hookenv import (
     config,
     log,
@@ -7,17 +18,277 @@ from charmhelpers.core.hookenv import (
     relation_get,
     relation_ids,
     unit_private_ip,
+    WARNING,
 )
 
 from charmhelpers.contrib.openstack.context import (
+    DEFAULT_MULTIPLIER,
+    MAX_DEFAULT_WORKERS,
     OSContextGenerator,
 )
 
 from charmhelpers.contrib.network.ip import (
     get_ipv6_addr,
+    get_relation_ip,
+    resolve_network_cidr,
+)
+
+from charmhelpers.contrib.openstack.utils import (
+    CompareOpenStackReleases,
+    get_os_codename_package,
+)
+
+from lib.swift_storage_tuning import (
+    daemon_tuning,
+    device_size,
+    nic_speed,
+    object_server_tuning,
+    rotational,
 )
 
 
+SERVERS = ('account', 'container', 'object')
+
+# swift.conf storage policy options accepted from the storage_policies
+# relation setting
+STORAGE_POLICY_OPTIONS = (
+    'name', 'aliases', 'default', 'deprecated', 'policy_type',
+    'diskfile_module', 'ec_type', 'ec_num_data_fragments',
+    'ec_num_parity_fragments', 'ec_object_segment_size',
+    'ec_duplication_factor',
+)
+# Tuning options only understood from the release that introduced them
+TUNING_RELEASES = {
+    'object_replicator_workers': 'rocky',
+    'object_reconstructor_workers': 'stein',
+}
+# Expected resident memory of one worker of each server, used to keep the
+# worker plan within the memory budget.
+WORKER_RSS = {
+    'account': 128 * 1024 * 1024,
+    'container': 160 * 1024 * 1024,
+    'object': 256 * 1024 * 1024,
+}
+
+
+def parse_storage_policies(value):
+    """Parse the storage_policies relation setting, a JSON list of
+    policies each with an index and storage policy options, e.g.
+    [{"index": 1, "name": "ec104", "policy_type": "erasure_coding",
+    "ec_type": "liberasurecode_rs_vand", "ec_num_data_fragments": 10,
+    "ec_num_parity_fragments": 4}].
+
+    :returns: list of (index, list of (option, value)) sorted by index, with
+              booleans as yes or no and lists comma separated
+    :raises: ValueError if value is not a valid list of policies including
+             policy 0
+    """
+    if not value:
+        return []
+    policies = json.loads(value)
+    if not isinstance(policies, list):
+        raise ValueError("storage_policies is not a list")
+    parsed = []
+    for policy in policies:
+        try:
+            index = int(policy['index'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("Storage policy without an index: {}".format(
+                policy))
+        options = []
+        for option in STORAGE_POLICY_OPTIONS:
+            if option not in policy:
+                continue
+            value = policy[option]
+            if isinstance(value, bool):
+                value = 'yes' if value else 'no'
+            elif isinstance(value, list):
+                if not all(isinstance(v, str) for v in value):
+                    raise ValueError("Storage policy {} {} is not a list of "
+                                     "strings".format(index, option))
+                value = ', '.join(value)
+            options.append((option, value))
+        parsed.append((index, options))
+    indexes = [index for index, _ in parsed]
+    if len(set(indexes)) != len(indexes):
+        raise ValueError("Duplicate storage policy indexes")
+    # swift refuses to start without policy 0, used by legacy containers
+    if 0 not in indexes:
+        raise ValueError("No storage policy with index 0")
+    return sorted(parsed)
+
+
+def worker_plan():
+    """Size the workers of each server.
+
+    Account and container servers are bound by their SQLite databases, so
+    their workers scale with the CPU count. As with charmhelpers'
+    WorkerConfigContext, servers without a configured multiplier get at
+    most MAX_DEFAULT_WORKERS workers in containers. Object servers are
+    bound by disk I/O, so they can also be given object-workers-per-device
+    workers per prepared device. Should worker-memory-budget be set and the
+    plan's expected memory use, including the replication servers running
+    the same plan, exceed that percentage of RAM, all counts are scaled
+    down to fit, keeping at least one worker per server.
+
+    :returns: dict of server -> workers, and 'memory-limited' set if the
+              plan was scaled down
+    """
+    cpus = multiprocessing.cpu_count()
+    devices = len(kv().get('prepared-devices', []))
+    default = config('worker-multiplier')
+    plan = {}
+    for server in SERVERS:
+        multiplier = config('{}-worker-multiplier'.format(server))
+        if multiplier is None:
+            multiplier = default
+        if multiplier is None:
+            plan[server] = int(cpus * DEFAULT_MULTIPLIER)
+            if is_container():
+                plan[server] = min(plan[server], MAX_DEFAULT_WORKERS)
+        else:
+            plan[server] = int(cpus * multiplier)
+    plan['object'] = max(plan['object'], int(math.ceil(
+        devices * (config('object-workers-per-device') or 0))))
+
+    limited = False
+    if config('worker-memory-budget'):
+        budget = get_total_ram() * config('worker-memory-budget') / 100.0
+        needed = sum(plan[s] * WORKER_RSS[s] for s in SERVERS)
+        if replication_servers_enabled():
+            needed *= 2
+        limited = needed > budget
+        if limited:
+            for server in SERVERS:
+                plan[server] = int(plan[server] * budget / needed)
+    for server in SERVERS:
+        plan[server] = max(1, plan[server])
+    plan['memory-limited'] = limited
+    return plan
+
+
+def format_worker_plan(plan):
+    return "workers {}{}".format(
+        " ".join("{}={}".format(s, plan[s]) for s in SERVERS),
+        " (memory limited)" if plan['memory-limited'] else "")
+
+
+class ServerWorkerContext(OSContextGenerator):
+    """Workers of one of the account, container or object servers, as sized
+    by worker_plan().
+    """
+    interfaces = []
+
+    def __init__(self, server):
+        self.server = server
+
+    def __call__(self):
+        return {'workers': worker_plan()[self.server]}
+
+
+def replication_ip():
+    """Return the address replication traffic is bound to, from the
+    replication binding or replication-network.
+    """
+    return get_relation_ip('replication',
+                           cidr_network=config('replication-network'))
+
+
+def replication_network():
+    """Return the network peers replicate from when replication has an
+    address of its own, from replication-network or else the network of the
+    replication address.
+
+    :returns: network CIDR, or None when replication uses the swift-storage
+              address
+    """
+    address = replication_ip()
+    if address == get_relation_ip('swift-storage'):
+        return None
+    return config('replication-network') or resolve_network_cidr(address)
+
+
+def replication_servers_enabled():
+    """Tell whether the replication servers run on this unit. They are
+    systemd units, so replication-servers is ignored on other init systems.
+    """
+    return bool(config('replication-servers')) and init_is_systemd()
+
+
+def statsd_aggregator_enabled():
+    """Tell whether the local statsd aggregator runs on this unit. It needs
+    statsd-host to forward to and is a systemd unit, so
+    statsd-local-aggregator is ignored on other init systems.
+    """
+    return (bool(config('statsd-local-aggregator')) and
+            bool(config('statsd-host')) and init_is_systemd())
+
+
+def container_sharding():
+    """Tell whether the installed swift has the container sharder, which
+    came with Rocky. Assumed when the release is unknown.
+    """
+    release = get_os_codename_package('swift-container', fatal=False)
+    return not release or CompareOpenStackReleases(release) >= 'rocky'
+
+
+def mostly_ssd(devices):
+    """Tell whether most devices are SSDs. Devices of unknown class count
+    as spinning disks.
+    """
+    ssds = len([d for d in devices if rotational(d) == 0])
+    return ssds * 2 > len(devices)
+
+
+def apply_overrides(tuning):
+    """Build a context from tuning, overridden by the config options of the
+    same names.
+    """
+    ctxt = {}
+    for option, value in tuning.items():
+        override = config(option)
+        ctxt[option.replace('-', '_')] = (
+            value if override is None else override)
+    return ctxt
+
+
+class DaemonTuningContext(OSContextGenerator):
+    """Rates and concurrency of the replicators, auditors and updaters, as
+    derived by daemon_tuning() from the prepared devices and the NIC speed.
+    """
+    interfaces = []
+
+    def __call__(self):
+        devices = kv().get('prepared-devices', [])
+        ctxt = apply_overrides(daemon_tuning(len(devices),
+                                             mostly_ssd(devices),
+                                             nic_speed()))
+        release = get_os_codename_package('swift-object', fatal=False)
+        if release:
+            for option, since in TUNING_RELEASES.items():
+                if CompareOpenStackReleases(release) < since:
+                    del ctxt[option]
+        return ctxt
+
+
+class ObjectServerTuningContext(OSContextGenerator):
+    """Object server chunk sizes, page cache policy and sync cadence, as
+    derived by object_server_tuning() from RAM, the NIC speed and the
+    prepared devices.
+    """
+    interfaces = []
+
+    def __call__(self):
+        devices = kv().get('prepared-devices', [])
+        sizes = [s for s in (device_size(d) for d in devices)
+                 if s is not None]
+        ctxt = apply_overrides(object_server_tuning(
+            get_total_ram(), nic_speed(), sizes, mostly_ssd(devices)))
+        ctxt['object_server_keep_cache_private'] = str(
+            bool(ctxt['object_server_keep_cache_private'])).lower()
+        return ctxt
+
+
 class SwiftStorageContext(OSContextGenerator):
     interfaces = ['swift-storage']
 
@@ -27,16 +298,26 @@ class SwiftStorageContext(OSContextGenerator):
             return {}
 
         swift_hash = None
+        policies = None
         for rid in rids:
             for unit in related_units(rid):
                 if not swift_hash:
                     swift_hash = relation_get('swift_hash', rid=rid,
                                               unit=unit)
+                if not policies:
+                    policies = relation_get('storage_policies', rid=rid,
+                                            unit=unit)
         if not swift_hash:
             log('No swift_hash passed via swift-storage relation. '
                 'Peer not ready?')
             return {}
-        return {'swift_hash': swift_hash}
+        ctxt = {'swift_hash': swift_hash}
+        try:
+            ctxt['storage_policies'] = parse_storage_policies(policies)
+        except ValueError as e:
+            log('Ignoring storage_policies from swift-storage relation: '
+                '{}'.format(e), level=WARNING)
+        return ctxt
 
 
 class RsyncContext(OSContextGenerator):
@@ -72,6 +353,13 @@ class RsyncContext(OSContextGenerator):
 
                     timestamps.append(ts)
 
+        # the proxy only knows the peers' swift-storage addresses, while
+        # they replicate from their replication addresses
+        if ctxt.get('allowed_hosts'):
+            network = replication_network()
+            if network:
+                ctxt['allowed_hosts'] += ' {}'.format(network)
+
         self.enable_rsyncd()
         return ctxt
 
@@ -87,6 +375,7 @@ class SwiftStorageServerContext(OSContextGenerator):
             'object_server_port': config('object-server-port'),
             'object_server_threads_per_disk': config(
                 'object-server-threads-per-disk'),
+            'object_servers_per_port': config('object-servers-per-port'),
             'account_max_connections': config('account-max-connections'),
             'container_max_connections': config('container-max-connections'),
             'object_max_connections': config('object-max-connections'),
@@ -96,5 +385,23 @@ class SwiftStorageServerContext(OSContextGenerator):
             'statsd_host': config('statsd-host'),
             'statsd_port': config('statsd-port'),
             'statsd_sample_rate': config('statsd-sample-rate'),
+            'replication_servers': replication_servers_enabled(),
+            'container_sharding': container_sharding(),
+            'container_sharder_shard_container_threshold': config(
+                'container-sharder-shard-container-threshold'),
+            'container_sharder_concurrency': config(
+                'container-sharder-concurrency'),
+            'container_sharder_cleave_batch_size': config(
+                'container-sharder-cleave-batch-size'),
         }
+        if ctxt['replication_servers']:
+            ctxt['replication_ip'] = replication_ip()
+            for server in SERVERS:
+                option = '{}-replication-port'.format(server)
+                ctxt[option.replace('-', '_')] = config(option)
+        if statsd_aggregator_enabled():
+            # daemons send to the local aggregator which forwards batches
+            # to statsd-host.
+            ctxt['statsd_host'] = '127.0.0.1'
+            ctxt['statsd_port'] = config('statsd-local-aggregator-port')
         return ctxt
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Detect slow swift storage devices from /proc/diskstats.
+
+Used by the charm to report slow devices in the workload status and
+installed as the check_swift_disk_latency.py NRPE plugin, so this module
+must only depend on the standard library.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+DISKSTATS = '/proc/diskstats'
+# Devices are not reported as slow below this average I/O wait time, which
+# keeps idle and lightly loaded devices from being flagged.
+MIN_AWAIT = 20.0
+SAMPLE_INTERVAL = 1.0
+
+STATUS_OK = 0
+STATUS_WARN = 1
+STATUS_CRIT = 2
+STATUS_UNKNOWN = 3
+
+
+def read_diskstats(path=DISKSTATS):
+    """Read the I/O counters of every block device in one read of path.
+
+    :returns: dict of kernel device name -> (ios, io_ms, io_ticks,
+              time_in_queue) where ios and io_ms sum reads and writes
+    """
+    with open(path) as f:
+        data = f.read()
+    stats = {}
+    for line in data.splitlines():
+        fields = line.split()
+        if len(fields) < 14:
+            continue
+        try:
+            counters = [int(v) for v in fields[3:14]]
+        except ValueError:
+            continue
+        stats[fields[2]] = (counters[0] + counters[4],
+                            counters[3] + counters[7],
+                            counters[9], counters[10])
+    return stats
+
+
+def kernel_name(device):
+    """Return the /proc/diskstats name of a device path, resolving symlinks
+    such as /dev/mapper/crypt-* to their dm-* device.
+    """
+    path = os.path.realpath(device)
+    if path.startswith('/dev/'):
+        return path[len('/dev/'):]
+    return os.path.basename(path)
+
+
+def device_stats(previous, current, interval, devices=None):
+    """Compute per-device latency statistics between two samples.
+
+    :param previous: read_diskstats() result of the first sample
+    :param current: read_diskstats() result of the second sample
+    :param interval: seconds between the two samples
+    :param devices: kernel names to report, all devices if None
+    :returns: dict of device -> {'await': average ms per I/O, 'util':
+              percent of time busy, 'queue': average queue depth}
+    """
+    stats = {}
+    for dev in (current if devices is None else devices):
+        if dev not in previous or dev not in current or interval <= 0:
+            continue
+        deltas = [c - p for c, p in zip(current[dev], previous[dev])]
+        if any(d < 0 for d in deltas):
+            # counters were reset, e.g. the device was re-attached
+            continue
+        ios, io_ms, io_ticks, time_in_queue = deltas
+        stats[dev] = {
+            'await': float(io_ms) / ios if ios else 0.0,
+            'util': min(100.0, 100.0 * io_ticks / (interval * 1000)),
+            'queue': time_in_queue / (interval * 1000),
+        }
+    return stats
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def find_outliers(stats, factor, min_await=MIN_AWAIT):
+    """Find devices much slower than their peers on the node.
+
+    A device is an outlier if its await is at least min_await and factor
+    times the median await of the other devices.
+
+    :returns: dict of device -> median await of its peers
+    """
+    outliers = {}
+    if not factor:
+        return outliers
+    for dev in stats:
+        peers = [s['await'] for d, s in stats.items() if d != dev]
+        if not peers:
+            continue
+        median = _median(peers)
+        if (stats[dev]['await'] >= min_await and
+                stats[dev]['await'] >= factor * median):
+            outliers[dev] = median
+    return outliers
+
+
+def format_outliers(stats, outliers):
+    return ', '.join(
+        '{} (await {:.0f}ms, peers {:.0f}ms)'.format(
+            dev, stats[dev]['await'], outliers[dev])
+        for dev in sorted(outliers))
+
+
+def check_latency(stats, factors, min_await=MIN_AWAIT, util=None):
+    """Nagios check of device latency outliers and utilisation.
+
+    :param factors: (warn, crit) await outlier factors
+    :param util: optional (warn, crit) utilisation percentages
+    :returns: list of (status, message)
+    """
+    results = []
+    crit = find_outliers(stats, factors[1], min_await)
+    warn = dict((d, m) for d, m in find_outliers(stats, factors[0],
+                                                 min_await).items()
+                if d not in crit)
+    if crit:
+        results.append((STATUS_CRIT,
+                        'slow devices: ' + format_outliers(stats, crit)))
+    if warn:
+        results.append((STATUS_WARN,
+                        'slow devices: ' + format_outliers(stats, warn)))
+    if util:
+        for dev in sorted(stats):
+            busy = stats[dev]['util']
+            if busy >= util[1]:
+                results.append((STATUS_CRIT,
+                                'device {} is {:.0f}% busy'.format(dev, busy)))
+            elif busy >= util[0]:
+                results.append((STATUS_WARN,
+                                'device {} is {:.0f}% busy'.format(dev, busy)))
+    return results
+
+
+def format_perfdata(stats):
+    perfdata = []
+    for dev in sorted(stats):
+        for key, unit in (('await', 'ms'), ('util', '%'), ('queue', '')):
+            perfdata.append("'{}_{}'={:.2f}{};;;0".format(
+                dev, key, stats[dev][key], unit))
+    return ' '.join(perfdata)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-d', '--devices', nargs='+', required=True,
+                        help='Devices to check')
+    parser.add_argument('-f', '--await-factor', dest='factors', type=float,
+                        nargs=2, default=[3, 5], metavar=('warn', 'crit'),
+                        help='Flag devices whose await is this many times '
+                             'the median of the other devices')
+    parser.add_argument('--min-await', type=float, default=MIN_AWAIT,
+                        help='Do not flag devices below this await (ms)')
+    parser.add_argument('-u', '--util', type=float, nargs=2,
+                        metavar=('warn', 'crit'),
+                        help='Check device utilisation (percent)')
+    parser.add_argument('-i', '--interval', type=float,
+                        default=SAMPLE_INTERVAL,
+                        help='Seconds between the two diskstats samples')
+    args = parser.parse_args(argv)
+
+    devices = [kernel_name(d) for d in args.devices]
+    try:
+        previous = read_diskstats()
+        time.sleep(args.interval)
+        current = read_diskstats()
+    except IOError as e:
+        print('UNKNOWN: {}'.format(e))
+        return STATUS_UNKNOWN
+
+    stats = device_stats(previous, current, args.interval, devices)
+    missing = sorted(set(devices) - set(stats))
+    results = check_latency(stats, args.factors, args.min_await, args.util)
+    if missing:
+        results.append((STATUS_UNKNOWN,
+                        'no diskstats for ' + ', '.join(missing)))
+
+    perfdata = format_perfdata(stats)
+    if perfdata:
+        perfdata = ' | ' + perfdata
+    for status, label in ((STATUS_CRIT, 'CRITICAL'),
+                          (STATUS_WARN, 'WARNING'),
+                          (STATUS_UNKNOWN, 'UNKNOWN')):
+        messages = [m for s, m in results if s == status]
+        if messages:
+            print('{}: {}{}'.format(label, ';'.join(messages), perfdata))
+            return status
+    print('OK{}'.format(perfdata))
+    return STATUS_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,150 @@
+import atexit
+
+import six
+
+from charmhelpers.core import hookenv
+
+from charmhelpers.core.hookenv import (
+    CRITICAL,
+    ERROR,
+    WARNING,
+    INFO,
+    DEBUG,
+    TRACE,
+    SH_MAX_ARG,
+)
+
+# NOTE: keep a reference to the real juju-log writer so that the buffer can
+#       still reach it once hookenv.log has been replaced by install().
+_juju_log = hookenv.log
+
+LEVELS = {
+    TRACE: 0,
+    DEBUG: 10,
+    INFO: 20,
+    'WARN': 30,
+    WARNING: 30,
+    ERROR: 40,
+    CRITICAL: 50,
+}
+
+# Levels that cause the buffer to be flushed immediately so that errors are
+# never lost or reordered behind a hook failure.
+FLUSH_LEVELS = (ERROR, CRITICAL)
+
+DEFAULT_MAX_MESSAGES = 200
+
+
+def level_value(level):
+    """Return the numeric rank of a juju-log level.
+
+    Unknown or missing levels are treated as INFO which matches the default
+    used by juju-log itself.
+    """
+    if not level:
+        return LEVELS[INFO]
+    return LEVELS.get(str(level).upper(), LEVELS[INFO])
+
+
+class BufferedLog(object):
+    """Drop-in replacement for hookenv.log that batches juju-log calls.
+
+    Messages are queued in memory and coalesced into as few juju-log
+    invocations as possible, one per level held in the buffer so that
+    interleaved DEBUG and INFO messages do not cost a fork each. Every
+    message is logged at its own level, keeping its order among the messages
+    of that level, and levels are written lowest first so that the message
+    causing an ERROR flush comes last. Messages below the configured
+    threshold are discarded before any formatting takes place.
+    """
+
+    def __init__(self, threshold=DEBUG, max_messages=DEFAULT_MAX_MESSAGES,
+                 writer=None):
+        self.threshold = threshold
+        self.max_messages = max_messages
+        self.writer = writer or _juju_log
+        self.buffer = []
+
+    @property
+    def threshold(self):
+        return self._threshold
+
+    @threshold.setter
+    def threshold(self, level):
+        self._threshold = level_value(level or DEBUG)
+
+    def __call__(self, message, level=None):
+        if level_value(level) < self._threshold:
+            return
+
+        if not isinstance(message, six.string_types):
+            message = repr(message)
+
+        self.buffer.append((level, message))
+        if (str(level).upper() in FLUSH_LEVELS or
+                len(self.buffer) >= self.max_messages):
+            self.flush()
+
+    def flush(self):
+        """Write all buffered messages to juju-log."""
+        buffered, self.buffer = self.buffer, []
+        levels = {}
+        for level, message in buffered:
+            # the first spelling of a level, e.g. WARN or WARNING, is kept
+            levels.setdefault(level_value(level), (level, []))[1].append(
+                message)
+        for value in sorted(levels):
+            level, messages = levels[value]
+            for chunk in self._chunks(messages):
+                self.writer(chunk, level=level)
+
+    @staticmethod
+    def _chunks(messages):
+        """Join messages into newline separated chunks that fit in a single
+        juju-log argument.
+        """
+        chunk = []
+        size = 0
+        for message in messages:
+            message = message[:SH_MAX_ARG]
+            if chunk and size + len(message) + 1 > SH_MAX_ARG:
+                yield '\n'.join(chunk)
+                chunk = []
+                size = 0
+            chunk.append(message)
+            size += len(message) + 1
+
+        if chunk:
+            yield '\n'.join(chunk)
+
+
+log = BufferedLog()
+
+_installed = []
+
+
+def install(modules, threshold=None):
+    """Route log calls made by the given modules through the buffered log.
+
+    Modules that imported log directly from hookenv hold their own reference
+    to it, so it is rebound on each of them as well as on hookenv itself for
+    callers using hookenv.log(). The buffer is flushed at interpreter exit.
+
+    :param modules: list of modules whose 'log' attribute will be replaced.
+    :param threshold: minimum level to be logged, DEBUG if not set.
+    """
+    if threshold:
+        log.threshold = threshold
+
+    for module in [hookenv] + list(modules):
+        if getattr(module, 'log', None) is not log:
+            module.log = log
+
+    if not _installed:
+        atexit.register(log.flush)
+        _installed.append(True)
+
+
+def flush():
+    """Flush any messages still held in the buffer."""
+    log.flush()
@@ -0,0 +1,197 @@
+import contextlib
+import glob
+import json
+import os
+import subprocess
+import time
+
+from charmhelpers.core.hookenv import (
+    log,
+    WARNING,
+)
+
+TRACE_DIR = '/var/lib/juju/swift_storage/hook-traces'
+# Number of hook traces kept on disk, oldest are removed first.
+MAX_TRACES = 100
+
+_Popen = subprocess.Popen
+
+
+class HookProfiler(object):
+    """Record wall time of hook phases and of every subprocess they run."""
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self, hook_name=None):
+        self.hook_name = hook_name
+        self.start = time.time()
+        self.phases = []
+        self.commands = []
+        self.current_phase = None
+
+    def enable(self, hook_name):
+        """Start profiling hook_name.
+
+        Replaces subprocess.Popen so that every command run through the
+        subprocess module, including by charmhelpers, is recorded.
+        """
+        self.reset(hook_name)
+        self.enabled = True
+        subprocess.Popen = ProfiledPopen
+
+    def disable(self):
+        self.enabled = False
+        subprocess.Popen = _Popen
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Context manager timing a named phase of the hook."""
+        if not self.enabled:
+            yield
+            return
+
+        parent = self.current_phase
+        self.current_phase = name
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases.append({'name': name,
+                                'start': round(start - self.start, 6),
+                                'duration': round(time.time() - start, 6)})
+            self.current_phase = parent
+
+    def record_command(self, args, start, returncode):
+        if not self.enabled:
+            return
+        if isinstance(args, (list, tuple)):
+            args = [str(a) for a in args]
+        else:
+            args = [str(args)]
+        self.commands.append({'argv': args,
+                              'phase': self.current_phase,
+                              'start': round(start - self.start, 6),
+                              'duration': round(time.time() - start, 6),
+                              'returncode': returncode})
+
+    def trace(self):
+        return {'hook': self.hook_name,
+                'timestamp': int(self.start),
+                'duration': round(time.time() - self.start, 6),
+                'phases': self.phases,
+                'commands': self.commands}
+
+    def write(self, trace_dir=TRACE_DIR, max_traces=MAX_TRACES):
+        """Write the JSON trace of the current hook run to trace_dir.
+
+        Failures are logged and ignored; profiling must never cause a hook to
+        fail.
+        """
+        if not self.enabled:
+            return
+        trace = self.trace()
+        filename = '%.6f-%s.json' % (self.start, self.hook_name)
+        path = os.path.join(trace_dir, filename)
+        try:
+            if not os.path.isdir(trace_dir):
+                os.makedirs(trace_dir)
+            with open(path, 'w') as f:
+                json.dump(trace, f, sort_keys=True)
+            for old in list_traces(trace_dir)[:-max_traces]:
+                os.remove(old)
+        except (IOError, OSError) as exc:
+            log("Unable to write hook trace: %s" % exc, level=WARNING)
+
+
+class ProfiledPopen(_Popen):
+    """subprocess.Popen recording argv, duration and exit code of each
+    command with the hook profiler.
+    """
+
+    def __init__(self, args, *pargs, **kwargs):
+        self._profile_args = args
+        self._profile_start = time.time()
+        self._profile_recorded = False
+        try:
+            super(ProfiledPopen, self).__init__(args, *pargs, **kwargs)
+        except OSError:
+            self._profile_record(None)
+            raise
+
+    def _profile_record(self, returncode):
+        if not self._profile_recorded:
+            self._profile_recorded = True
+            profiler.record_command(self._profile_args, self._profile_start,
+                                    returncode)
+
+    def wait(self, *args, **kwargs):
+        returncode = super(ProfiledPopen, self).wait(*args, **kwargs)
+        self._profile_record(returncode)
+        return returncode
+
+
+profiler = HookProfiler()
+
+
+def phase(name):
+    """Time a named hook phase, a no-op unless profiling is enabled."""
+    return profiler.phase(name)
+
+
+def list_traces(trace_dir=TRACE_DIR):
+    """Return paths of the stored hook traces, oldest first."""
+    return sorted(glob.glob(os.path.join(trace_dir, '*.json')),
+                  key=lambda p: float(os.path.basename(p).split('-')[0]))
+
+
+def load_traces(trace_dir=TRACE_DIR):
+    traces = []
+    for path in list_traces(trace_dir):
+        try:
+            with open(path) as f:
+                traces.append(json.load(f))
+        except (IOError, ValueError):
+            log("Ignoring unreadable hook trace %s" % path, level=WARNING)
+    return traces
+
+
+def summarise(traces, limit=10):
+    """Summarise the slowest hooks, phases and commands of a set of traces.
+
+    Commands are grouped by their first two arguments, e.g. 'systemctl
+    restart', so that repeated invocations are aggregated.
+
+    :param traces: list of traces as written by HookProfiler.write
+    :param limit: number of entries to return in each list
+    :returns: dict with 'hooks', 'phases' and 'commands' lists
+    """
+    hooks = sorted(({'hook': t['hook'], 'timestamp': t['timestamp'],
+                     'duration': t['duration'],
+                     'commands': len(t['commands'])} for t in traces),
+                   key=lambda h: h['duration'], reverse=True)
+
+    def _aggregate(items, key):
+        totals = {}
+        for item in items:
+            entry = totals.setdefault(key(item), {'count': 0, 'total': 0.0,
+                                                  'max': 0.0})
+            entry['count'] += 1
+            entry['total'] += item['duration']
+            entry['max'] = max(entry['max'], item['duration'])
+        result = []
+        for name, entry in totals.items():
+            entry['total'] = round(entry['total'], 6)
+            entry['name'] = name
+            result.append(entry)
+        return sorted(result, key=lambda e: e['total'], reverse=True)[:limit]
+
+    phases = [dict(p, hook=t['hook']) for t in traces for p in t['phases']]
+    commands = [c for t in traces for c in t['commands']]
+    return {
+        'hooks': hooks[:limit],
+        'phases': _aggregate(phases,
+                             lambda p: '%s:%s' % (p['hook'], p['name'])),
+        'commands': _aggregate(commands, lambda c: ' '.join(c['argv'][:2])),
+    }
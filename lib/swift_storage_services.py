@@ -0,0 +1,349 @@
+import subprocess
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from charmhelpers.core.hookenv import (
+    config,
+    log,
+    DEBUG,
+    INFO,
+    WARNING,
+)
+
+from charmhelpers.core.unitdata import kv
+
+from charmhelpers.core.host import (
+    init_is_systemd,
+    service_pause,
+    service_resume,
+    service_running,
+    service_start,
+    service_stop,
+)
+
+PROC_NET_TCP = ['/proc/net/tcp', '/proc/net/tcp6']
+# st field of /proc/net/tcp for established and listening sockets
+TCP_ESTABLISHED = '01'
+TCP_LISTEN = '0A'
+
+# The WSGI servers, and the config options holding their bind ports. All
+# other swift services are background daemons.
+SERVER_PORT_OPTIONS = {
+    'swift-account': 'account-server-port',
+    'swift-container': 'container-server-port',
+    'swift-object': 'object-server-port',
+    'swift-account-replication': 'account-replication-port',
+    'swift-container-replication': 'container-replication-port',
+    'swift-object-replication': 'object-replication-port',
+}
+
+DRAIN_TIMEOUT = 30
+LISTEN_TIMEOUT = 30
+POLL_INTERVAL = 0.5
+
+
+def parse_systemctl_show(output):
+    """Parse the output of 'systemctl show' for several units.
+
+    :returns: dict of unit Id -> dict of property -> value
+    """
+    units = {}
+    for block in output.strip().split('\n\n'):
+        props = {}
+        for line in block.splitlines():
+            key, sep, value = line.partition('=')
+            if sep:
+                props[key] = value
+        if props.get('Id'):
+            units[props['Id']] = props
+    return units
+
+
+def services_running(services):
+    """Determine which services are running.
+
+    On systemd the state of all services is read with a single
+    'systemctl show' call rather than one 'systemctl is-active' per service.
+
+    :param services: list of service names
+    :returns: dict of service -> bool
+    """
+    if not init_is_systemd():
+        return {s: service_running(s) for s in services}
+
+    cmd = ['systemctl', 'show', '--property=Id,ActiveState,SubState']
+    cmd += ['{}.service'.format(s) for s in services]
+    try:
+        units = parse_systemctl_show(
+            subprocess.check_output(cmd).decode('UTF-8'))
+    except (OSError, subprocess.CalledProcessError) as e:
+        log("Unable to query service states: {}".format(e), level=DEBUG)
+        units = {}
+
+    running = {}
+    for service in services:
+        props = units.get('{}.service'.format(service), {})
+        running[service] = (props.get('ActiveState') == 'active' and
+                            props.get('SubState') == 'running')
+    return running
+
+
+def tcp_sockets(paths=None):
+    """Read the local port and state of every TCP socket from
+    /proc/net/tcp{,6}.
+
+    :returns: list of (port, state) tuples
+    """
+    sockets = []
+    for path in paths or PROC_NET_TCP:
+        try:
+            with open(path) as f:
+                lines = f.readlines()[1:]
+        except IOError:
+            continue
+        for line in lines:
+            fields = line.split()
+            if len(fields) > 3:
+                sockets.append((int(fields[1].rsplit(':', 1)[1], 16),
+                                fields[3]))
+    return sockets
+
+
+def listening_ports(paths=None):
+    """Return the TCP ports listened on, read once from /proc/net/tcp{,6}.
+
+    :returns: set of port numbers
+    """
+    return set(port for port, state in tcp_sockets(paths)
+               if state == TCP_LISTEN)
+
+
+def connection_count(ports, paths=None):
+    """Return the number of established connections to the given local
+    ports.
+    """
+    ports = set(int(p) for p in ports)
+    return len([port for port, state in tcp_sockets(paths)
+                if state == TCP_ESTABLISHED and port in ports])
+
+
+def check_services(services, ports):
+    """Check services are running and ports are listened on.
+
+    Costs one systemctl call and two file reads whatever the number of
+    services and ports.
+
+    :param services: list of service names
+    :param ports: list of port numbers
+    :returns: (state, message) or (None, None) if everything is running
+    """
+    messages = []
+    running = services_running(services)
+    stopped = [s for s in services if not running[s]]
+    if stopped:
+        messages.append("Services not running that should be: {}"
+                        .format(", ".join(stopped)))
+    listening = listening_ports()
+    closed = [str(p) for p in ports if int(p) not in listening]
+    if closed:
+        messages.append("Ports which should be open, but are not: {}"
+                        .format(", ".join(closed)))
+    if messages:
+        return 'blocked', "; ".join(messages)
+    return None, None
+
+
+def server_ports(services):
+    """Return the bind ports of the WSGI servers among services.
+
+    In servers_per_port mode the object server listens on the ports
+    allocated to the devices rather than on object-server-port.
+
+    :returns: dict of service -> list of ports
+    """
+    ports = {}
+    for service in services:
+        if service not in SERVER_PORT_OPTIONS:
+            continue
+        device_ports = None
+        if service == 'swift-object' and config('object-servers-per-port'):
+            device_ports = sorted(
+                kv().get('object-device-ports', {}).values())
+        ports[service] = device_ports or [
+            int(config(SERVER_PORT_OPTIONS[service]))]
+    return ports
+
+
+def _all_ports(ports):
+    return [p for service_ports in ports.values() for p in service_ports]
+
+
+def run_parallel(func, services):
+    """Run func for every service concurrently.
+
+    :returns: list of the services for which func returned a false value or
+              raised
+    """
+    def _run(service):
+        try:
+            return func(service)
+        except Exception as e:
+            log("{} failed for {}: {}".format(func.__name__, service, e),
+                level=WARNING)
+            return False
+
+    if not services:
+        return []
+    with ThreadPoolExecutor(max_workers=len(services)) as executor:
+        results = list(executor.map(_run, services))
+    return [s for s, ok in zip(services, results) if not ok]
+
+
+def wait_for(predicate, timeout, interval=POLL_INTERVAL):
+    """Poll predicate until it returns True or timeout seconds pass.
+
+    :returns: the last value returned by predicate
+    """
+    deadline = time.time() + timeout
+    while True:
+        result = predicate()
+        if result or time.time() >= deadline:
+            return result
+        time.sleep(interval)
+
+
+def graceful_shutdown(service):
+    """Ask a swift WSGI server to stop accepting connections and exit once
+    its in-flight requests complete, as 'swift-init shutdown' does.
+
+    On SIGHUP the server's parent process exits at once, leaving its workers
+    to complete the requests. systemd then deactivates the unit and, unless
+    the unit's KillMode is process, kills the workers with it. Such units,
+    and units without a known main process, are not signalled so that they
+    are stopped outright rather than cut off in the middle of a drain.
+
+    :returns: True if the server is draining
+    """
+    if not init_is_systemd():
+        return False
+    unit = '{}.service'.format(service)
+    cmd = ['systemctl', 'show', '--property=Id,MainPID,KillMode', unit]
+    try:
+        props = parse_systemctl_show(
+            subprocess.check_output(cmd).decode('UTF-8')).get(unit, {})
+    except (OSError, subprocess.CalledProcessError) as e:
+        log("Unable to read the state of {}: {}".format(service, e),
+            level=WARNING)
+        return False
+    if props.get('MainPID', '0') == '0' or props.get('KillMode') != 'process':
+        log("Not draining {}: KillMode {}, MainPID {}".format(
+            service, props.get('KillMode'), props.get('MainPID')),
+            level=DEBUG)
+        return False
+    return subprocess.call(['systemctl', 'kill', '--signal=SIGHUP',
+                            '--kill-who=main', service]) == 0
+
+
+def stop_services(services, drain_timeout=DRAIN_TIMEOUT,
+                  stop=service_pause):
+    """Stop services in dependency order.
+
+    Background daemons are stopped first, in parallel, so that nothing
+    replicates to or updates the servers while they go away. The WSGI
+    servers are then shut down gracefully and given up to drain_timeout
+    seconds for the connections on their ports to finish before being
+    stopped, also in parallel.
+
+    :param stop: function stopping a single service, returning True on
+                 success
+    :returns: list of services which failed to stop, empty on success
+    """
+    ports = server_ports(services)
+    background = [s for s in services if s not in ports]
+    start = time.time()
+    failed = run_parallel(stop, background)
+    if failed:
+        return failed
+    log("Stopped {} background services in {:.1f}s".format(
+        len(background), time.time() - start), level=INFO)
+
+    if not ports:
+        return []
+    start = time.time()
+    draining = [s for s in ports if graceful_shutdown(s)]
+    if draining:
+        remaining = wait_for(
+            lambda: connection_count(_all_ports(ports)) == 0, drain_timeout)
+        if not remaining:
+            log("{} connections still open after {}s, stopping servers "
+                "anyway".format(connection_count(_all_ports(ports)),
+                                drain_timeout), level=WARNING)
+    servers = [s for s in services if s in ports]
+    failed = run_parallel(stop, servers)
+    log("Drained and stopped {} servers in {:.1f}s".format(
+        len(servers), time.time() - start), level=INFO)
+    return failed
+
+
+def start_services(services, listen_timeout=LISTEN_TIMEOUT,
+                   start=service_resume):
+    """Start services in the reverse order of stop_services().
+
+    The WSGI servers are started first, in parallel, and the background
+    daemons only once every server listens on one of its ports or
+    listen_timeout seconds have passed. An object server in servers_per_port
+    mode only listens on the ports of devices in the rings, so it need not
+    listen on all of them.
+
+    :param start: function starting a single service, returning True on
+                  success
+    :returns: list of services which failed to start, empty on success
+    """
+    ports = server_ports(services)
+    servers = [s for s in services if s in ports]
+    begin = time.time()
+    failed = run_parallel(start, servers)
+    if failed:
+        return failed
+    if ports:
+        def not_listening():
+            listening = listening_ports()
+            return [s for s in servers
+                    if not listening.intersection(ports[s])]
+
+        if not wait_for(lambda: not not_listening(), listen_timeout):
+            failed = not_listening()
+            log("{} not listening after {}s".format(
+                ', '.join(failed), listen_timeout), level=WARNING)
+            return failed
+        log("Started {} servers in {:.1f}s".format(
+            len(servers), time.time() - begin), level=INFO)
+
+    background = [s for s in services if s not in ports]
+    return run_parallel(start, background)
+
+
+def rolling_restart(services, drain_timeout=DRAIN_TIMEOUT,
+                    listen_timeout=LISTEN_TIMEOUT):
+    """Restart services tier by tier, keeping the node serving throughout.
+
+    The background daemons are stopped in parallel, then each WSGI server in
+    turn is drained, restarted and must listen on its port again before the
+    next one is touched, so that at most one server type is unavailable at
+    a time. The background daemons are started last, once every server is
+    healthy.
+
+    :returns: list of services which failed to restart, empty on success
+    """
+    ports = server_ports(services)
+    background = [s for s in services if s not in ports]
+    failed = run_parallel(service_stop, background)
+    if failed:
+        return failed
+    for server in (s for s in services if s in ports):
+        failed = (stop_services([server], drain_timeout, service_stop) or
+                  start_services([server], listen_timeout, service_start))
+        if failed:
+            return failed
+    return run_parallel(service_start, background)
@@ -0,0 +1,213 @@
+import math
+import os
+
+from lib.swift_storage_diskstats import kernel_name
+
+SYSFS_BLOCK = '/sys/class/block'
+SYSFS_NET = '/sys/class/net'
+# Assumed when no physical NIC reports its speed, e.g. on most VMs.
+DEFAULT_NIC_SPEED = 1000
+
+# Per-process rates the background daemons may use on a device without
+# starving the servers of I/O. Swift's own defaults suit a few spinning
+# disks, SSDs can take several times more.
+DEVICE_CLASS_RATES = {
+    'hdd': {
+        'object-auditor-files-per-second': 20,
+        'object-auditor-bytes-per-second': 10 * 1000 * 1000,
+        'object-auditor-zero-byte-files-per-second': 50,
+        'object-updater-objects-per-second': 50,
+        'replicator-max-diffs': 100,
+    },
+    'ssd': {
+        'object-auditor-files-per-second': 100,
+        'object-auditor-bytes-per-second': 50 * 1000 * 1000,
+        'object-auditor-zero-byte-files-per-second': 250,
+        'object-updater-objects-per-second': 250,
+        'replicator-max-diffs': 1000,
+    },
+}
+# swift's own object replicator pass interval and request timeout, kept
+# unless overridden
+REPLICATOR_RUN_PAUSE = 30
+REPLICATOR_NODE_TIMEOUT = 10
+# Devices walked by each auditor and replicator process.
+DEVICES_PER_AUDITOR = 8
+DEVICES_PER_REPLICATOR = 12
+# Concurrent updater processes per Gb/s of NIC speed; updates go to the
+# container servers over the network.
+UPDATERS_PER_GBPS = 4
+MIN_UPDATER_CONCURRENCY = 8
+# Reconstructor jobs run concurrently per Gb/s of NIC speed, rebuilding a
+# fragment reads the others from as many nodes.
+RECONSTRUCTORS_PER_GBPS = 1
+MAX_RECONSTRUCTOR_CONCURRENCY = 8
+# Database rows sent per replication request, per Gb/s of NIC speed.
+PER_DIFF_PER_GBPS = 1000
+MAX_PER_DIFF = 10000
+
+KiB = 1024
+MiB = 1024 * KiB
+GiB = 1024 * MiB
+TiB = 1024 * GiB
+# sysfs block device sizes are in 512 byte sectors whatever the device's
+# logical block size
+SECTOR_SIZE = 512
+# Objects up to swift's default keep_cache_size of 5MiB are cached with
+# 1GiB of RAM per TiB of storage, the cut off grows with that ratio but is
+# never below swift's default.
+KEEP_CACHE_SIZE = 5 * MiB
+MAX_KEEP_CACHE_SIZE = 64 * MiB
+# RAM per TiB of storage above which private objects are cached too
+KEEP_CACHE_PRIVATE_RAM = 4 * GiB
+# Space kept free on each device, as a percentage of its own size
+FALLOCATE_RESERVE = '1%'
+# Seconds allowed for an upload; a 5GiB object at about 60KB/s.
+MAX_UPLOAD_TIME = 86400
+
+
+def read_sysfs(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except IOError:
+        return None
+
+
+def sysfs_device(device, sysfs_block=SYSFS_BLOCK):
+    """Return the sysfs directory of a block device path."""
+    return os.path.realpath(os.path.join(sysfs_block, kernel_name(device)))
+
+
+def device_size(device, sysfs_block=SYSFS_BLOCK):
+    """Return the size of device in bytes, or None if unknown."""
+    size = read_sysfs(os.path.join(sysfs_device(device, sysfs_block),
+                                   'size'))
+    return int(size) * SECTOR_SIZE if size is not None else None
+
+
+def rotational(device, sysfs_block=SYSFS_BLOCK):
+    """Tell whether device is a spinning disk.
+
+    :returns: 1 if rotational, 0 if not, None if unknown
+    """
+    sysfs = sysfs_device(device, sysfs_block)
+    # partitions have no queue of their own, use their disk's
+    value = (read_sysfs(os.path.join(sysfs, 'queue/rotational')) or
+             read_sysfs(os.path.join(os.path.dirname(sysfs),
+                                     'queue/rotational')))
+    return int(value) if value is not None else None
+
+
+def nic_speed(sysfs_net=SYSFS_NET):
+    """Return the speed of the fastest physical NIC in Mb/s.
+
+    Virtual interfaces have no device link in sysfs, and interfaces which
+    are down fail to report a speed or report -1.
+    """
+    speeds = []
+    try:
+        names = os.listdir(sysfs_net)
+    except OSError:
+        names = []
+    for name in names:
+        if not os.path.exists(os.path.join(sysfs_net, name, 'device')):
+            continue
+        try:
+            speeds.append(int(read_sysfs(
+                os.path.join(sysfs_net, name, 'speed'))))
+        except (TypeError, ValueError):
+            continue
+    speeds = [s for s in speeds if s > 0]
+    return max(speeds) if speeds else DEFAULT_NIC_SPEED
+
+
+def daemon_tuning(devices, ssd, nic_mbps):
+    """Derive the background daemon settings of a node.
+
+    The auditor, replicator and reconstructor fork a process per group of
+    devices so that a pass over a node with many disks does not take
+    proportionally longer, while every process keeps to its device class
+    rates. Updater and reconstructor concurrency and database replication
+    batches grow with the NIC speed.
+
+    :param devices: number of storage devices
+    :param ssd: whether the devices are mostly solid state
+    :param nic_mbps: NIC speed in Mb/s
+    :returns: dict of option name -> value
+    """
+    rates = DEVICE_CLASS_RATES['ssd' if ssd else 'hdd']
+    gbps = max(1, nic_mbps // 1000)
+    per_diff = min(MAX_PER_DIFF, PER_DIFF_PER_GBPS * gbps)
+    # 0 keeps the work in the replicator's or reconstructor's own process
+    replicator_workers = 0
+    if devices > DEVICES_PER_REPLICATOR:
+        replicator_workers = int(math.ceil(
+            devices / float(DEVICES_PER_REPLICATOR)))
+    return {
+        'object-auditor-concurrency': max(
+            1, int(math.ceil(devices / float(DEVICES_PER_AUDITOR)))),
+        'object-auditor-files-per-second': rates[
+            'object-auditor-files-per-second'],
+        'object-auditor-bytes-per-second': rates[
+            'object-auditor-bytes-per-second'],
+        'object-auditor-zero-byte-files-per-second': rates[
+            'object-auditor-zero-byte-files-per-second'],
+        'object-updater-concurrency': max(
+            MIN_UPDATER_CONCURRENCY,
+            min(devices // 2, UPDATERS_PER_GBPS * gbps)),
+        'object-updater-objects-per-second': rates[
+            'object-updater-objects-per-second'],
+        'object-replicator-run-pause': REPLICATOR_RUN_PAUSE,
+        'object-replicator-node-timeout': REPLICATOR_NODE_TIMEOUT,
+        'object-replicator-workers': replicator_workers,
+        'object-reconstructor-concurrency': min(
+            MAX_RECONSTRUCTOR_CONCURRENCY, RECONSTRUCTORS_PER_GBPS * gbps),
+        'object-reconstructor-workers': replicator_workers,
+        'container-replicator-per-diff': per_diff,
+        'container-replicator-max-diffs': rates['replicator-max-diffs'],
+        'account-replicator-per-diff': per_diff,
+        'account-replicator-max-diffs': rates['replicator-max-diffs'],
+    }
+
+
+def network_chunk_size(nic_mbps):
+    if nic_mbps >= 25000:
+        return 1 * MiB
+    if nic_mbps >= 10000:
+        return 256 * KiB
+    return 64 * KiB
+
+
+def object_server_tuning(ram, nic_mbps, device_sizes, ssd):
+    """Derive the object server data path settings of a node.
+
+    The page cache is worth using for more and larger objects the more RAM
+    the node has per byte of storage. Larger network chunks cut the
+    per-chunk overhead on fast NICs, larger disk chunks the seeks of
+    spinning disks, and nodes with little RAM sync writes more often to
+    limit the dirty pages built up by uploads.
+
+    :param ram: RAM in bytes
+    :param nic_mbps: NIC speed in Mb/s
+    :param device_sizes: sizes of the storage devices in bytes
+    :param ssd: whether the devices are mostly solid state
+    :returns: dict of option name -> value
+    """
+    storage = sum(device_sizes)
+    ram_per_tib = float(ram) * TiB / storage if storage else ram
+    keep_cache_size = int(KEEP_CACHE_SIZE * ram_per_tib / GiB)
+    return {
+        'object-server-disk-chunk-size': 64 * KiB if ssd else 256 * KiB,
+        'object-server-network-chunk-size': network_chunk_size(nic_mbps),
+        'object-server-keep-cache-size': min(
+            MAX_KEEP_CACHE_SIZE, max(KEEP_CACHE_SIZE, keep_cache_size)),
+        'object-server-keep-cache-private': (
+            ram_per_tib >= KEEP_CACHE_PRIVATE_RAM),
+        'object-server-mb-per-sync': min(512, max(64, 4 * ram // GiB)),
+        'object-server-max-upload-time': MAX_UPLOAD_TIME,
+        'object-server-fallocate-reserve': FALLOCATE_RESERVE,
+        'object-server-client-timeout': 60 if nic_mbps >= 10000 else 120,
+        'object-server-max-clients': min(
+            4096, max(1024, nic_mbps // 1000 * 100)),
+    }
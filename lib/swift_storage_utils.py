@@ -1,9 +1,11 @@
+import contextlib
 import json
 import os
 import re
 import subprocess
 import shutil
 import tempfile
+import time
 import uuid
 
 from subprocess import check_call, call, CalledProcessError, check_output
@@ -17,9 +19,38 @@ from lib.misc_utils import (
 )
 
 from lib.swift_storage_context import (
+    DaemonTuningContext,
+    ObjectServerTuningContext,
+    ServerWorkerContext,
     SwiftStorageContext,
     SwiftStorageServerContext,
     RsyncContext,
+    format_worker_plan,
+    replication_ip,
+    replication_servers_enabled,
+    statsd_aggregator_enabled,
+    worker_plan,
+)
+
+from lib.swift_storage_services import (
+    check_services,
+    rolling_restart,
+)
+
+from lib.swift_storage_profiler import phase
+
+from lib.swift_storage_tuning import (
+    SYSFS_BLOCK,
+    device_size,
+    rotational,
+)
+
+from lib.swift_storage_diskstats import (
+    device_stats,
+    find_outliers,
+    format_outliers,
+    kernel_name,
+    read_diskstats,
 )
 
 from charmhelpers.fetch import (
@@ -37,12 +68,19 @@ from charmhelpers.core.host import (
     mkdir,
     mount,
     fstab_add,
+    umount,
     service_restart,
+    service_stop,
+    init_is_systemd,
     lsb_release,
+    rsync,
     CompareHostReleases,
 )
 
+from charmhelpers.core.templating import render
+
 from charmhelpers.core.hookenv import (
+    charm_dir,
     config,
     log,
     DEBUG,
@@ -57,10 +95,15 @@ from charmhelpers.core.hookenv import (
     ingress_address,
     storage_list,
     storage_get,
+    status_get,
+    status_set,
 )
 
 from charmhelpers.contrib.network import ufw
-from charmhelpers.contrib.network.ip import get_host_ip
+from charmhelpers.contrib.network.ip import (
+    get_host_ip,
+    get_relation_ip,
+)
 
 from charmhelpers.contrib.storage.linux.utils import (
     is_block_device,
@@ -73,6 +116,7 @@ from charmhelpers.contrib.storage.linux.loopback import (
 )
 
 from charmhelpers.contrib.openstack.utils import (
+    CompareOpenStackReleases,
     configure_installation_source,
     get_os_codename_install_source,
     get_os_codename_package,
@@ -100,6 +144,21 @@ PACKAGES = [
 
 VERSION_PACKAGE = 'swift-account'
 
+STORAGE_MOUNT_PATH = '/srv/node'
+
+# devstore statuses of devices which are in the rings. Draining devices
+# are published with a reduced weight until their partitions have moved,
+# then unmounted and marked inactive.
+RINGED_STATUSES = ('active', 'draining')
+DRAIN_STEP = 0.25
+DATA_DIR_PREFIXES = ('accounts', 'containers', 'objects')
+
+DEVICE_CLASSES = ('ssd', 'hdd')
+RINGS = ('account', 'container', 'object')
+
+# invoke-rc.d policy used to hold service restarts during staged upgrades
+POLICY_RC = '/usr/sbin/policy-rc.d'
+
 TEMPLATES = 'templates/'
 
 REQUIRED_INTERFACES = {
@@ -114,22 +173,38 @@ ACCOUNT_SVCS = [
 CONTAINER_SVCS = [
     'swift-container', 'swift-container-auditor',
     'swift-container-updater', 'swift-container-replicator',
-    'swift-container-sync'
+    'swift-container-sync', 'swift-container-sharder'
 ]
 
 OBJECT_SVCS = [
     'swift-object', 'swift-object-auditor',
-    'swift-object-updater', 'swift-object-replicator'
+    'swift-object-updater', 'swift-object-replicator',
+    'swift-object-reconstructor'
 ]
 
 SWIFT_SVCS = ACCOUNT_SVCS + CONTAINER_SVCS + OBJECT_SVCS
 
+# Servers only answering replication requests, run with replication-servers
+REPLICATION_SVCS = [
+    'swift-account-replication', 'swift-container-replication',
+    'swift-object-replication'
+]
+REPLICATION_UNIT_TEMPLATE = 'swift-replication-server.service'
+
 RESTART_MAP = {
     '/etc/rsync-juju.d/050-swift-storage.conf': ['rsync'],
     '/etc/swift/account-server.conf': ACCOUNT_SVCS,
     '/etc/swift/container-server.conf': CONTAINER_SVCS,
     '/etc/swift/object-server.conf': OBJECT_SVCS,
-    '/etc/swift/swift.conf': ACCOUNT_SVCS + CONTAINER_SVCS + OBJECT_SVCS
+    '/etc/swift/account-replication-server.conf': [
+        'swift-account-replication'],
+    '/etc/swift/container-replication-server.conf': [
+        'swift-container-replication'],
+    '/etc/swift/object-replication-server.conf': [
+        'swift-object-replication'],
+    '/etc/swift/internal-client.conf': ['swift-container-sharder'],
+    '/etc/swift/swift.conf': (ACCOUNT_SVCS + CONTAINER_SVCS + OBJECT_SVCS +
+                              REPLICATION_SVCS)
 }
 
 SWIFT_CONF_DIR = '/etc/swift'
@@ -147,6 +222,16 @@ FIRST = 1
 # FIXME: add charm support for removing devices (see LP: #1448190)
 KV_DB_PATH = '/var/lib/juju/swift_storage/charm_kvdata.db'
 
+# Duration of the last run of each hook, read by the metrics exporter.
+HOOK_STATS_PATH = '/var/lib/juju/swift_storage/hook-stats.json'
+
+EXPORTER_UNIT = 'swift-storage-exporter'
+EXPORTER_BIN = '/usr/local/lib/swift-storage/swift_storage_exporter.py'
+STATSD_AGGREGATOR_UNIT = 'swift-statsd-aggregator'
+STATSD_AGGREGATOR_BIN = \
+    '/usr/local/lib/swift-storage/swift_statsd_aggregator.py'
+SYSTEMD_SYSTEM_DIR = '/etc/systemd/system'
+
 
 def ensure_swift_directories():
     '''
@@ -162,6 +247,33 @@ def ensure_swift_directories():
      if not os.path.isdir(d)]
 
 
+def swift_services():
+    """Return the swift services run on this unit."""
+    services = SWIFT_SVCS[:]
+    # The object reconstructor, for erasure coded policies, came with Liberty
+    release = get_os_codename_package('swift-object', fatal=False)
+    if release and CompareOpenStackReleases(release) < 'liberty':
+        services.remove('swift-object-reconstructor')
+    # and the container sharder with Rocky
+    if release and CompareOpenStackReleases(release) < 'rocky':
+        services.remove('swift-container-sharder')
+    if replication_servers_enabled():
+        services += REPLICATION_SVCS
+    return services
+
+
+def restart_map():
+    """Return RESTART_MAP restricted to the services run on this unit."""
+    services = swift_services()
+    _map = {}
+    for path, path_services in RESTART_MAP.items():
+        path_services = [s for s in path_services
+                         if s in services or not s.startswith('swift-')]
+        if path_services:
+            _map[path] = path_services
+    return _map
+
+
 def register_configs():
     release = get_os_codename_package('python-swift', fatal=False) or 'essex'
     configs = templating.OSConfigRenderer(templates_dir=TEMPLATES,
@@ -172,12 +284,21 @@ def register_configs():
                      [RsyncContext(), SwiftStorageServerContext()])
     # NOTE: add VaultKVContext so interface status can be assessed
     for server in ['account', 'object', 'container']:
-        configs.register('/etc/swift/%s-server.conf' % server,
-                         [SwiftStorageServerContext(),
-                          context.BindHostContext(),
-                          context.WorkerConfigContext(),
-                          vaultlocker.VaultKVContext(
-                              vaultlocker.VAULTLOCKER_BACKEND)]),
+        contexts = [SwiftStorageServerContext(),
+                    context.BindHostContext(),
+                    ServerWorkerContext(server),
+                    DaemonTuningContext()]
+        if server == 'object':
+            contexts.append(ObjectServerTuningContext())
+        contexts.append(
+            vaultlocker.VaultKVContext(vaultlocker.VAULTLOCKER_BACKEND))
+        configs.register('/etc/swift/%s-server.conf' % server, contexts)
+        if replication_servers_enabled():
+            configs.register('/etc/swift/%s-replication-server.conf' % server,
+                             contexts)
+    # the sharder talks to the cluster through an internal proxy
+    if 'swift-container-sharder' in swift_services():
+        configs.register('/etc/swift/internal-client.conf', [])
     return configs
 
 
@@ -192,7 +313,18 @@ def swift_init(target, action, fatal=False):
     return call(cmd)
 
 
-def do_openstack_upgrade(configs):
+def do_openstack_upgrade(configs, staged=None):
+    """Upgrade to the OpenStack release of the openstack-origin config.
+
+    A staged upgrade downloads the new packages while the services keep
+    serving, then installs them without letting the packages restart
+    services and finally restarts the services with rolling_restart().
+
+    :param staged: run a staged upgrade, the staged-openstack-upgrade config
+                   option is used if None
+    :returns: dict of staged upgrade phase -> seconds taken, empty if the
+              upgrade was not staged
+    """
     new_src = config('openstack-origin')
     new_os_rel = get_os_codename_install_source(new_src)
 
@@ -202,13 +334,71 @@ def do_openstack_upgrade(configs):
         '--option', 'Dpkg::Options::=--force-confnew',
         '--option', 'Dpkg::Options::=--force-confdef',
     ]
-    apt_update()
-    apt_upgrade(options=dpkg_opts, fatal=True, dist=True)
-    configs.set_release(openstack_release=new_os_rel)
-    configs.write_all()
+    if staged is None:
+        staged = config('staged-openstack-upgrade')
+    if not staged:
+        apt_update()
+        apt_upgrade(options=dpkg_opts, fatal=True, dist=True)
+        configs.set_release(openstack_release=new_os_rel)
+        configs.write_all()
+        if not is_paused():
+            for service in swift_services():
+                service_restart(service)
+        return {}
+
+    timings = {}
+
+    @contextlib.contextmanager
+    def timed(name):
+        start = time.time()
+        with phase('openstack_upgrade_' + name):
+            yield
+        timings[name] = round(time.time() - start, 3)
+
+    with timed('download'):
+        apt_update()
+        apt_upgrade(options=dpkg_opts + ['--download-only'], fatal=True,
+                    dist=True)
+    with timed('install'):
+        with services_held():
+            apt_upgrade(options=dpkg_opts, fatal=True, dist=True)
+        configs.set_release(openstack_release=new_os_rel)
+        configs.write_all()
     if not is_paused():
-        for service in SWIFT_SVCS:
-            service_restart(service)
+        with timed('restart'):
+            failed = rolling_restart(swift_services())
+        if failed:
+            raise Exception("{} failed to restart after upgrade".format(
+                ", ".join(failed)))
+    log("Staged upgrade to {} took {}".format(
+        new_os_rel, ", ".join("{} {}s".format(k, timings[k])
+                              for k in ('download', 'install', 'restart')
+                              if k in timings)), level=INFO)
+    return timings
+
+
+@contextlib.contextmanager
+def services_held(policy_rc=None):
+    """Stop package maintainer scripts from (re)starting the swift services,
+    so that the restarts following an upgrade can be ordered by the charm.
+    Other services are left to their maintainer scripts since the charm does
+    not restart them.
+    """
+    policy_rc = policy_rc or POLICY_RC
+    if os.path.exists(policy_rc):
+        log("{} already exists, swift services are not held during the "
+            "upgrade".format(policy_rc), level=WARNING)
+        yield
+        return
+    with open(policy_rc, 'w') as f:
+        f.write('#!/bin/sh\n# Installed by the swift-storage charm during '
+                'upgrades\ncase "$1" in\n    swift-*) exit 101 ;;\nesac\n'
+                'exit 0\n')
+    os.chmod(policy_rc, 0o755)
+    try:
+        yield
+    finally:
+        os.remove(policy_rc)
 
 
 def _is_storage_ready(partition):
@@ -336,7 +526,7 @@ def is_device_in_ring(dev, skip_rel_check=False, ignore_deactivated=True):
         masterkey = "%s@%s" % (dev, env_uuid)
         if (masterkey in devstore and
                 devstore[masterkey].get('blkid') == blk_uuid and
-                devstore[masterkey].get('status') == 'active'):
+                devstore[masterkey].get('status') in RINGED_STATUSES):
             log("Device '%s' appears to be in use by Swift (found in local "
                 "devstore)" % (dev), level=INFO)
             return True
@@ -354,7 +544,7 @@ def is_device_in_ring(dev, skip_rel_check=False, ignore_deactivated=True):
 
         if ignore_deactivated:
             deactivated = [k == masterkey and v.get('blkid') == blk_uuid and
-                           v.get('status') != 'active'
+                           v.get('status') not in RINGED_STATUSES
                            for k, v in devstore.items()]
 
     if skip_rel_check:
@@ -444,6 +634,300 @@ def remember_devices(devs):
     kvstore.close()
 
 
+def devstore_devices(status='active'):
+    """Return the names of the devices in the local devstore.
+
+    :param status: only return devices with this status, all if None
+    """
+    if not os.path.exists(KV_DB_PATH):
+        return []
+    kvstore = KVStore(KV_DB_PATH)
+    devstore = devstore_safe_load(kvstore.get(key='devices')) or {}
+    kvstore.close()
+    return sorted(set(key.split('@')[0] for key, val in devstore.items()
+                      if status is None or val.get('status') == status))
+
+
+def remember_benchmarks(results, outliers):
+    """Save device benchmark results in the local devstore.
+
+    :param results: dict of device name -> benchmark results
+    :param outliers: dict of device name -> metrics the device is slow in
+    """
+    if not os.path.exists(KV_DB_PATH):
+        return
+    kvstore = KVStore(KV_DB_PATH)
+    devstore = devstore_safe_load(kvstore.get(key='devices')) or {}
+    timestamp = int(time.time())
+    for key, val in devstore.items():
+        dev = key.split('@')[0]
+        if dev in results and 'error' not in results[dev]:
+            val['benchmark'] = dict(results[dev], timestamp=timestamp,
+                                    outlier=outliers.get(dev, []))
+    kvstore.set(key='devices', value=json.dumps(devstore, sort_keys=True))
+    kvstore.flush()
+    kvstore.close()
+
+
+def device_metadata(devices):
+    """Describe devices for the proxy to weight them in the rings.
+
+    The size and rotational class are read from sysfs, the throughput score
+    is the mean sequential read and write MB/s measured by the last
+    benchmark-devices action, or None if the device was not benchmarked.
+
+    :param devices: device paths
+    :returns: dict of device name -> [size in bytes, 1 if rotational else 0,
+              throughput score], None for values which cannot be read
+    """
+    benchmarks = {}
+    if os.path.exists(KV_DB_PATH):
+        kvstore = KVStore(KV_DB_PATH)
+        devstore = devstore_safe_load(kvstore.get(key='devices')) or {}
+        kvstore.close()
+        benchmarks = {k.split('@')[0]: v['benchmark']
+                      for k, v in devstore.items() if 'benchmark' in v}
+
+    metadata = {}
+    for dev in devices:
+        name = os.path.basename(dev)
+        score = None
+        if name in benchmarks:
+            bench = benchmarks[name]
+            score = round((bench.get('seq-read-mbps', 0) +
+                           bench.get('seq-write-mbps', 0)) / 2.0, 1)
+        metadata[name] = [
+            device_size(dev, SYSFS_BLOCK),
+            rotational(dev, SYSFS_BLOCK),
+            score,
+        ]
+    return metadata
+
+
+def parse_device_class_overrides(overrides):
+    """Parse the device-class-overrides option, e.g. 'sdb:ssd sdc:hdd'.
+
+    :returns: dict of device name -> class
+    :raises: ValueError on entries which are not device:class with a known
+             class
+    """
+    classes = {}
+    for entry in (overrides or '').split():
+        dev, _, cls = entry.partition(':')
+        if not dev or cls not in DEVICE_CLASSES:
+            raise ValueError("Invalid device class override '{}', expected "
+                             "device:{}".format(entry,
+                                                '|'.join(DEVICE_CLASSES)))
+        classes[os.path.basename(dev)] = cls
+    return classes
+
+
+def device_classes(devices):
+    """Classify devices as ssd or hdd and remember the classes in the local
+    devstore.
+
+    Classes come from device-class-overrides, then from the devstore, then
+    from the rotational flag in sysfs. Remembering the first detected class
+    keeps a device in the same rings should sysfs later report it
+    differently, e.g. once it sits behind dm-crypt. Devices of unknown class
+    are taken to be hdd.
+
+    :param devices: device paths
+    :returns: dict of device name -> class
+    """
+    try:
+        overrides = parse_device_class_overrides(
+            config('device-class-overrides'))
+    except ValueError as e:
+        log("Ignoring device-class-overrides: {}".format(e), level=WARNING)
+        overrides = {}
+    paths = {os.path.basename(d): d for d in devices}
+    classes = {}
+
+    def classify(dev, remembered=None):
+        return (overrides.get(dev) or remembered or
+                ('ssd' if rotational(paths[dev], SYSFS_BLOCK) == 0
+                 else 'hdd'))
+
+    def update(devstore):
+        changed = False
+        for key, val in devstore.items():
+            dev = key.split('@')[0]
+            if dev in paths:
+                classes[dev] = classify(dev, val.get('class'))
+                changed |= val.get('class') != classes[dev]
+                val['class'] = classes[dev]
+        return changed
+
+    _update_devstore(update)
+    for dev in paths:
+        if dev not in classes:
+            classes[dev] = classify(dev)
+    return classes
+
+
+def ring_devices(classes):
+    """Assign devices to the account, container and object rings.
+
+    On nodes with both classes of devices, and if separate-db-devices is
+    set, the account and container databases go on the ssds and objects on
+    the hdds. Otherwise every device is in every ring.
+
+    :param classes: dict of device name -> class, see device_classes()
+    :returns: dict of ring -> sorted list of device names
+    """
+    ssds = sorted(d for d, c in classes.items() if c == 'ssd')
+    hdds = sorted(d for d, c in classes.items() if c != 'ssd')
+    if ssds and hdds and config('separate-db-devices'):
+        return {'account': ssds, 'container': ssds, 'object': hdds}
+    return {ring: sorted(classes) for ring in RINGS}
+
+
+def encode_device_metadata(metadata):
+    """Encode device_metadata() as compact JSON with stable ordering, so
+    that the relation setting only changes when the devices do.
+    """
+    return json.dumps(metadata, sort_keys=True, separators=(',', ':'))
+
+
+def count_partitions(dev):
+    """Count the partition directories held by a storage device, across
+    the account, container and every object policy data directory.
+    """
+    path = os.path.join(STORAGE_MOUNT_PATH, dev)
+    count = 0
+    try:
+        data_dirs = [d for d in os.listdir(path)
+                     if d.split('-')[0] in DATA_DIR_PREFIXES]
+    except OSError:
+        return 0
+    for data_dir in data_dirs:
+        try:
+            count += len([p for p in os.listdir(os.path.join(path, data_dir))
+                          if p.isdigit()])
+        except OSError:
+            pass
+    return count
+
+
+def _update_devstore(update):
+    """Apply update(devstore) to the local devstore, saving it if update
+    returns True.
+    """
+    if not os.path.exists(KV_DB_PATH):
+        return False
+    kvstore = KVStore(KV_DB_PATH)
+    devstore = devstore_safe_load(kvstore.get(key='devices')) or {}
+    changed = update(devstore)
+    if changed:
+        kvstore.set(key='devices', value=json.dumps(devstore, sort_keys=True))
+        kvstore.flush()
+    kvstore.close()
+    return changed
+
+
+def start_drain(dev, step=DRAIN_STEP):
+    """Start draining a device, or reduce its weight further if it is
+    already draining.
+
+    :returns: the devstore entry of the device
+    :raises: ValueError if the device is not in the rings
+    """
+    entries = []
+
+    def update(devstore):
+        for key, val in devstore.items():
+            if (key.split('@')[0] == dev and
+                    val.get('status') in RINGED_STATUSES):
+                partitions = count_partitions(dev)
+                if val['status'] != 'draining':
+                    val['status'] = 'draining'
+                    val['drain-weight'] = 1.0
+                    val['drain-start-partitions'] = partitions
+                val['drain-weight'] = round(
+                    max(0.0, val['drain-weight'] - step), 3)
+                val['drain-step'] = step
+                val['drain-partitions'] = partitions
+                entries.append(val)
+        return bool(entries)
+
+    if not _update_devstore(update):
+        raise ValueError("Device {} is not in the rings".format(dev))
+    return entries[0]
+
+
+def update_drains():
+    """Follow the progress of draining devices.
+
+    The weight of a draining device is reduced by its drain step once the
+    share of partitions matching its current weight has moved off it. A
+    device whose weight has reached zero is unmounted and marked inactive
+    once it holds no more partitions, or left draining until the next call
+    if it cannot be unmounted.
+
+    :returns: True if any weight or status changed and the relation must be
+              updated
+    """
+    republish = []
+
+    def update(devstore):
+        saved = False
+        for key, val in devstore.items():
+            if val.get('status') != 'draining':
+                continue
+            dev = key.split('@')[0]
+            partitions = count_partitions(dev)
+            saved = saved or val.get('drain-partitions') != partitions
+            val['drain-partitions'] = partitions
+            weight = val['drain-weight']
+            if weight == 0 and partitions == 0:
+                log("Device {} drained, unmounting".format(dev), level=INFO)
+                if umount(os.path.join(STORAGE_MOUNT_PATH, dev),
+                          persist=True):
+                    val['status'] = 'inactive'
+                    republish.append(dev)
+                else:
+                    # e.g. busy while swift daemons hold it open, retried
+                    # on the next hook
+                    log("Unable to unmount drained device {}".format(dev),
+                        level=WARNING)
+            elif (weight > 0 and
+                    partitions <= val['drain-start-partitions'] * weight):
+                val['drain-weight'] = round(
+                    max(0.0, weight - val['drain-step']), 3)
+                log("Reducing weight of draining device {} to {}".format(
+                    dev, val['drain-weight']), level=INFO)
+                republish.append(dev)
+        return saved or bool(republish)
+
+    _update_devstore(update)
+    return bool(republish)
+
+
+def draining_devices():
+    """Return the draining devices.
+
+    :returns: sorted list of (device name, partitions left, weight)
+    """
+    if not os.path.exists(KV_DB_PATH):
+        return []
+    kvstore = KVStore(KV_DB_PATH)
+    devstore = devstore_safe_load(kvstore.get(key='devices')) or {}
+    kvstore.close()
+    return sorted((key.split('@')[0], val.get('drain-partitions'),
+                   val['drain-weight'])
+                  for key, val in devstore.items()
+                  if val.get('status') == 'draining')
+
+
+def drain_weights():
+    """Return the relative weights of the draining devices.
+
+    :returns: dict of device name -> weight between 0 and 1
+    """
+    return {dev: weight for dev, _, weight in draining_devices()}
+
+
 def ensure_devs_tracked():
     for rid in relation_ids('swift-storage'):
         devs = relation_get(attribute='device', rid=rid, unit=local_unit())
@@ -562,18 +1046,23 @@ def setup_storage(encrypt=False):
 
 
 @retry_on_exception(3, base_delay=2, exc_type=CalledProcessError)
-def fetch_swift_rings(rings_url):
+def fetch_swift_rings(rings_url, policies=()):
     """Fetch rings from leader proxy unit.
 
     Note that we support a number of retries if a fetch fails since we may
     have hit the very small update window on the proxy side.
+
+    :param policies: storage policy indexes, policy 0 uses the object ring
+                     and policy N the object-N ring
     """
     log('Fetching swift rings from proxy @ %s.' % rings_url, level=INFO)
     target = SWIFT_CONF_DIR
     tmpdir = tempfile.mkdtemp(prefix='swiftrings')
+    rings = ['account', 'object', 'container']
+    rings += ['object-%d' % index for index in sorted(policies) if index]
     try:
         synced = []
-        for server in ['account', 'object', 'container']:
+        for server in rings:
             url = '%s/%s.%s' % (rings_url, server, SWIFT_RING_EXT)
             log('Fetching %s.' % url, level=DEBUG)
             ring = '%s.%s' % (server, SWIFT_RING_EXT)
@@ -639,13 +1128,61 @@ gid = nogroup
 pid file = /var/run/rsyncd.pid
 syslog facility = daemon
 socket options = SO_KEEPALIVE
-
+"""
+    # keep replication off the client facing network when it has its own
+    address = replication_ip()
+    if address != get_relation_ip('swift-storage'):
+        rsyncd_base += "address = {}\n".format(address)
+    rsyncd_base += """
 &include /etc/rsync-juju.d
 """
 
-    f = open('/etc/rsyncd.conf', 'w')
-    f.write(rsyncd_base)
-    f.close()
+    with open('/etc/rsyncd.conf', 'w') as f:
+        f.write(rsyncd_base)
+
+
+def storage_device_names():
+    """Return the /proc/diskstats names of the prepared storage devices."""
+    return sorted(set(kernel_name(d)
+                      for d in kv().get('prepared-devices', [])))
+
+
+def find_slow_devices():
+    """Find storage devices much slower than their peers on this unit.
+
+    Statistics are computed over the time since the previous call from a
+    single read of /proc/diskstats, the previous sample being kept in the
+    unit kv store.
+
+    :returns: description of the slow devices, or None
+    """
+    factor = config('slow-disk-factor')
+    devices = storage_device_names()
+    if not factor or len(devices) < 2:
+        return None
+
+    now = time.time()
+    try:
+        current = read_diskstats()
+    except IOError as e:
+        log("Unable to read diskstats: {}".format(e), level=WARNING)
+        return None
+    current = {d: current[d] for d in devices if d in current}
+
+    db = kv()
+    previous = db.get('diskstats-sample')
+    db.set('diskstats-sample', {'timestamp': now, 'stats': current})
+    db.flush()
+    if not previous:
+        return None
+
+    stats = device_stats({d: tuple(v) for d, v in
+                          previous['stats'].items()},
+                         current, now - previous['timestamp'])
+    outliers = find_outliers(stats, factor)
+    if outliers:
+        return format_outliers(stats, outliers)
+    return None
 
 
 def assess_status(configs):
@@ -653,8 +1190,67 @@ def assess_status(configs):
     if is_paused():
         return ("maintenance",
                 "Paused. Use 'resume' action to resume normal service.")
-    else:
-        return ("active", "Unit is ready")
+
+    # the servers only run once the rings have been fetched from the proxy
+    if all(os.path.exists(os.path.join(SWIFT_CONF_DIR, '{}.{}'.format(
+            server, SWIFT_RING_EXT)))
+            for server in ['account', 'container', 'object']):
+        # in servers_per_port mode the object server only listens on the
+        # ports of the devices in the rings, which check_services cannot
+        # tell from newly added devices
+        ports = [config('{}-server-port'.format(server))
+                 for server in ['object', 'container', 'account']
+                 if server != 'object' or
+                 not config('object-servers-per-port')]
+        if replication_servers_enabled():
+            ports += [config('{}-replication-port'.format(server))
+                      for server in ['object', 'container', 'account']]
+        state, message = check_services(swift_services(), ports)
+        if state:
+            return state, message
+
+    try:
+        parse_device_class_overrides(config('device-class-overrides'))
+    except ValueError as e:
+        return ("blocked", str(e))
+
+    draining = draining_devices()
+    if draining:
+        return ("maintenance", "Draining {}".format(", ".join(
+            "{} ({} partitions left, weight {})".format(dev, parts, weight)
+            for dev, parts, weight in draining)))
+    return ("active", "Unit is ready")
+
+
+def report_worker_plan():
+    """Log the worker plan when it changes. A plan scaled down to fit
+    worker-memory-budget is also appended to the workload status message of
+    a ready unit.
+    """
+    plan = worker_plan()
+    db = kv()
+    if db.get('worker-plan') != plan:
+        log(format_worker_plan(plan), level=INFO)
+        db.set('worker-plan', plan)
+        db.flush()
+    if not plan['memory-limited']:
+        return
+    state, message = status_get()
+    if state == 'active':
+        status_set(state, "{}, {}".format(message, format_worker_plan(plan)))
+
+
+def report_slow_devices():
+    """Append the storage devices found slow since the previous hook to the
+    workload status message of a ready unit. A slow device degrades the unit
+    without stopping it, so the unit stays active.
+    """
+    slow = find_slow_devices()
+    if not slow:
+        return
+    state, message = status_get()
+    if state == 'active':
+        status_set(state, "{}, Slow devices: {}".format(message, slow))
 
 
 def grant_access(address, port):
@@ -678,6 +1274,68 @@ def revoke_access(address, port):
     ufw.revoke_access(address, port=port, proto='tcp')
 
 
+def object_device_ports(devices):
+    """Allocate a port to each device for servers_per_port mode.
+
+    Ports are allocated upwards from object-server-port-base and kept for
+    as long as the base is unchanged, so adding or removing a device never
+    moves the others to a different port in the rings.
+
+    :param devices: device names
+    :returns: dict of device name -> port
+    """
+    db = kv()
+    base = config('object-server-port-base')
+    ports = db.get('object-device-ports', {})
+    if db.get('object-device-port-base') != base:
+        ports = {}
+    allocated = dict(ports)
+    used = set(ports.values())
+    port = base
+    for dev in devices:
+        if dev in allocated:
+            continue
+        while port in used:
+            port += 1
+        allocated[dev] = port
+        used.add(port)
+    if allocated != ports:
+        db.set('object-device-ports', allocated)
+        db.set('object-device-port-base', base)
+        db.flush()
+    return {dev: allocated[dev] for dev in devices}
+
+
+def port_ranges(ports):
+    """Collapse ports into as few ufw port specifications as possible, e.g.
+    [6010, 6011, 6012, 6020] -> ['6010:6012', '6020'].
+    """
+    ranges = []
+    for port in sorted(set(ports)):
+        if ranges and ranges[-1][1] == port - 1:
+            ranges[-1][1] = port
+        else:
+            ranges.append([port, port])
+    return [str(first) if first == last else '{}:{}'.format(first, last)
+            for first, last in ranges]
+
+
+def storage_ports():
+    """Return the ports the swift servers listen on, as ufw port
+    specifications.
+    """
+    ports = [config('object-server-port'),
+             config('container-server-port'),
+             config('account-server-port')]
+    if config('object-servers-per-port'):
+        ports += port_ranges(kv().get('object-device-ports', {}).values())
+    if replication_servers_enabled():
+        ports += [config('object-replication-port'),
+                  config('container-replication-port'),
+                  config('account-replication-port')]
+    return ports
+
+
 def setup_ufw():
     """Setup UFW firewall to ensure only swift-storage clients and storage
     peers have access to the swift daemons.
@@ -690,9 +1348,7 @@ def setup_ufw():
         log("Firewall has been administratively disabled", "DEBUG")
         return
 
-    ports = [config('object-server-port'),
-             config('container-server-port'),
-             config('account-server-port')]
+    ports = storage_ports()
 
     # Storage peers
     allowed_hosts = RsyncContext()().get('allowed_hosts', '').split(' ')
@@ -710,3 +1366,179 @@ def setup_ufw():
     for port in ports:
         ufw.modify_access(src=None, dst='any', port=port,
                           proto='tcp', action='reject')
+
+
+def record_hook_duration(hook_name, duration):
+    """Record the duration of a hook run for the metrics exporter.
+
+    Failures are logged and ignored since statistics must never cause a hook
+    to fail.
+
+    :param hook_name: name of the hook that ran
+    :param duration: wall time taken by the hook in seconds
+    :return: None
+    """
+    try:
+        with open(HOOK_STATS_PATH) as f:
+            stats = json.load(f)
+    except (IOError, ValueError):
+        stats = {}
+
+    stats[hook_name] = {'duration': round(duration, 3),
+                        'timestamp': int(time.time())}
+    d = os.path.dirname(HOOK_STATS_PATH)
+    try:
+        if not os.path.isdir(d):
+            mkdir(d)
+        with tempfile.NamedTemporaryFile('w', dir=d, delete=False) as f:
+            json.dump(stats, f, sort_keys=True)
+        os.rename(f.name, HOOK_STATS_PATH)
+    except (IOError, OSError) as exc:
+        log("Unable to record hook duration: %s" % exc, level=WARNING)
+
+
+def install_systemd_units(name, script, ctxt):
+    """Install a charm provided script and its systemd unit(s).
+
+    Renders every <name>.service and <name>.timer template found in the
+    charm templates directory.
+
+    :param name: base name of the systemd units
+    :param script: (source, target) paths of the script run by the service,
+                   source is relative to the charm directory
+    :param ctxt: context used to render the unit templates
+    :returns: list of installed unit names
+    """
+    src, dst = script
+    mkdir(os.path.dirname(dst))
+    rsync(os.path.join(charm_dir(), src), dst)
+    units = []
+    for ext in ('service', 'timer'):
+        unit = '%s.%s' % (name, ext)
+        if os.path.exists(os.path.join(charm_dir(), TEMPLATES, unit)):
+            render(unit, os.path.join(SYSTEMD_SYSTEM_DIR, unit), ctxt,
+                   perms=0o644)
+            units.append(unit)
+    check_call(['systemctl', 'daemon-reload'])
+    return units
+
+
+def remove_systemd_units(name):
+    """Stop, disable and remove systemd units installed by
+    install_systemd_units.
+
+    :param name: base name of the systemd units
+    :return: None
+    """
+    removed = False
+    for ext in ('timer', 'service'):
+        unit = '%s.%s' % (name, ext)
+        path = os.path.join(SYSTEMD_SYSTEM_DIR, unit)
+        if os.path.exists(path):
+            log('Removing %s' % unit, level=INFO)
+            call(['systemctl', 'disable', unit])
+            service_stop(unit)
+            os.remove(path)
+            removed = True
+    if removed:
+        check_call(['systemctl', 'daemon-reload'])
+
+
+def configure_prometheus_exporter():
+    """Install or remove the node_exporter textfile metrics exporter.
+
+    The exporter is run from a systemd timer and writes its output into the
+    directory set by the prometheus-textfile-dir option. When the option is
+    unset the timer is disabled and removed.
+
+    :return: None
+    """
+    output_dir = config('prometheus-textfile-dir')
+    if not output_dir:
+        remove_systemd_units(EXPORTER_UNIT)
+        return
+
+    if not init_is_systemd():
+        log('Prometheus textfile exporter requires systemd', level=WARNING)
+        return
+
+    mkdir(output_dir, perms=0o755)
+    ctxt = {
+        'exporter_bin': EXPORTER_BIN,
+        'output_dir': output_dir,
+        'port': config('object-server-port'),
+        'interval': config('prometheus-exporter-interval'),
+    }
+    install_systemd_units(EXPORTER_UNIT,
+                          (os.path.join('files', 'prometheus',
+                                        'swift_storage_exporter.py'),
+                           EXPORTER_BIN),
+                          ctxt)
+    timer = '%s.timer' % EXPORTER_UNIT
+    check_call(['systemctl', 'enable', timer])
+    service_restart(timer)
+
+
+def configure_replication_servers():
+    """Install or remove the replication servers.
+
+    With replication-servers set, an account, container and object server
+    answering only replication requests runs on the replication address and
+    ports, so that replication does not compete with client requests for
+    the servers' workers.
+
+    :return: None
+    """
+    if not replication_servers_enabled():
+        if config('replication-servers'):
+            log('Replication servers require systemd', level=WARNING)
+        for service in REPLICATION_SVCS:
+            remove_systemd_units(service)
+        for server in ('account', 'container', 'object'):
+            path = os.path.join(SWIFT_CONF_DIR,
+                                '%s-replication-server.conf' % server)
+            if os.path.exists(path):
+                os.remove(path)
+        return
+
+    for service, server in zip(REPLICATION_SVCS,
+                               ('account', 'container', 'object')):
+        unit = '%s.service' % service
+        render(REPLICATION_UNIT_TEMPLATE,
+               os.path.join(SYSTEMD_SYSTEM_DIR, unit), {'server': server},
+               perms=0o644)
+    check_call(['systemctl', 'daemon-reload'])
+    check_call(['systemctl', 'enable'] +
+               ['%s.service' % s for s in REPLICATION_SVCS])
+
+
+def configure_statsd_aggregator():
+    """Install or remove the local statsd aggregator.
+
+    When statsd-local-aggregator is set along with statsd-host, the swift
+    daemons are pointed at an aggregator listening on localhost (see
+    SwiftStorageServerContext) which forwards batches to statsd-host.
+
+    :return: None
+    """
+    if not statsd_aggregator_enabled():
+        if config('statsd-local-aggregator') and config('statsd-host'):
+            log('Local statsd aggregator requires systemd', level=WARNING)
+        remove_systemd_units(STATSD_AGGREGATOR_UNIT)
+        return
+
+    ctxt = {
+        'aggregator_bin': STATSD_AGGREGATOR_BIN,
+        'listen_port': config('statsd-local-aggregator-port'),
+        'upstream_host': config('statsd-host'),
+        'upstream_port': config('statsd-port'),
+        'flush_interval': config('statsd-flush-interval'),
+    }
+    install_systemd_units(STATSD_AGGREGATOR_UNIT,
+                          (os.path.join('files', 'statsd',
+                                        'swift_statsd_aggregator.py'),
+                           STATSD_AGGREGATOR_BIN),
+                          ctxt)
+    service = '%s.service' % STATSD_AGGREGATOR_UNIT
+    check_call(['systemctl', 'enable', service])
+    service_restart(service)
@@ -43,69 +43,33 @@ class PauseTestCase(CharmTestCase):
 
     def setUp(self):
         super(PauseTestCase, self).setUp(
-            actions.actions, ["service_pause", "HookData", "kv",
+            actions.actions, ["stop_services", "action_get", "HookData", "kv",
                               "set_os_workload_status"])
 
         class FakeArgs(object):
             services = ['swift-account',
                         'swift-account-auditor',
-                        'swift-account-reaper',
-                        'swift-account-replicator',
-                        'swift-container',
-                        'swift-container-auditor',
-                        'swift-container-updater',
-                        'swift-container-replicator',
-                        'swift-container-sync',
                         'swift-object',
-                        'swift-object-auditor',
-                        'swift-object-updater',
                         'swift-object-replicator']
         self.args = FakeArgs()
+        self.action_get.return_value = 30
+        self.stop_services.return_value = []
 
     def test_pauses_services(self):
-        """Pause action pauses all of the Swift services."""
-        pause_calls = []
-
-        def fake_service_pause(svc):
-            pause_calls.append(svc)
-            return True
-
-        self.service_pause.side_effect = fake_service_pause
-
+        """Pause action stops all of the Swift services."""
         actions.actions.pause(self.args)
-        self.assertEqual(pause_calls, ['swift-account',
-                                       'swift-account-auditor',
-                                       'swift-account-reaper',
-                                       'swift-account-replicator',
-                                       'swift-container',
-                                       'swift-container-auditor',
-                                       'swift-container-updater',
-                                       'swift-container-replicator',
-                                       'swift-container-sync',
-                                       'swift-object',
-                                       'swift-object-auditor',
-                                       'swift-object-updater',
-                                       'swift-object-replicator'])
-
-    def test_bails_out_early_on_error(self):
-        """Pause action fails early if there are errors stopping a service."""
-        pause_calls = []
-
-        def maybe_kill(svc):
-            if svc == "swift-container":
-                return False
-            else:
-                pause_calls.append(svc)
-                return True
-
-        self.service_pause.side_effect = maybe_kill
+        self.action_get.assert_called_once_with('drain-timeout')
+        self.stop_services.assert_called_once_with(self.args.services, 30)
+
+    def test_bails_out_on_error(self):
+        """Pause action fails if there are errors stopping a service."""
+        self.stop_services.return_value = ['swift-account-auditor',
+                                           'swift-object-replicator']
         self.assertRaisesRegexp(
-            Exception, "swift-container didn't stop cleanly.",
+            Exception, "swift-account-auditor, swift-object-replicator "
+                       "didn't stop cleanly.",
             actions.actions.pause, self.args)
-        self.assertEqual(pause_calls, ['swift-account',
-                                       'swift-account-auditor',
-                                       'swift-account-reaper',
-                                       'swift-account-replicator'])
+        self.assertFalse(self.kv().set.called)
 
     def test_pause_sets_value(self):
         """Pause action sets the unit-paused value to True."""
@@ -119,68 +83,31 @@ class ResumeTestCase(CharmTestCase):
 
     def setUp(self):
         super(ResumeTestCase, self).setUp(
-            actions.actions, ["service_resume", "HookData", "kv",
-                              "set_os_workload_status"])
+            actions.actions, ["start_services", "action_get", "HookData",
+                              "kv", "set_os_workload_status"])
 
         class FakeArgs(object):
             services = ['swift-account',
                         'swift-account-auditor',
-                        'swift-account-reaper',
-                        'swift-account-replicator',
-                        'swift-container',
-                        'swift-container-auditor',
-                        'swift-container-updater',
-                        'swift-container-replicator',
-                        'swift-container-sync',
                         'swift-object',
-                        'swift-object-auditor',
-                        'swift-object-updater',
                         'swift-object-replicator']
         self.args = FakeArgs()
+        self.action_get.return_value = 30
+        self.start_services.return_value = []
 
     def test_resumes_services(self):
-        """Resume action resumes all of the Swift services."""
-        resume_calls = []
-
-        def fake_service_resume(svc):
-            resume_calls.append(svc)
-            return True
-
-        self.service_resume.side_effect = fake_service_resume
+        """Resume action starts all of the Swift services."""
         actions.actions.resume(self.args)
-        self.assertEqual(resume_calls, ['swift-account',
-                                        'swift-account-auditor',
-                                        'swift-account-reaper',
-                                        'swift-account-replicator',
-                                        'swift-container',
-                                        'swift-container-auditor',
-                                        'swift-container-updater',
-                                        'swift-container-replicator',
-                                        'swift-container-sync',
-                                        'swift-object',
-                                        'swift-object-auditor',
-                                        'swift-object-updater',
-                                        'swift-object-replicator'])
-
-    def test_bails_out_early_on_error(self):
-        """Resume action fails early if there are errors starting a service."""
-        resume_calls = []
-
-        def maybe_kill(svc):
-            if svc == "swift-container":
-                return False
-            else:
-                resume_calls.append(svc)
-                return True
-
-        self.service_resume.side_effect = maybe_kill
+        self.action_get.assert_called_once_with('listen-timeout')
+        self.start_services.assert_called_once_with(self.args.services, 30)
+
+    def test_bails_out_on_error(self):
+        """Resume action fails if there are errors starting a service."""
+        self.start_services.return_value = ['swift-object']
         self.assertRaisesRegexp(
-            Exception, "swift-container didn't start cleanly.",
+            Exception, "swift-object didn't start cleanly.",
             actions.actions.resume, self.args)
-        self.assertEqual(resume_calls, ['swift-account',
-                                        'swift-account-auditor',
-                                        'swift-account-reaper',
-                                        'swift-account-replicator'])
+        self.assertFalse(self.kv().set.called)
 
     def test_resume_sets_value(self):
         """Resume action sets the unit-paused value to False."""
@@ -190,6 +117,100 @@ class ResumeTestCase(CharmTestCase):
         self.kv().set.assert_called_with('unit-paused', False)
 
 
+class DeviceCapacityTestCase(CharmTestCase):
+
+    def setUp(self):
+        super(DeviceCapacityTestCase, self).setUp(
+            actions.actions, ["action_set", "capacity_report",
+                              "devstore_devices"])
+
+    def test_no_devices(self):
+        self.devstore_devices.return_value = []
+        self.capacity_report.return_value = {'devices': {}, 'mean-fill': 0.0,
+                                             'mean-inode-fill': 0.0}
+        actions.actions.device_capacity([])
+        self.action_set.assert_called_once_with(
+            {'message': 'No storage devices found in the devstore'})
+
+    def test_device_capacity(self):
+        self.devstore_devices.return_value = ['sdb']
+        self.capacity_report.return_value = {
+            'devices': {'sdb': {'fill': 0.5, 'weight-factor': 1.0}},
+            'mean-fill': 0.5, 'mean-inode-fill': 0.1}
+        actions.actions.device_capacity([])
+        self.capacity_report.assert_called_once_with(['sdb'])
+        self.action_set.assert_called_once_with({
+            'devices': '{"sdb": {"fill": 0.5, "weight-factor": 1.0}}',
+            'mean-fill': 0.5,
+            'mean-inode-fill': 0.1})
+
+
+class BenchmarkDevicesTestCase(CharmTestCase):
+
+    def setUp(self):
+        super(BenchmarkDevicesTestCase, self).setUp(
+            actions.actions, ["action_get", "action_set", "action_fail",
+                              "devstore_devices", "remember_benchmarks",
+                              "run_benchmarks"])
+        self.action_get.side_effect = {'size': 16, 'duration': 2,
+                                       'outlier-factor': 2.0}.get
+
+    def test_benchmark_devices(self):
+        self.devstore_devices.return_value = ['sdb', 'sdc', 'sdd']
+        fast = {'seq-write-mbps': 200.0, 'seq-read-mbps': 200.0,
+                'rand-write-iops': 150.0, 'rand-read-iops': 150.0}
+        results = {'sdb': fast, 'sdc': fast,
+                   'sdd': dict(fast, **{'rand-read-iops': 10.0})}
+        self.run_benchmarks.return_value = results
+        actions.actions.benchmark_devices([])
+        self.run_benchmarks.assert_called_once_with(
+            {'sdb': '/srv/node/sdb', 'sdc': '/srv/node/sdc',
+             'sdd': '/srv/node/sdd'}, size=16 * 1024 * 1024, duration=2)
+        self.remember_benchmarks.assert_called_once_with(
+            results, {'sdd': ['rand-read-iops']})
+        self.assertEqual(self.action_set.call_args[0][0]['outliers'],
+                         '{"sdd": ["rand-read-iops"]}')
+        self.assertFalse(self.action_fail.called)
+
+    def test_benchmark_devices_error(self):
+        self.devstore_devices.return_value = ['sdb']
+        self.run_benchmarks.return_value = {'sdb': {'error': 'I/O error'}}
+        actions.actions.benchmark_devices([])
+        self.action_fail.assert_called_once_with("Unable to benchmark sdb")
+
+
+class DrainDeviceTestCase(CharmTestCase):
+
+    def setUp(self):
+        super(DrainDeviceTestCase, self).setUp(
+            actions.actions, ["action_get", "action_set", "action_fail",
+                              "relation_ids", "start_drain",
+                              "swift_storage_relation_joined",
+                              "set_os_workload_status"])
+        self.action_get.side_effect = {'device': '/dev/sdb',
+                                       'step': 0.25}.get
+        self.relation_ids.return_value = ['swift-storage:1']
+
+    def test_drain_device(self):
+        self.start_drain.return_value = {'status': 'draining',
+                                         'drain-weight': 0.75,
+                                         'drain-partitions': 1200}
+        actions.actions.drain_device([])
+        self.start_drain.assert_called_once_with('sdb', 0.25)
+        self.swift_storage_relation_joined.assert_called_once_with(
+            'swift-storage:1')
+        self.action_set.assert_called_once_with({'weight': 0.75,
+                                                 'partitions': 1200})
+
+    def test_drain_unknown_device(self):
+        self.start_drain.side_effect = ValueError(
+            "Device sdb is not in the rings")
+        actions.actions.drain_device([])
+        self.action_fail.assert_called_once_with(
+            "Device sdb is not in the rings")
+        self.assertFalse(self.swift_storage_relation_joined.called)
+
+
 class GetActionParserTestCase(unittest.TestCase):
 
     def test_definition_from_yaml(self):
@@ -245,3 +266,30 @@ class MainTestCase(CharmTestCase):
         with mock.patch.dict(actions.actions.ACTIONS, {"foo": dummy_action}):
             actions.actions.main([])
         self.assertEqual(dummy_calls, ["uh oh"])
+
+
+class HookProfileSummaryTestCase(CharmTestCase):
+
+    def setUp(self):
+        super(HookProfileSummaryTestCase, self).setUp(
+            actions.actions, ["action_get", "action_set", "load_traces"])
+
+    def test_no_traces(self):
+        self.load_traces.return_value = []
+        actions.actions.hook_profile_summary([])
+        self.action_set.assert_called_once_with(
+            {'message': 'No hook traces found, is profile-hooks enabled?'})
+
+    def test_summary(self):
+        self.action_get.return_value = 5
+        self.load_traces.return_value = [
+            {'hook': 'config-changed', 'timestamp': 1, 'duration': 10.0,
+             'phases': [], 'commands': []}]
+        actions.actions.hook_profile_summary([])
+        self.action_get.assert_called_once_with('limit')
+        self.action_set.assert_called_once_with({
+            'traces': 1,
+            'hooks': '[{"commands": 0, "duration": 10.0, '
+                     '"hook": "config-changed", "timestamp": 1}]',
+            'phases': '[]',
+            'commands': '[]'})
@@ -34,6 +34,8 @@ with patch('charmhelpers.contrib.hardening.harden.harden') as mock_dec:
 from unit_tests.test_utils import CharmTestCase
 
 TO_PATCH = [
+    'action_get',
+    'action_set',
     'config_changed',
     'do_openstack_upgrade',
 ]
@@ -70,3 +72,20 @@ class TestSwiftStorageUpgradeActions(CharmTestCase):
 
         self.assertFalse(self.do_openstack_upgrade.called)
         self.assertFalse(self.config_changed.called)
+
+    def test_upgrade_with_timings(self):
+        self.action_get.return_value = True
+        self.do_openstack_upgrade.return_value = {'download': 60.0,
+                                                  'install': 8.5}
+        configs = MagicMock()
+        openstack_upgrade.upgrade_with_timings(configs)
+        self.do_openstack_upgrade.assert_called_once_with(configs=configs,
+                                                          staged=True)
+        self.action_set.assert_called_once_with({'timings.download': 60.0,
+                                                 'timings.install': 8.5})
+
+    def test_upgrade_with_timings_not_staged(self):
+        self.action_get.return_value = None
+        self.do_openstack_upgrade.return_value = {}
+        openstack_upgrade.upgrade_with_timings(MagicMock())
+        self.assertFalse(self.action_set.called)
@@ -0,0 +1,99 @@
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from mock import patch
+
+sys.path.append('files/nrpe-external-master')
+import check_swift_services
+
+SYSTEMCTL_SHOW = """\
+Id=swift-object.service
+ActiveState=active
+SubState=running
+MainPID=1234
+NRestarts=0
+
+Id=swift-object-auditor.service
+ActiveState=failed
+SubState=failed
+MainPID=0
+NRestarts=3
+"""
+
+
+class CheckSwiftServicesTests(unittest.TestCase):
+
+    @patch('subprocess.check_output')
+    def test_systemd_states(self, check_output):
+        check_output.return_value = SYSTEMCTL_SHOW
+        states = check_swift_services.systemd_states(
+            ['swift-object', 'swift-object-auditor'])
+        check_output.assert_called_once_with(
+            ['systemctl', 'show',
+             '--property=Id,ActiveState,SubState,MainPID,NRestarts',
+             'swift-object.service', 'swift-object-auditor.service'],
+            universal_newlines=True)
+        self.assertEqual(states, {
+            'swift-object': (True, 'active (running)', 0),
+            'swift-object-auditor': (False, 'failed (failed)', 3)})
+
+    def test_pid_file(self):
+        self.assertEqual(check_swift_services.pid_file('swift-object'),
+                         '/var/run/swift/object-server.pid')
+        self.assertEqual(
+            check_swift_services.pid_file('swift-container-sync'),
+            '/var/run/swift/container-sync.pid')
+
+    def test_pid_states(self):
+        pid_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pid_dir)
+        with open(os.path.join(pid_dir, 'account-server.pid'), 'w') as f:
+            f.write('{}\n'.format(os.getpid()))
+        with open(os.path.join(pid_dir, 'account-reaper.pid'), 'w') as f:
+            f.write('0\n')
+        states = check_swift_services.pid_states(
+            ['swift-account', 'swift-account-reaper',
+             'swift-account-auditor'], pid_dir)
+        self.assertEqual(states, {
+            'swift-account': (True, 'running (pid {})'.format(os.getpid()),
+                              None),
+            'swift-account-reaper': (False, 'not running (stale pid 0)',
+                                     None),
+            'swift-account-auditor': (False, 'not running (no pid file)',
+                                      None)})
+
+    @patch('check_swift_services.init_is_systemd')
+    @patch('subprocess.check_output')
+    def test_main(self, check_output, init_is_systemd):
+        init_is_systemd.return_value = True
+        check_output.return_value = SYSTEMCTL_SHOW
+        with patch('sys.stdout') as stdout:
+            status = check_swift_services.main(['swift-object'])
+        self.assertEqual(status, check_swift_services.STATUS_OK)
+        stdout.write.assert_any_call(
+            "OK: 1 services running | 'swift-object_up'=1;;;0;1 "
+            "'swift-object_restarts'=0c")
+
+        with patch('sys.stdout') as stdout:
+            status = check_swift_services.main(['swift-object',
+                                                'swift-object-auditor'])
+        self.assertEqual(status, check_swift_services.STATUS_CRIT)
+        self.assertTrue(stdout.write.call_args_list[0][0][0].startswith(
+            'CRITICAL: swift-object-auditor is failed (failed) |'))
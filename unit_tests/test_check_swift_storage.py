@@ -12,8 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
 import datetime
+import http.client
+import os
+import shutil
+import socket
 import sys
+import tempfile
+import threading
 import unittest
 import urllib
 
@@ -27,10 +34,25 @@ from mock import (
 
 sys.path.append('files/nrpe-external-master')
 from check_swift_storage import (
+    HISTORY_RECORD,
+    ReplicationPass,
+    append_history,
+    check_async,
+    check_diskusage,
+    check_driveaudit,
     check_md5,
+    check_quarantined,
+    check_unmounted,
     check_replication,
+    check_sharding,
+    check_trends,
+    fetch_all,
+    format_perfdata,
     generate_md5,
+    read_history,
+    record_replication,
     repl_last_timestamp,
+    sharding_perfdata,
 )
 
 
@@ -96,7 +118,7 @@ class CheckSwiftStorageTestCase(unittest.TestCase):
         url = '{}ringmd5'.format(base_url)
         mock_urlopen.side_effect = ValueError(Mock(return_value=''))
         result = check_md5(base_url)
-        mock_urlopen.assert_called_with(url)
+        mock_urlopen.assert_called_with(url, timeout=5)
         self.assertEqual(result,
                          [(STATUS_UNKNOWN,
                            "Can't parse status data")])
@@ -109,7 +131,7 @@ class CheckSwiftStorageTestCase(unittest.TestCase):
         jdata = PropertyMock(return_value='X')
         mock_urlopen.return_value = MagicMock(read=jdata)
         result = check_md5('.')
-        mock_urlopen.assert_called_with('.ringmd5')
+        mock_urlopen.assert_called_with('.ringmd5', timeout=5)
         self.assertEqual(result,
                          [(STATUS_UNKNOWN,
                            "Can't parse status data")])
@@ -130,7 +152,7 @@ class CheckSwiftStorageTestCase(unittest.TestCase):
         with patch('urllib.request.urlopen') as mock_urlopen:
             mock_urlopen.return_value = MagicMock(read=pmock_jdata)
             result = check_md5('.')
-            mock_urlopen.assert_called_with('.ringmd5')
+            mock_urlopen.assert_called_with('.ringmd5', timeout=5)
             expected_result = [(STATUS_UNKNOWN,
                                 "Can't open ringfile "
                                 "/etc/swift/{}.ring.gz".format(name))
@@ -153,7 +175,7 @@ class CheckSwiftStorageTestCase(unittest.TestCase):
         with patch('urllib.request.urlopen') as mock_urlopen:
             mock_urlopen.return_value = MagicMock(read=pmock_jdata)
             result = check_md5('.')
-            mock_urlopen.assert_called_with('.ringmd5')
+            mock_urlopen.assert_called_with('.ringmd5', timeout=5)
             expected_result = [(STATUS_CRIT,
                                 'Ringfile /etc/swift/{}.ring.gz '
                                 'MD5 sum mismatch'.format(name))
@@ -176,7 +198,7 @@ class CheckSwiftStorageTestCase(unittest.TestCase):
         with patch('urllib.request.urlopen') as mock_urlopen:
             mock_urlopen.return_value = MagicMock(read=pmock_jdata)
             result = check_md5('.')
-            mock_urlopen.assert_called_with('.ringmd5')
+            mock_urlopen.assert_called_with('.ringmd5', timeout=5)
             self.assertEqual(result,
                              [(STATUS_OK, 'OK')])
 
@@ -413,3 +435,294 @@ class CheckSwiftStorageTestCase(unittest.TestCase):
         result = repl_last_timestamp(jdata)
         self.assertEqual(result,
                          (datetime.timedelta(0), 0))
+
+    @patch('urllib.request.urlopen')
+    def test_fetch_all_concurrent(self, mock_urlopen):
+        """
+        All urls are fetched with an explicit timeout and latency recorded
+        """
+        mock_urlopen.return_value = MagicMock(read=PropertyMock(
+            return_value='{"a": 1}'))
+        urls = ['http://localhost:6000/recon/a',
+                'http://localhost:6001/recon/a']
+        result = fetch_all(urls, timeout=2, deadline=5)
+        self.assertEqual(sorted(result), urls)
+        for url in urls:
+            data, error, latency = result[url]
+            self.assertEqual(data, {'a': 1})
+            self.assertIsNone(error)
+            self.assertIsNotNone(latency)
+            mock_urlopen.assert_any_call(url, timeout=2)
+
+    @patch('urllib.request.urlopen')
+    def test_fetch_all_socket_timeout(self, mock_urlopen):
+        """
+        A read timeout is reported as UNKNOWN data
+        """
+        mock_urlopen.side_effect = socket.timeout()
+        url = 'http://localhost:6000/recon/a'
+        result = fetch_all([url], timeout=1, deadline=1)
+        self.assertEqual(result[url][1],
+                         'Timed out reading url: {}'.format(url))
+
+    @patch('urllib.request.urlopen')
+    def test_fetch_all_connection_error(self, mock_urlopen):
+        """
+        Connection and protocol errors are reported as they are
+        """
+        url = 'http://localhost:6000/recon/a'
+        mock_urlopen.side_effect = ConnectionResetError()
+        result = fetch_all([url], timeout=1, deadline=1)
+        self.assertEqual(result[url][1], 'Error reading url: {}: '
+                         'ConnectionResetError()'.format(url))
+        mock_urlopen.side_effect = http.client.BadStatusLine('')
+        result = fetch_all([url], timeout=1, deadline=1)
+        self.assertEqual(result[url][1], "Error reading url: {}: "
+                         "BadStatusLine(\"''\")".format(url))
+
+    @patch('urllib.request.urlopen')
+    def test_fetch_all_deadline(self, mock_urlopen):
+        """
+        A hung server cannot hold the plugin past the shared deadline
+        """
+        hang = threading.Event()
+        self.addCleanup(hang.set)
+
+        def urlopen(*args, **kwargs):
+            hang.wait(5)
+            raise socket.timeout()
+
+        mock_urlopen.side_effect = urlopen
+        url = 'http://localhost:6000/recon/a'
+        result = fetch_all([url], timeout=5, deadline=0.1)
+        self.assertEqual(result[url],
+                         (None, 'Timed out fetching url: {}'.format(url),
+                          None))
+
+    def test_format_perfdata(self):
+        """
+        Latency is reported per port and endpoint
+        """
+        base_urls = [('http://h:6000/recon/', '6000'),
+                     ('http://h:6001/recon/', '6001')]
+        responses = {
+            'http://h:6000/recon/ringmd5': ({}, None, 0.0123),
+            'http://h:6001/recon/replication/object': ({}, None, 0.5),
+            'http://h:6001/recon/ringmd5': (None, 'timeout', None),
+        }
+        self.assertEqual(format_perfdata(responses, base_urls),
+                         "'6000_ringmd5'=0.012s;;;0 "
+                         "'6001_replication_object'=0.500s;;;0")
+
+    def test_check_unmounted(self):
+        """
+        Unmounted devices over CRIT threshold are listed, STATUS_CRIT
+        """
+        base_url = 'http://localhost:6000/recon/'
+        responses = {base_url + 'unmounted': (
+            [{'device': 'sdc', 'mounted': False},
+             {'device': 'sdb', 'mounted': False}], None, 0.1)}
+        self.assertEqual(check_unmounted(base_url, [1, 2], responses),
+                         [(STATUS_CRIT, '2 unmounted devices (sdb, sdc)')])
+        responses[base_url + 'unmounted'] = ([], None, 0.1)
+        self.assertEqual(check_unmounted(base_url, [1, 2], responses),
+                         [(STATUS_OK, 'OK')])
+
+    def test_check_unmounted_unknown(self):
+        """
+        Fetch errors are reported, STATUS_UNKNOWN
+        """
+        base_url = 'http://localhost:6000/recon/'
+        responses = {base_url + 'unmounted': (None, 'error', None)}
+        self.assertEqual(check_unmounted(base_url, [1, 2], responses),
+                         [(STATUS_UNKNOWN, 'error')])
+
+    def test_check_async(self):
+        """
+        Async pendings over WARN threshold (below CRIT), STATUS_WARN
+        """
+        base_url = 'http://localhost:6000/recon/'
+        responses = {base_url + 'async': ({'async_pending': 150}, None, 0.1)}
+        self.assertEqual(check_async(base_url, [100, 200], responses),
+                         [(STATUS_WARN, '150 async pendings')])
+        responses[base_url + 'async'] = ({'async_pending': None}, None, 0.1)
+        self.assertEqual(check_async(base_url, [100, 200], responses),
+                         [(STATUS_UNKNOWN, 'async pendings counter is NULL '
+                                           '(check syslog)')])
+
+    def test_check_diskusage(self):
+        """
+        Per-device fill and fill skew are checked, unmounted disks skipped
+        """
+        base_url = 'http://localhost:6000/recon/'
+        diskusage = [
+            {'device': 'sdb', 'mounted': True, 'size': 100, 'used': 96,
+             'avail': 4},
+            {'device': 'sdc', 'mounted': True, 'size': 100, 'used': 50,
+             'avail': 50},
+            {'device': 'sdd', 'mounted': False, 'size': '', 'used': '',
+             'avail': ''},
+        ]
+        responses = {base_url + 'diskusage': (diskusage, None, 0.1)}
+        self.assertEqual(check_diskusage(base_url, [85, 95, 20, 40],
+                                         responses),
+                         [(STATUS_CRIT, 'device sdb is 96% full'),
+                          (STATUS_CRIT, 'disk fill skew is 46%')])
+        diskusage[0]['used'] = 60
+        self.assertEqual(check_diskusage(base_url, [85, 95, 20, 40],
+                                         responses),
+                         [(STATUS_OK, 'OK')])
+
+    def test_check_quarantined(self):
+        """
+        Quarantined items are checked per type
+        """
+        base_url = 'http://localhost:6000/recon/'
+        responses = {base_url + 'quarantined': (
+            {'objects': 20, 'containers': 0, 'accounts': None,
+             'policies': {}}, None, 0.1)}
+        self.assertEqual(check_quarantined(base_url, [10, 100], responses),
+                         [(STATUS_WARN, '20 quarantined objects')])
+
+    def test_check_driveaudit(self):
+        """
+        Drive audit errors are checked, missing data is OK
+        """
+        base_url = 'http://localhost:6000/recon/'
+        responses = {base_url + 'driveaudit': (
+            {'drive_audit_errors': 3}, None, 0.1)}
+        self.assertEqual(check_driveaudit(base_url, [1, 3], responses),
+                         [(STATUS_CRIT, '3 drive audit errors')])
+        responses[base_url + 'driveaudit'] = ({}, None, 0.1)
+        self.assertEqual(check_driveaudit(base_url, [1, 3], responses),
+                         [(STATUS_OK, 'OK')])
+
+    @patch('check_swift_storage.time.time', lambda: 10000.0)
+    def test_check_sharding(self):
+        """
+        Sharder lag and cleave failures are checked, progress is perfdata
+        """
+        base_url = 'http://localhost:6000/recon/'
+        sharding_info = {
+            'sharding_last': 5000.0,
+            'sharding_time': 12.5,
+            'sharding_stats': {'sharding': {
+                'sharding_candidates': {'found': 3, 'top': []},
+                'sharding_in_progress': {'all': [{'container': 'c1'},
+                                                 {'container': 'c2'}]},
+                'cleaved': {'attempted': 6, 'success': 5, 'failure': 1},
+            }},
+        }
+        responses = {base_url + 'sharding': (sharding_info, None, 0.1)}
+        self.assertEqual(check_sharding(base_url, [3600, 86400], responses),
+                         [(STATUS_WARN, 'container sharding lag is 5000 '
+                                        'seconds'),
+                          (STATUS_WARN, '1 container cleave failures')])
+        self.assertEqual(sharding_perfdata(base_url, responses),
+                         "'sharding_candidates'=3;;;0 "
+                         "'sharding_cleave_failures'=1;;;0 "
+                         "'sharding_cleaved'=5;;;0 "
+                         "'sharding_in_progress'=2;;;0")
+
+        responses[base_url + 'sharding'] = ({'sharding_last': 9000.0},
+                                            None, 0.1)
+        self.assertEqual(check_sharding(base_url, [3600, 86400], responses),
+                         [(STATUS_OK, 'OK')])
+        responses[base_url + 'sharding'] = ({'sharding_last': None},
+                                            None, 0.1)
+        self.assertEqual(check_sharding(base_url, [3600, 86400], responses),
+                         [(STATUS_CRIT, 'container sharding not running '
+                                        '(check syslog)')])
+        responses[base_url + 'sharding'] = (None, "Can't open url", None)
+        self.assertEqual(check_sharding(base_url, [3600, 86400], responses),
+                         [(STATUS_UNKNOWN, "Can't open url")])
+        self.assertEqual(sharding_perfdata(base_url, responses), '')
+
+    def _history_path(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        return os.path.join(tmpdir, 'history.dat')
+
+    def test_history_roundtrip(self):
+        """
+        Replication passes are appended as fixed size records
+        """
+        path = self._history_path()
+        passes = [ReplicationPass(10.0, 5.0, 2.5, 100, 90, 10, 6000,
+                                  'object'),
+                  ReplicationPass(20.0, 15.0, 3.0, None, None, None, 6000,
+                                  'account')]
+        append_history(path, passes)
+        self.assertEqual(os.path.getsize(path), 2 * HISTORY_RECORD.size)
+        self.assertEqual(read_history(path), passes)
+        self.assertEqual(read_history(path, max_records=1), passes[1:])
+
+    def test_history_compaction(self):
+        """
+        The history is bounded and survives a partially written record
+        """
+        path = self._history_path()
+        for i in range(7):
+            append_history(path, [ReplicationPass(i, i, 1.0, 1, 1, 0, 6000,
+                                                  'object')],
+                           max_records=4)
+        self.assertLess(os.path.getsize(path), 8 * HISTORY_RECORD.size)
+        self.assertEqual([p.last for p in read_history(path)][-4:],
+                         [3, 4, 5, 6])
+
+        with open(path, 'ab') as f:
+            f.write(b'partial')
+        self.assertEqual(read_history(path)[-1].last, 6)
+        append_history(path, [ReplicationPass(7, 7, 1.0, 1, 1, 0, 6000,
+                                              'object')])
+        self.assertEqual(read_history(path)[-1].last, 7)
+
+    def test_read_history_missing(self):
+        self.assertEqual(read_history('/nonexistent/history.dat'), [])
+
+    def test_record_replication(self):
+        """
+        Only passes completed since the last recorded one are returned
+        """
+        base_url = 'http://localhost:6000/recon/'
+        responses = {
+            base_url + 'replication/account': (
+                {'replication_last': 100.0, 'replication_time': 2.0,
+                 'replication_stats': {'attempted': 10, 'success': 9,
+                                       'failure': 1}}, None, 0.1),
+            base_url + 'replication/object': (
+                {'object_replication_last': 50.0,
+                 'object_replication_time': 4.0}, None, 0.1),
+            base_url + 'replication/container': (
+                None, "Can't open url", None),
+        }
+        history = [ReplicationPass(1.0, 50.0, 4.0, None, None, None, 6000,
+                                   'object')]
+        passes = record_replication(base_url, 6000, responses, history)
+        self.assertEqual(len(passes), 1)
+        self.assertEqual(passes[0][1:],
+                         (100.0, 2.0, 10, 9, 1, 6000, 'account'))
+
+    def test_check_trends(self):
+        """
+        Failure rate, duration growth and success drop are alerted on
+        """
+        history = [ReplicationPass(i, i, 10.0, 100, 99, 1, 6000, 'object')
+                   for i in range(5)]
+        args = argparse.Namespace(failure_rate=[5, 10],
+                                  duration_growth=[50, 100],
+                                  success_drop=[5, 20])
+        self.assertEqual(check_trends(history, 6000, 6, args),
+                         [(STATUS_OK, 'OK')])
+
+        history.append(ReplicationPass(5, 5, 25.0, 100, 70, 30, 6000,
+                                       'object'))
+        self.assertEqual(check_trends(history, 6000, 6, args), [
+            (STATUS_WARN, "'object' replication averaging 5 failures per "
+                          "pass"),
+            (STATUS_CRIT, "'object' replication pass duration grew 150%"),
+            (STATUS_CRIT, "'object' replication success rate dropped 29 "
+                          "points")])
+        # other ports are not considered
+        self.assertEqual(check_trends(history, 6001, 6, args),
+                         [(STATUS_OK, 'OK')])
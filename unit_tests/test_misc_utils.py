@@ -19,7 +19,10 @@ import shutil
 
 from mock import patch
 
-from lib.misc_utils import ensure_block_device
+from lib.misc_utils import (
+    ensure_block_device,
+    pause_aware_restart_on_change,
+)
 
 
 class EnsureBlockDeviceTestCase(unittest.TestCase):
@@ -38,3 +41,21 @@ class EnsureBlockDeviceTestCase(unittest.TestCase):
         assert mock_function.called
         self.assertEqual("/dev/null", result)
         shutil.rmtree(temp_dir)
+
+
+class PauseAwareRestartOnChangeTestCase(unittest.TestCase):
+
+    @patch("lib.misc_utils.restart_on_change_helper")
+    @patch("lib.misc_utils.is_paused", lambda: False)
+    def test_restart_map_function(self, helper):
+        """
+        A restart map function is evaluated on every call.
+        """
+        maps = [{'/etc/a': ['a']}, {'/etc/b': ['b']}]
+        decorated = pause_aware_restart_on_change(lambda: maps.pop(0))(
+            lambda: 'done')
+        helper.side_effect = lambda f, restart_map: f()
+        self.assertEqual(decorated(), 'done')
+        self.assertEqual(decorated(), 'done')
+        self.assertEqual([c[0][1] for c in helper.call_args_list],
+                         [{'/etc/a': ['a']}, {'/etc/b': ['b']}])
@@ -0,0 +1,84 @@
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import unittest
+
+from mock import MagicMock
+
+sys.path.append('files/statsd')
+import swift_statsd_aggregator as aggregator
+
+
+class AggregatorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.agg = aggregator.Aggregator()
+
+    def test_counters_are_summed(self):
+        self.agg.add_packet(b'object-server.PUT.errors:1|c\n'
+                            b'object-server.PUT.errors:2|c')
+        self.agg.add_line('object-server.GET.errors:1|c|@0.5')
+        self.assertEqual(self.agg.lines(),
+                         ['object-server.GET.errors:2|c',
+                          'object-server.PUT.errors:3|c'])
+
+    def test_timers_are_summarised(self):
+        for value in (10, 20, 30):
+            self.agg.add_line('object-server.PUT.timing:{}|ms'.format(value))
+        self.assertEqual(self.agg.lines(),
+                         ['object-server.PUT.timing.count:3|c',
+                          'object-server.PUT.timing.mean:20|g',
+                          'object-server.PUT.timing.lower:10|g',
+                          'object-server.PUT.timing.upper:30|g'])
+
+    def test_sampled_timers(self):
+        for value in (100, 100, 40):
+            self.agg.add_line('object-server.GET.timing:{}|ms|@0.5'.format(
+                value))
+        self.assertEqual(self.agg.lines(),
+                         ['object-server.GET.timing.count:6|c',
+                          'object-server.GET.timing.mean:80|g',
+                          'object-server.GET.timing.lower:40|g',
+                          'object-server.GET.timing.upper:100|g'])
+
+    def test_gauges_keep_last_value(self):
+        self.agg.add_line('foo:1|g')
+        self.agg.add_line('foo:5|g')
+        self.assertEqual(self.agg.lines(), ['foo:5|g'])
+
+    def test_malformed_lines_ignored(self):
+        self.assertFalse(self.agg.add_line('garbage'))
+        self.assertFalse(self.agg.add_line('foo:bar|c'))
+        self.assertFalse(self.agg.add_line('foo:1|x'))
+        self.assertEqual(self.agg.lines(), [])
+
+    def test_packets_are_batched(self):
+        for i in range(10):
+            self.agg.add_line('metric{}:1|c'.format(i))
+        packets = list(self.agg.packets(max_size=40))
+        self.assertEqual(packets[0], b'metric0:1|c\nmetric1:1|c\nmetric2:1|c')
+        self.assertEqual(len(packets), 4)
+        self.assertTrue(all(len(p) <= 40 for p in packets))
+
+    def test_flush(self):
+        loop = MagicMock()
+        sock = MagicMock()
+        self.agg.add_line('foo:1|c')
+        aggregator.flush(loop, self.agg, ('10.0.0.10', 8125), sock, 10)
+        sock.sendto.assert_called_once_with(b'foo:1|c', ('10.0.0.10', 8125))
+        self.assertEqual(self.agg.lines(), [])
+        loop.call_later.assert_called_once_with(
+            10, aggregator.flush, loop, self.agg, ('10.0.0.10', 8125), sock,
+            10)
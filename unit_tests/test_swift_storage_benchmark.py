@@ -0,0 +1,75 @@
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+import lib.swift_storage_benchmark as benchmark
+
+RESULT = {'seq-write-mbps': 200.0, 'seq-read-mbps': 220.0,
+          'rand-write-iops': 150.0, 'rand-read-iops': 180.0}
+
+
+class SwiftStorageBenchmarkTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_benchmark_path(self):
+        result = benchmark.benchmark_path(self.tmpdir, size=2 * benchmark.MiB,
+                                          duration=1.0, seed=1)
+        self.assertEqual(sorted(result),
+                         sorted(benchmark.METRICS + ('direct',)))
+        for metric in benchmark.METRICS:
+            self.assertGreater(result[metric], 0)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    @patch.object(benchmark.os, 'open')
+    def test_open_direct_unsupported(self, mock_open):
+        def fake_open(path, flags, mode):
+            if flags & getattr(os, 'O_DIRECT', 0):
+                raise OSError(errno.EINVAL, 'Invalid argument')
+            return 3
+
+        mock_open.side_effect = fake_open
+        self.assertEqual(benchmark.open_direct('/srv/node/sdb/f', os.O_RDWR),
+                         (3, False))
+
+    def test_benchmark_devices(self):
+        paths = {'sdb': self.tmpdir,
+                 'sdc': os.path.join(self.tmpdir, 'missing')}
+        results = benchmark.benchmark_devices(paths, size=benchmark.MiB,
+                                              duration=0.5)
+        self.assertIn('seq-write-mbps', results['sdb'])
+        self.assertEqual(results['sdc'], {'error': 'No such file or '
+                                                   'directory'})
+        self.assertEqual(benchmark.benchmark_devices({}), {})
+
+    def test_find_outliers(self):
+        results = {
+            'sdb': dict(RESULT),
+            'sdc': dict(RESULT, **{'seq-read-mbps': 210.0}),
+            'sdd': dict(RESULT, **{'rand-write-iops': 50.0,
+                                   'seq-write-mbps': 90.0}),
+            'sde': {'error': 'No such file or directory'},
+        }
+        self.assertEqual(benchmark.find_outliers(results),
+                         {'sdd': ['seq-write-mbps', 'rand-write-iops']})
+        self.assertEqual(benchmark.find_outliers(results, factor=3.0), {})
@@ -0,0 +1,104 @@
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+import time
+import unittest
+
+from collections import namedtuple
+
+from mock import patch
+
+import lib.swift_storage_capacity as capacity
+
+StatVFS = namedtuple('StatVFS', ['f_blocks', 'f_bfree', 'f_bavail',
+                                 'f_frsize', 'f_files', 'f_ffree'])
+
+STATVFS = {
+    '/srv/node/sdb': StatVFS(1000, 800, 750, 4096, 100, 90),
+    '/srv/node/sdc': StatVFS(1000, 400, 350, 4096, 100, 50),
+    '/srv/node/sdd': StatVFS(1000, 600, 550, 4096, 100, 70),
+}
+
+
+class SwiftStorageCapacityTests(unittest.TestCase):
+
+    def setUp(self):
+        ismount = patch.object(capacity.os.path, 'ismount')
+        self.ismount = ismount.start()
+        self.ismount.side_effect = lambda p: p in STATVFS
+        self.addCleanup(ismount.stop)
+        statvfs = patch.object(capacity.os, 'statvfs')
+        statvfs.start().side_effect = STATVFS.__getitem__
+        self.addCleanup(statvfs.stop)
+
+    def test_device_usage(self):
+        self.assertEqual(capacity.device_usage('/srv/node/sdb'), {
+            'bytes-total': 4096000,
+            'bytes-used': 819200,
+            'bytes-avail': 3072000,
+            'inodes-total': 100,
+            'inodes-used': 10,
+            'fill': 0.2,
+            'inode-fill': 0.1,
+        })
+        self.assertEqual(capacity.device_usage('/srv/node/sde'),
+                         {'error': 'not mounted'})
+
+    def test_weight_factor(self):
+        self.assertEqual(capacity.weight_factor(0.4, 0.4), 1.0)
+        self.assertEqual(capacity.weight_factor(0.5, 0.4), 0.8)
+        self.assertEqual(capacity.weight_factor(0.8, 0.4), 0.75)
+        self.assertEqual(capacity.weight_factor(0.1, 0.4), 1.25)
+        self.assertEqual(capacity.weight_factor(0.0, 0.4), 1.0)
+
+    def test_capacity_report(self):
+        report = capacity.capacity_report(['sdb', 'sdc', 'sdd', 'sde'])
+        self.assertEqual(report['mean-fill'], 0.4)
+        self.assertEqual(report['mean-inode-fill'], 0.3)
+        devices = report['devices']
+        self.assertEqual(devices['sde'], {'error': 'not mounted'})
+        self.assertEqual(devices['sdb']['fill-deviation'], -0.2)
+        self.assertEqual(devices['sdb']['weight-factor'], 1.25)
+        self.assertEqual(devices['sdc']['fill-deviation'], 0.2)
+        self.assertEqual(devices['sdc']['inode-fill-deviation'], 0.2)
+        self.assertEqual(devices['sdc']['weight-factor'], 0.75)
+        self.assertEqual(devices['sdd']['weight-factor'], 1.0)
+
+    def test_capacity_report_hung_device(self):
+        hang = threading.Event()
+        self.addCleanup(hang.set)
+        ismount = self.ismount.side_effect
+
+        def hung_ismount(path):
+            if path.endswith('sdc'):
+                hang.wait(5)
+            return ismount(path)
+
+        self.ismount.side_effect = hung_ismount
+        start = time.time()
+        report = capacity.capacity_report(['sdb', 'sdc', 'sdd'], timeout=0.2)
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(report['devices']['sdc'], {'error': 'timed out'})
+        self.assertEqual(report['mean-fill'], 0.3)
+
+    def test_capacity_report_no_devices(self):
+        self.assertEqual(capacity.capacity_report([]),
+                         {'devices': {}, 'mean-fill': 0.0,
+                          'mean-inode-fill': 0.0})
+
+    def test_capacity_report_mount_path(self):
+        capacity.capacity_report(['sdb'], mount_path='/mnt')
+        self.ismount.assert_called_once_with(os.path.join('/mnt', 'sdb'))
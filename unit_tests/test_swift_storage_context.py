@@ -12,9 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from mock import MagicMock
+import json
 
-from unit_tests.test_utils import CharmTestCase, patch_open
+from mock import MagicMock, patch
+
+from unit_tests.test_utils import CharmTestCase, TestKV, patch_open
 
 import lib.swift_storage_context as swift_context
 
@@ -27,14 +29,26 @@ TO_PATCH = [
     'relation_ids',
     'unit_private_ip',
     'get_ipv6_addr',
+    'get_total_ram',
+    'kv',
+    'get_os_codename_package',
+    'init_is_systemd',
+    'is_container',
 ]
 
+GiB = 1024 * 1024 * 1024
+
 
 class SwiftStorageContextTests(CharmTestCase):
 
     def setUp(self):
         super(SwiftStorageContextTests, self).setUp(swift_context, TO_PATCH)
         self.config.side_effect = self.test_config.get
+        self.test_kv = TestKV()
+        self.kv.return_value = self.test_kv
+        self.get_os_codename_package.return_value = 'rocky'
+        self.init_is_systemd.return_value = True
+        self.is_container.return_value = False
 
     def test_swift_storage_context_missing_data(self):
         self.relation_ids.return_value = []
@@ -54,6 +68,37 @@ class SwiftStorageContextTests(CharmTestCase):
         self.relation_get.return_value = 'fooooo'
         self.assertEqual(ctxt(), {'swift_hash': 'fooooo'})
 
+    def test_swift_storage_context_storage_policies(self):
+        policies = json.dumps([
+            {'index': 1, 'name': 'ec104', 'policy_type': 'erasure_coding',
+             'ec_type': 'liberasurecode_rs_vand',
+             'ec_num_data_fragments': 10, 'ec_num_parity_fragments': 4,
+             'unknown': 'dropped'},
+            {'index': 0, 'name': 'gold', 'default': True,
+             'aliases': ['yellow', 'orange']}])
+        self.relation_ids.return_value = ['swift-proxy:0']
+        self.related_units.return_value = ['swift-proxy/0']
+        self.relation_get.side_effect = lambda key, **kwargs: {
+            'swift_hash': 'fooooo', 'storage_policies': policies}[key]
+        self.assertEqual(swift_context.SwiftStorageContext()(), {
+            'swift_hash': 'fooooo',
+            'storage_policies': [
+                (0, [('name', 'gold'), ('aliases', 'yellow, orange'),
+                     ('default', 'yes')]),
+                (1, [('name', 'ec104'), ('policy_type', 'erasure_coding'),
+                     ('ec_type', 'liberasurecode_rs_vand'),
+                     ('ec_num_data_fragments', 10),
+                     ('ec_num_parity_fragments', 4)])]})
+
+    def test_parse_storage_policies(self):
+        self.assertEqual(swift_context.parse_storage_policies(None), [])
+        for invalid in ('{"index": 1}', '[{"name": "gold"}]', '[1]',
+                        'not json', '[{"index": 1}]',
+                        '[{"index": 0}, {"index": 0}]',
+                        '[{"index": 0, "aliases": ["a", 1]}]'):
+            self.assertRaises(ValueError,
+                              swift_context.parse_storage_policies, invalid)
+
     def test_rsync_context(self):
         self.unit_private_ip.return_value = '10.0.0.5'
         ctxt = swift_context.RsyncContext()
@@ -71,6 +116,30 @@ class SwiftStorageContextTests(CharmTestCase):
         self.assertEqual({'local_ip': '2001:db8:1::1'}, ctxt())
         self.assertTrue(ctxt.enable_rsyncd.called)
 
+    @patch.object(swift_context, 'resolve_network_cidr')
+    @patch.object(swift_context, 'get_relation_ip')
+    def test_rsync_context_replication_network(self, get_relation_ip,
+                                               resolve_network_cidr):
+        self.unit_private_ip.return_value = '10.0.0.5'
+        self.relation_ids.return_value = ['swift-storage:0']
+        self.related_units.return_value = ['swift-proxy/0']
+        self.relation_get.return_value = {
+            'timestamp': '1', 'rsync_allowed_hosts': '10.0.0.5 10.0.0.6'}
+        addresses = {'swift-storage': '10.0.0.5', 'replication': '10.20.0.5'}
+        get_relation_ip.side_effect = lambda i, **kwargs: addresses[i]
+        resolve_network_cidr.return_value = '10.20.0.0/24'
+        ctxt = swift_context.RsyncContext()
+        ctxt.enable_rsyncd = MagicMock()
+        self.assertEqual(ctxt()['allowed_hosts'],
+                         '10.0.0.5 10.0.0.6 10.20.0.0/24')
+        resolve_network_cidr.assert_called_once_with('10.20.0.5')
+        self.test_config.set('replication-network', '10.20.0.0/16')
+        self.assertEqual(ctxt()['allowed_hosts'],
+                         '10.0.0.5 10.0.0.6 10.20.0.0/16')
+        # replication on the swift-storage address needs no other hosts
+        addresses['replication'] = '10.0.0.5'
+        self.assertEqual(ctxt()['allowed_hosts'], '10.0.0.5 10.0.0.6')
+
     def test_rsync_enable_rsync(self):
         with patch_open() as (_open, _file):
             ctxt = swift_context.RsyncContext()
@@ -100,6 +169,7 @@ class SwiftStorageContextTests(CharmTestCase):
             'account_server_port': '500',
             'local_ip': '10.0.0.5',
             'object_server_threads_per_disk': '3',
+            'object_servers_per_port': 0,
             'object_replicator_concurrency': '3',
             'account_max_connections': '10',
             'container_max_connections': '10',
@@ -107,6 +177,152 @@ class SwiftStorageContextTests(CharmTestCase):
             'object_rsync_timeout': '950',
             'statsd_host': '',
             'statsd_port': 3125,
-            'statsd_sample_rate': 1.0
+            'statsd_sample_rate': 1.0,
+            'replication_servers': False,
+            'container_sharding': True,
+            'container_sharder_shard_container_threshold': 1000000,
+            'container_sharder_concurrency': 8,
+            'container_sharder_cleave_batch_size': 2,
         }
         self.assertEqual(ex, result)
+
+    def test_container_sharding(self):
+        self.assertTrue(swift_context.container_sharding())
+        self.get_os_codename_package.return_value = 'queens'
+        self.assertFalse(swift_context.container_sharding())
+        self.get_os_codename_package.return_value = None
+        self.assertTrue(swift_context.container_sharding())
+
+    @patch.object(swift_context, 'get_relation_ip')
+    def test_swift_storage_server_context_replication(self, get_relation_ip):
+        get_relation_ip.return_value = '10.20.0.5'
+        self.test_config.set('replication-servers', True)
+        self.test_config.set('replication-network', '10.20.0.0/24')
+        ctxt = swift_context.SwiftStorageServerContext()()
+        get_relation_ip.assert_called_once_with(
+            'replication', cidr_network='10.20.0.0/24')
+        self.assertTrue(ctxt['replication_servers'])
+        self.assertEqual(ctxt['replication_ip'], '10.20.0.5')
+        self.assertEqual(ctxt['account_replication_port'], 6005)
+        self.assertEqual(ctxt['container_replication_port'], 6004)
+        self.assertEqual(ctxt['object_replication_port'], 6003)
+        # the replication servers are systemd units
+        self.init_is_systemd.return_value = False
+        ctxt = swift_context.SwiftStorageServerContext()()
+        self.assertFalse(ctxt['replication_servers'])
+        self.assertNotIn('replication_ip', ctxt)
+
+    def test_swift_storage_server_context_local_statsd(self):
+        self.unit_private_ip.return_value = '10.0.0.5'
+        self.test_config.set('statsd-host', '10.0.0.10')
+        ctxt = swift_context.SwiftStorageServerContext()()
+        self.assertEqual(ctxt['statsd_host'], '10.0.0.10')
+        self.assertEqual(ctxt['statsd_port'], 3125)
+        self.test_config.set('statsd-local-aggregator', True)
+        ctxt = swift_context.SwiftStorageServerContext()()
+        self.assertEqual(ctxt['statsd_host'], '127.0.0.1')
+        self.assertEqual(ctxt['statsd_port'], 8125)
+        # no aggregator is installed without systemd
+        self.init_is_systemd.return_value = False
+        ctxt = swift_context.SwiftStorageServerContext()()
+        self.assertEqual(ctxt['statsd_host'], '10.0.0.10')
+        self.assertEqual(ctxt['statsd_port'], 3125)
+
+    @patch.object(swift_context.multiprocessing, 'cpu_count', lambda: 8)
+    def test_worker_plan(self):
+        self.get_total_ram.return_value = 64 * GiB
+        self.test_kv.set('prepared-devices',
+                         ['/dev/sd%s' % c for c in 'bcdefghijklmnopqrstuvwxy'])
+        self.assertEqual(swift_context.worker_plan(),
+                         {'account': 8, 'container': 8, 'object': 8,
+                          'memory-limited': False})
+        self.test_config.set('object-workers-per-device', 0.5)
+        self.assertEqual(swift_context.worker_plan(),
+                         {'account': 8, 'container': 8, 'object': 12,
+                          'memory-limited': False})
+        self.test_config.set('account-worker-multiplier', 0.5)
+        self.test_config.set('object-worker-multiplier', 2.0)
+        self.assertEqual(swift_context.worker_plan(),
+                         {'account': 4, 'container': 8, 'object': 16,
+                          'memory-limited': False})
+        self.assertEqual(swift_context.ServerWorkerContext('object')(),
+                         {'workers': 16})
+
+    @patch.object(swift_context.multiprocessing, 'cpu_count', lambda: 8)
+    def test_worker_plan_container(self):
+        self.get_total_ram.return_value = 64 * GiB
+        self.is_container.return_value = True
+        self.test_config.set('worker-multiplier', None)
+        self.test_config.set('object-worker-multiplier', 1.0)
+        # as WorkerConfigContext, only unconfigured workers are capped
+        self.assertEqual(swift_context.worker_plan(),
+                         {'account': 4, 'container': 4, 'object': 8,
+                          'memory-limited': False})
+
+    @patch.object(swift_context, 'nic_speed', lambda: 10000)
+    @patch.object(swift_context, 'rotational')
+    def test_daemon_tuning_context(self, rotational):
+        devices = ['/dev/sd%s' % c for c in 'bcdefghijklmnopqrstuvwxy']
+        self.test_kv.set('prepared-devices', devices)
+        rotational.side_effect = lambda d: 0 if d < '/dev/sdo' else None
+        ctxt = swift_context.DaemonTuningContext()()
+        # 13 of 24 devices are SSDs
+        self.assertEqual(ctxt['object_auditor_files_per_second'], 100)
+        self.assertEqual(ctxt['object_auditor_concurrency'], 3)
+        self.assertEqual(ctxt['object_replicator_workers'], 2)
+        self.assertEqual(ctxt['container_replicator_per_diff'], 10000)
+        rotational.side_effect = lambda d: 0 if d < '/dev/sdn' else 1
+        self.test_config.set('object-replicator-workers', 0)
+        ctxt = swift_context.DaemonTuningContext()()
+        self.assertEqual(ctxt['object_auditor_files_per_second'], 20)
+        self.assertEqual(ctxt['object_replicator_workers'], 0)
+        self.assertNotIn('object_reconstructor_workers', ctxt)
+        self.get_os_codename_package.return_value = 'queens'
+        ctxt = swift_context.DaemonTuningContext()()
+        self.assertNotIn('object_replicator_workers', ctxt)
+        self.get_os_codename_package.return_value = 'stein'
+        ctxt = swift_context.DaemonTuningContext()()
+        self.assertEqual(ctxt['object_reconstructor_workers'], 2)
+
+    @patch.object(swift_context, 'nic_speed', lambda: 10000)
+    @patch.object(swift_context, 'device_size')
+    @patch.object(swift_context, 'rotational', lambda d: 1)
+    def test_object_server_tuning_context(self, device_size):
+        self.get_total_ram.return_value = 64 * GiB
+        self.test_kv.set('prepared-devices', ['/dev/sdb', '/dev/sdc'])
+        device_size.side_effect = lambda d: 1024 * GiB
+        ctxt = swift_context.ObjectServerTuningContext()()
+        self.assertEqual(ctxt['object_server_disk_chunk_size'], 262144)
+        self.assertEqual(ctxt['object_server_keep_cache_size'],
+                         64 * 1024 * 1024)
+        self.assertEqual(ctxt['object_server_keep_cache_private'], 'true')
+        self.test_config.set('object-server-keep-cache-size', 1048576)
+        self.test_config.set('object-server-keep-cache-private', False)
+        self.test_config.set('object-server-fallocate-reserve', '2%')
+        ctxt = swift_context.ObjectServerTuningContext()()
+        self.assertEqual(ctxt['object_server_keep_cache_size'], 1048576)
+        self.assertEqual(ctxt['object_server_keep_cache_private'], 'false')
+        self.assertEqual(ctxt['object_server_fallocate_reserve'], '2%')
+
+    @patch.object(swift_context.multiprocessing, 'cpu_count', lambda: 32)
+    def test_worker_plan_memory_limited(self):
+        # 32 * (128 + 160 + 256)MiB = 17GiB of workers, budget 4GiB
+        self.get_total_ram.return_value = 8 * GiB
+        self.assertFalse(swift_context.worker_plan()['memory-limited'])
+        self.test_config.set('worker-memory-budget', 50)
+        plan = swift_context.worker_plan()
+        self.assertEqual(plan, {'account': 7, 'container': 7, 'object': 7,
+                                'memory-limited': True})
+        self.assertEqual(swift_context.format_worker_plan(plan),
+                         'workers account=7 container=7 object=7 '
+                         '(memory limited)')
+        self.get_total_ram.return_value = 256 * 1024 * 1024
+        self.assertEqual(swift_context.worker_plan(),
+                         {'account': 1, 'container': 1, 'object': 1,
+                          'memory-limited': True})
+        # the replication servers run as many workers again
+        self.get_total_ram.return_value = 8 * GiB
+        self.test_config.set('replication-servers', True)
+        self.assertEqual(swift_context.worker_plan(),
+                         {'account': 3, 'container': 3, 'object': 3,
+                          'memory-limited': True})
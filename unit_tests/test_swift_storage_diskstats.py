@@ -0,0 +1,86 @@
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from mock import patch
+
+from unit_tests.test_utils import patch_open
+
+import lib.swift_storage_diskstats as diskstats
+
+DISKSTATS = """\
+   8       0 sda 100 0 800 50 200 0 1600 150 0 300 200 0 0 0 0
+   8      16 sdb 1000 10 8000 4000 1000 20 16000 6000 2 5000 10000 0 0 0 0
+ 252       0 dm-0 10 0 80 5 10 0 80 5 0 10 10
+   7       0 loop0 0 0 0 0
+"""
+
+
+class DiskstatsTests(unittest.TestCase):
+
+    def test_read_diskstats(self):
+        with patch_open() as (_open, _file):
+            _file.read.return_value = DISKSTATS
+            stats = diskstats.read_diskstats()
+        _open.assert_called_once_with('/proc/diskstats')
+        self.assertEqual(stats, {
+            'sda': (300, 200, 300, 200),
+            'sdb': (2000, 10000, 5000, 10000),
+            'dm-0': (20, 10, 10, 10),
+        })
+
+    @patch('os.path.realpath')
+    def test_kernel_name(self, realpath):
+        realpath.side_effect = lambda p: {
+            '/dev/mapper/crypt-1': '/dev/dm-3'}.get(p, p)
+        self.assertEqual(diskstats.kernel_name('/dev/mapper/crypt-1'),
+                         'dm-3')
+        self.assertEqual(diskstats.kernel_name('/dev/cciss/c0d0'),
+                         'cciss/c0d0')
+        self.assertEqual(diskstats.kernel_name('sdb'), 'sdb')
+
+    def test_device_stats(self):
+        previous = {'sdb': (100, 100, 0, 0), 'sdc': (10, 0, 0, 0)}
+        current = {'sdb': (300, 2100, 500, 4000), 'sdc': (5, 0, 0, 0),
+                   'sdd': (1, 1, 1, 1)}
+        stats = diskstats.device_stats(previous, current, 2.0)
+        self.assertEqual(stats, {'sdb': {'await': 10.0, 'util': 25.0,
+                                         'queue': 2.0}})
+        self.assertEqual(diskstats.device_stats(previous, current, 2.0,
+                                                devices=['sdc']), {})
+
+    def test_find_outliers(self):
+        stats = {'sdb': {'await': 5.0}, 'sdc': {'await': 7.0},
+                 'sdd': {'await': 40.0}, 'sde': {'await': 6.0}}
+        self.assertEqual(diskstats.find_outliers(stats, 5), {'sdd': 6.0})
+        self.assertEqual(diskstats.find_outliers(stats, 10), {})
+        # fast devices are never outliers
+        self.assertEqual(diskstats.find_outliers(stats, 5, min_await=50), {})
+        self.assertEqual(diskstats.find_outliers(stats, 0), {})
+        self.assertEqual(diskstats.find_outliers({'sdb': {'await': 90.0}},
+                                                 2), {})
+
+    def test_check_latency(self):
+        stats = {'sdb': {'await': 5.0, 'util': 10.0},
+                 'sdc': {'await': 5.0, 'util': 95.0},
+                 'sdd': {'await': 30.0, 'util': 50.0}}
+        self.assertEqual(diskstats.check_latency(stats, [3, 10]), [
+            (diskstats.STATUS_WARN,
+             'slow devices: sdd (await 30ms, peers 5ms)')])
+        self.assertEqual(diskstats.check_latency(stats, [3, 5],
+                                                 util=[80, 90]), [
+            (diskstats.STATUS_CRIT,
+             'slow devices: sdd (await 30ms, peers 5ms)'),
+            (diskstats.STATUS_CRIT, 'device sdc is 95% busy')])
@@ -0,0 +1,114 @@
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+from mock import patch
+
+sys.path.append('files/prometheus')
+import swift_storage_exporter as exporter
+
+
+RECON = {
+    'replication/account': {'replication_last': 1500000000.0,
+                            'replication_time': 1.5,
+                            'replication_stats': {'attempted': 10,
+                                                  'success': 9,
+                                                  'failure': 1}},
+    'replication/container': None,
+    'replication/object': {'object_replication_last': 1500000100.0,
+                           'object_replication_time': 2.0},
+    'async': {'async_pending': 42},
+    'diskusage': [{'device': 'sdb', 'mounted': True, 'size': 100,
+                   'used': 40, 'avail': 60},
+                  {'device': 'sdc', 'mounted': False, 'size': '',
+                   'used': '', 'avail': ''}],
+    'ringmd5': {'/etc/swift/object.ring.gz': 'abc'},
+}
+
+
+def fake_fetch(url, timeout=None):
+    return RECON[url.split('/recon/')[1]]
+
+
+class SwiftStorageExporterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_metrics_render(self):
+        metrics = exporter.Metrics()
+        metrics.add('foo', 1, 'Foo help', device='sdb')
+        metrics.add('foo', None, 'Foo help', device='sdc')
+        metrics.add('bar', 2, 'Bar help', mtype='counter')
+        self.assertEqual(metrics.render(),
+                         '# HELP bar Bar help\n'
+                         '# TYPE bar counter\n'
+                         'bar 2.0\n'
+                         '# HELP foo Foo help\n'
+                         '# TYPE foo gauge\n'
+                         'foo{device="sdb"} 1.0\n')
+
+    @patch.object(exporter, 'generate_md5', lambda f: 'abc')
+    @patch.object(exporter, 'fetch_json', fake_fetch)
+    def test_collect(self):
+        devstore = os.path.join(self.tmpdir, 'kv.db')
+        conn = sqlite3.connect(devstore)
+        conn.execute('CREATE TABLE kv (key text, data text)')
+        # stored as the charm does, JSON encoded by KVStore.set()
+        conn.execute("INSERT INTO kv VALUES ('devices', ?)", (
+            json.dumps(json.dumps({
+                'sdb@uuid': {'blkid': 'x', 'status': 'active'},
+                'sdc@uuid': {'blkid': 'y', 'status': 'inactive'}})),))
+        conn.commit()
+        conn.close()
+        hook_stats = os.path.join(self.tmpdir, 'hook-stats.json')
+        with open(hook_stats, 'w') as f:
+            json.dump({'config-changed': {'duration': 12.5,
+                                          'timestamp': 1500000000}}, f)
+
+        output = exporter.collect('localhost', 6000, devstore,
+                                  hook_stats).render()
+        for line in [
+                'swift_storage_recon_up{endpoint="replication/container"} '
+                '0.0',
+                'swift_storage_replication_last_timestamp_seconds'
+                '{type="object"} 1500000100.0',
+                'swift_storage_replication_stats'
+                '{stat="failure",type="account"} 1.0',
+                'swift_storage_async_pending 42.0',
+                'swift_storage_device_used_bytes{device="sdb"} 40.0',
+                'swift_storage_device_mounted{device="sdc"} 0.0',
+                'swift_storage_ring_md5_match{ring="object.ring.gz"} 1.0',
+                'swift_storage_devstore_device_active'
+                '{device="sdc",status="inactive"} 0.0',
+                'swift_storage_hook_duration_seconds'
+                '{hook="config-changed"} 12.5']:
+            self.assertIn(line, output.split('\n'))
+        self.assertNotIn('swift_storage_device_size_bytes{device="sdc"}',
+                         output)
+
+    def test_write_textfile_atomic(self):
+        exporter.write_textfile('a 1.0\n', self.tmpdir)
+        exporter.write_textfile('a 2.0\n', self.tmpdir)
+        self.assertEqual(os.listdir(self.tmpdir), ['swift_storage.prom'])
+        with open(os.path.join(self.tmpdir, 'swift_storage.prom')) as f:
+            self.assertEqual(f.read(), 'a 2.0\n')
@@ -0,0 +1,89 @@
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import types
+import unittest
+
+from mock import MagicMock, call, patch
+
+import lib.swift_storage_log as swift_log
+
+
+class BufferedLogTests(unittest.TestCase):
+
+    def setUp(self):
+        self.writer = MagicMock()
+        self.log = swift_log.BufferedLog(writer=self.writer)
+
+    def test_messages_are_buffered(self):
+        self.log('one')
+        self.log('two', level='DEBUG')
+        self.assertFalse(self.writer.called)
+        self.assertEqual(len(self.log.buffer), 2)
+
+    def test_flush_coalesces_levels(self):
+        self.log('one', level='INFO')
+        self.log('two', level='INFO')
+        self.log('three', level='DEBUG')
+        self.log('four', level='WARNING')
+        self.log('five')
+        self.log('six', level='WARN')
+        self.log.flush()
+        # every message keeps its own level
+        self.assertEqual(self.writer.call_args_list, [
+            call('three', level='DEBUG'),
+            call('one\ntwo\nfive', level='INFO'),
+            call('four\nsix', level='WARNING')])
+        self.assertEqual(self.log.buffer, [])
+
+    def test_error_flushes(self):
+        self.log('one', level='DEBUG')
+        self.log('boom', level='error')
+        self.assertEqual(self.writer.call_args_list, [
+            call('one', level='DEBUG'),
+            call('boom', level='error')])
+        self.assertEqual(self.log.buffer, [])
+
+    def test_threshold_drops_messages(self):
+        self.log.threshold = 'INFO'
+        message = MagicMock()
+        message.__repr__ = MagicMock(return_value='dropped')
+        self.log(message, level='DEBUG')
+        self.log('kept', level='WARN')
+        self.assertEqual(self.log.buffer, [('WARN', 'kept')])
+        # Dropped messages must never be formatted.
+        self.assertFalse(message.__repr__.called)
+
+    def test_max_messages_flushes(self):
+        self.log.max_messages = 3
+        for i in range(3):
+            self.log('msg{}'.format(i))
+        self.writer.assert_called_once_with('msg0\nmsg1\nmsg2', level=None)
+
+    @patch.object(swift_log, 'SH_MAX_ARG', 10)
+    def test_chunks_fit_max_arg(self):
+        self.assertEqual(
+            list(self.log._chunks(['aaaa', 'bbbb', 'cccc'])),
+            ['aaaa\nbbbb', 'cccc'])
+
+    @patch.object(swift_log, 'atexit')
+    @patch.object(swift_log, 'hookenv')
+    def test_install(self, hookenv, atexit):
+        module = types.ModuleType('fake')
+        module.log = MagicMock()
+        with patch.object(swift_log, 'log', swift_log.BufferedLog()) as log:
+            swift_log.install([module], threshold='WARNING')
+            self.assertIs(module.log, log)
+            self.assertIs(hookenv.log, log)
+            self.assertEqual(log.threshold, swift_log.LEVELS['WARNING'])
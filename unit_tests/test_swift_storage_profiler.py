@@ -0,0 +1,97 @@
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from mock import patch
+
+import lib.swift_storage_profiler as swift_profiler
+
+
+class HookProfilerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.profiler = swift_profiler.HookProfiler()
+        patcher = patch.object(swift_profiler, 'profiler', self.profiler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.profiler.disable)
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_disabled_is_noop(self):
+        with self.profiler.phase('foo'):
+            subprocess.call(['true'])
+        self.assertEqual(self.profiler.phases, [])
+        self.assertEqual(self.profiler.commands, [])
+        self.assertIs(subprocess.Popen, swift_profiler._Popen)
+        self.profiler.write(self.tmpdir)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_records_phases_and_commands(self):
+        self.profiler.enable('config-changed')
+        with self.profiler.phase('configure_storage'):
+            subprocess.call(['true'])
+            with self.profiler.phase('inner'):
+                self.assertRaises(subprocess.CalledProcessError,
+                                  subprocess.check_output, ['false'])
+        subprocess.call(['true'])
+        self.assertRaises(OSError, subprocess.call, ['/nonexistent'])
+        self.profiler.disable()
+        self.assertIs(subprocess.Popen, swift_profiler._Popen)
+
+        self.assertEqual([p['name'] for p in self.profiler.phases],
+                         ['inner', 'configure_storage'])
+        self.assertEqual([(c['argv'], c['phase'], c['returncode'])
+                          for c in self.profiler.commands],
+                         [(['true'], 'configure_storage', 0),
+                          (['false'], 'inner', 1),
+                          (['true'], None, 0),
+                          (['/nonexistent'], None, None)])
+
+    def test_write_and_prune(self):
+        for i in range(3):
+            self.profiler.enable('hook{}'.format(i))
+            self.profiler.start = 1500000000 + i
+            self.profiler.write(self.tmpdir, max_traces=2)
+        traces = swift_profiler.load_traces(self.tmpdir)
+        self.assertEqual([t['hook'] for t in traces], ['hook1', 'hook2'])
+
+    def test_summarise(self):
+        traces = [
+            {'hook': 'config-changed', 'timestamp': 1, 'duration': 100.0,
+             'phases': [{'name': 'configure_storage', 'start': 0,
+                         'duration': 60.0}],
+             'commands': [{'argv': ['systemctl', 'restart', 'a'],
+                           'duration': 2.0},
+                          {'argv': ['systemctl', 'restart', 'b'],
+                           'duration': 3.0},
+                          {'argv': ['ufw', 'reload'], 'duration': 4.0}]},
+            {'hook': 'update-status', 'timestamp': 2, 'duration': 5.0,
+             'phases': [], 'commands': []},
+        ]
+        summary = swift_profiler.summarise(traces, limit=1)
+        self.assertEqual(summary['hooks'],
+                         [{'hook': 'config-changed', 'timestamp': 1,
+                           'duration': 100.0, 'commands': 3}])
+        self.assertEqual(summary['phases'],
+                         [{'name': 'config-changed:configure_storage',
+                           'count': 1, 'total': 60.0, 'max': 60.0}])
+        self.assertEqual(summary['commands'],
+                         [{'name': 'systemctl restart', 'count': 2,
+                           'total': 5.0, 'max': 3.0}])
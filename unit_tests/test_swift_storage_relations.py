@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from mock import patch
+from mock import MagicMock, call, patch
 import json
 import os
 import tempfile
@@ -58,14 +58,32 @@ TO_PATCH = [
     'register_configs',
     'update_nrpe_config',
     'get_relation_ip',
+    'device_classes',
+    'device_metadata',
+    'devstore_devices',
+    'drain_weights',
+    'object_device_ports',
+    'ring_devices',
+    'replication_ip',
+    'replication_servers_enabled',
+    'report_slow_devices',
+    'report_worker_plan',
+    'configure_replication_servers',
+    'swift_services',
+    'update_drains',
     'status_set',
     'set_os_workload_status',
     'os_application_version_set',
     'add_to_updatedb_prunepath',
     'ufw',
     'setup_ufw',
+    'storage_ports',
     'revoke_access',
     'kv',
+    'setup_logging',
+    'record_hook_duration',
+    'configure_prometheus_exporter',
+    'configure_statsd_aggregator',
 ]
 
 
@@ -92,6 +110,14 @@ class SwiftStorageRelationsTests(CharmTestCase):
         self.config.side_effect = self.test_config.get
         self.relation_get.side_effect = self.test_relation.get
         self.get_relation_ip.return_value = '10.10.10.2'
+        self.device_metadata.return_value = {}
+        self.devstore_devices.return_value = []
+        self.drain_weights.return_value = {}
+        self.ring_devices.return_value = {}
+        self.replication_ip.return_value = '10.20.0.2'
+        self.replication_servers_enabled.side_effect = lambda: bool(
+            self.test_config.get('replication-servers'))
+        self.swift_services.return_value = hooks.SWIFT_SVCS
         self.test_kv = TestKV()
         self.kv.return_value = self.test_kv
 
@@ -197,6 +223,10 @@ class SwiftStorageRelationsTests(CharmTestCase):
         kvstore.__enter__.return_value = kvstore
         kvstore.get.return_value = None
         self.test_kv.set('prepared-devices', ['/dev/vdb'])
+        self.device_metadata.return_value = {'vdb': [8001563222016, 1, None]}
+        self.ring_devices.return_value = {'account': ['vdb'],
+                                          'container': ['vdb'],
+                                          'object': ['vdb']}
 
         # py3 is very picky, and log is only patched in
         # hooks.swift_storage_hooks
@@ -209,8 +239,18 @@ class SwiftStorageRelationsTests(CharmTestCase):
             relation_id=None,
             relation_settings={
                 "device": 'vdb',
+                "account_devices": 'vdb',
+                "container_devices": 'vdb',
+                "object_devices": 'vdb',
+                "device_info": '{"vdb":[8001563222016,1,null]}',
+                "device_weight": None,
+                "object_device_ports": None,
                 "object_port": 6000,
                 "account_port": 6002,
+                "replication_ip": "10.20.0.2",
+                "object_replication_port": 6000,
+                "container_replication_port": 6001,
+                "account_replication_port": 6002,
                 "zone": 1,
                 "container_port": 6001,
                 "private-address": "10.10.10.2"
@@ -351,9 +391,20 @@ class SwiftStorageRelationsTests(CharmTestCase):
         hooks.swift_storage_relation_changed()
         self.CONFIGS.write.assert_called_with('/etc/swift/swift.conf')
         self.fetch_swift_rings.assert_called_with(
-            'http://swift-proxy.com/rings/'
+            'http://swift-proxy.com/rings/', []
         )
 
+    def test_storage_changed_storage_policies(self):
+        self.test_relation.set({
+            'swift_hash': 'foo_hash',
+            'rings_url': 'http://swift-proxy.com/rings/',
+            'storage_policies': '[{"index": 0, "name": "gold"}, '
+                                '{"index": 2, "name": "ec"}]',
+        })
+        hooks.swift_storage_relation_changed()
+        self.fetch_swift_rings.assert_called_with(
+            'http://swift-proxy.com/rings/', [0, 2])
+
     @patch('sys.argv', new=['dodah'])
     def test_main_hook_missing(self):
         hooks.main()
@@ -364,3 +415,107 @@ class SwiftStorageRelationsTests(CharmTestCase):
             tmpfile.file.write(UFW_DUMMY_RULES)
             tmpfile.file.close()
             hooks.add_ufw_gre_rule(tmpfile.name)
+
+    @patch.object(hooks, 'harden')
+    def test_harden_on_config_change(self, harden):
+        hardened = harden.return_value.return_value
+        func = MagicMock(__name__='update_status')
+        wrapped = hooks.harden_on_config_change(func)
+        wrapped()
+        hardened.assert_called_once_with()
+        self.assertFalse(func.called)
+        # hardening is skipped until the config changes
+        wrapped()
+        self.assertEqual(hardened.call_count, 1)
+        func.assert_called_once_with()
+        self.test_config.set('harden', 'os')
+        wrapped()
+        self.assertEqual(hardened.call_count, 2)
+
+    @patch.object(hooks, 'relation_set')
+    @patch.object(hooks, 'remember_devices')
+    def test_storage_joined_draining(self, remember_devices, relation_set):
+        self.test_kv.set('prepared-devices', ['/dev/vdb', '/dev/vdc',
+                                              '/dev/vdd'])
+        self.devstore_devices.return_value = ['vdd']
+        self.drain_weights.return_value = {'vdc': 0.5}
+        hooks.swift_storage_relation_joined('swift-storage:1')
+        self.devstore_devices.assert_called_once_with(status='inactive')
+        self.device_metadata.assert_called_once_with(['/dev/vdb',
+                                                      '/dev/vdc'])
+        settings = relation_set.call_args[1]['relation_settings']
+        self.assertEqual(settings['device'], 'vdb:vdc')
+        self.assertEqual(settings['device_weight'], '{"vdc":0.5}')
+
+    @patch.object(hooks, 'swift_storage_relation_joined')
+    def test_update_status_drains(self, joined):
+        self.relation_ids.return_value = ['swift-storage:1']
+        self.update_drains.return_value = False
+        hooks.update_status()
+        self.assertFalse(joined.called)
+        self.update_drains.return_value = True
+        hooks.update_status()
+        joined.assert_called_once_with('swift-storage:1')
+
+    @patch.object(hooks, 'relation_set')
+    @patch.object(hooks, 'remember_devices')
+    def test_storage_joined_servers_per_port(self, remember_devices,
+                                             relation_set):
+        self.test_kv.set('prepared-devices', ['/dev/vdb', '/dev/vdc'])
+        self.test_config.set('object-servers-per-port', 2)
+        self.object_device_ports.return_value = {'vdb': 6010, 'vdc': 6011}
+        hooks.swift_storage_relation_joined('swift-storage:1')
+        self.object_device_ports.assert_called_once_with(['vdb', 'vdc'])
+        settings = relation_set.call_args[1]['relation_settings']
+        self.assertEqual(settings['object_device_ports'],
+                         '{"vdb":6010,"vdc":6011}')
+        # the ports of new devices are opened straight away
+        self.setup_ufw.assert_called_once_with()
+        self.setup_ufw.reset_mock()
+        self.test_kv.set('object-device-ports', {'vdb': 6010, 'vdc': 6011})
+        hooks.swift_storage_relation_joined('swift-storage:1')
+        self.assertFalse(self.setup_ufw.called)
+
+    @patch.object(hooks, 'ingress_address')
+    def test_storage_departed_revokes_ports(self, ingress_address):
+        ingress_address.return_value = '10.0.0.9'
+        self.storage_ports.return_value = [6000, 6001, 6002, '6010:6011']
+        hooks.swift_storage_relation_departed()
+        self.revoke_access.assert_has_calls([
+            call('10.0.0.9', port) for port in [6000, 6001, 6002,
+                                                '6010:6011']])
+
+    @patch.object(hooks, 'relation_set')
+    @patch.object(hooks, 'remember_devices')
+    def test_storage_joined_ring_devices(self, remember_devices,
+                                         relation_set):
+        self.test_kv.set('prepared-devices', ['/dev/vdb', '/dev/vdc',
+                                              '/dev/vdd'])
+        self.device_classes.return_value = {'vdb': 'ssd', 'vdc': 'hdd',
+                                            'vdd': 'hdd'}
+        self.ring_devices.return_value = {'account': ['vdb'],
+                                          'container': ['vdb'],
+                                          'object': ['vdc', 'vdd']}
+        hooks.swift_storage_relation_joined('swift-storage:1')
+        self.device_classes.assert_called_once_with(
+            ['/dev/vdb', '/dev/vdc', '/dev/vdd'])
+        self.ring_devices.assert_called_once_with(
+            self.device_classes.return_value)
+        settings = relation_set.call_args[1]['relation_settings']
+        self.assertEqual(settings['device'], 'vdb:vdc:vdd')
+        self.assertEqual(settings['account_devices'], 'vdb')
+        self.assertEqual(settings['container_devices'], 'vdb')
+        self.assertEqual(settings['object_devices'], 'vdc:vdd')
+
+    @patch.object(hooks, 'relation_set')
+    @patch.object(hooks, 'remember_devices')
+    def test_storage_joined_replication_servers(self, remember_devices,
+                                                relation_set):
+        self.test_config.set('replication-servers', True)
+        hooks.swift_storage_relation_joined('swift-storage:1')
+        settings = relation_set.call_args[1]['relation_settings']
+        self.assertEqual(settings['replication_ip'], '10.20.0.2')
+        self.assertEqual(settings['object_replication_port'], 6003)
+        self.assertEqual(settings['container_replication_port'], 6004)
+        self.assertEqual(settings['account_replication_port'], 6005)
+        self.assertEqual(settings['object_port'], 6000)
@@ -0,0 +1,300 @@
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import threading
+
+from mock import patch
+
+from unit_tests.test_utils import CharmTestCase
+
+import lib.swift_storage_services as services
+
+TO_PATCH = [
+    'config',
+    'log',
+    'init_is_systemd',
+    'service_running',
+]
+
+SYSTEMCTL_SHOW = b"""\
+Id=swift-object.service
+ActiveState=active
+SubState=running
+
+Id=swift-object-auditor.service
+ActiveState=inactive
+SubState=dead
+"""
+
+PROC_NET_TCP = """\
+  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt
+   0: 00000000:1770 00000000:0000 0A 00000000:00000000 00:00000000 00000000
+   1: 0100007F:1771 00000000:0000 0A 00000000:00000000 00:00000000 00000000
+   2: 0100007F:1772 0100007F:B958 01 00000000:00000000 02:000002DF 00000000
+"""
+
+PROC_NET_TCP6 = """\
+  sl  local_address                         remote_address
+   0: 00000000000000000000000000000000:1772 00000000000000000000000000000000:0000 0A 00000000:00000000
+"""  # noqa
+
+SERVICES = ['swift-account', 'swift-account-replicator', 'swift-object',
+            'swift-object-auditor', 'swift-object-replicator']
+
+
+class SwiftStorageServicesTests(CharmTestCase):
+
+    def setUp(self):
+        super(SwiftStorageServicesTests, self).setUp(services, TO_PATCH)
+        self.init_is_systemd.return_value = True
+        self.config.side_effect = {'account-server-port': 6002,
+                                   'object-server-port': 6000}.get
+
+    @patch('subprocess.check_output')
+    def test_services_running(self, check_output):
+        check_output.return_value = SYSTEMCTL_SHOW
+        self.assertEqual(
+            services.services_running(['swift-object', 'swift-object-auditor',
+                                       'swift-account']),
+            {'swift-object': True, 'swift-object-auditor': False,
+             'swift-account': False})
+        check_output.assert_called_once_with(
+            ['systemctl', 'show', '--property=Id,ActiveState,SubState',
+             'swift-object.service', 'swift-object-auditor.service',
+             'swift-account.service'])
+
+    def test_services_running_not_systemd(self):
+        self.init_is_systemd.return_value = False
+        self.service_running.side_effect = lambda s: s == 'swift-object'
+        self.assertEqual(
+            services.services_running(['swift-object', 'swift-account']),
+            {'swift-object': True, 'swift-account': False})
+
+    def test_listening_ports(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        paths = [os.path.join(tmpdir, 'tcp'), os.path.join(tmpdir, 'tcp6'),
+                 os.path.join(tmpdir, 'missing')]
+        for path, content in zip(paths, [PROC_NET_TCP, PROC_NET_TCP6]):
+            with open(path, 'w') as f:
+                f.write(content)
+        self.assertEqual(services.listening_ports(paths),
+                         set([6000, 6001, 6002]))
+
+    @patch.object(services, 'listening_ports')
+    @patch.object(services, 'services_running')
+    def test_check_services(self, services_running, listening_ports):
+        services_running.return_value = {'swift-object': True,
+                                         'swift-account': True}
+        listening_ports.return_value = set([6000, 6002])
+        self.assertEqual(
+            services.check_services(['swift-object', 'swift-account'],
+                                    [6000, 6002]),
+            (None, None))
+        services_running.return_value['swift-account'] = False
+        self.assertEqual(
+            services.check_services(['swift-object', 'swift-account'],
+                                    [6000, 6001, 6002]),
+            ('blocked', 'Services not running that should be: '
+                        'swift-account; Ports which should be open, but '
+                        'are not: 6001'))
+
+    def test_connection_count(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'tcp')
+        with open(path, 'w') as f:
+            f.write(PROC_NET_TCP)
+        self.assertEqual(services.connection_count([6002], [path]), 1)
+        self.assertEqual(services.connection_count([6000, 6001], [path]), 0)
+
+    def test_run_parallel(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        def stop(service):
+            # Every call must be in flight at once to pass the barrier.
+            barrier.wait()
+            if service == 'c':
+                raise Exception('boom')
+            return service != 'b'
+
+        self.assertEqual(services.run_parallel(stop, ['a', 'b', 'c']),
+                         ['b', 'c'])
+        self.assertEqual(services.run_parallel(stop, []), [])
+
+    @patch('subprocess.call')
+    @patch('subprocess.check_output')
+    def test_graceful_shutdown(self, check_output, call):
+        call.return_value = 0
+        check_output.return_value = (b'Id=swift-object.service\n'
+                                     b'MainPID=1234\nKillMode=process\n')
+        self.assertTrue(services.graceful_shutdown('swift-object'))
+        check_output.assert_called_once_with(
+            ['systemctl', 'show', '--property=Id,MainPID,KillMode',
+             'swift-object.service'])
+        call.assert_called_once_with(['systemctl', 'kill', '--signal=SIGHUP',
+                                      '--kill-who=main', 'swift-object'])
+        call.reset_mock()
+        # systemd would kill the draining workers with the main process
+        check_output.return_value = (b'Id=swift-object.service\n'
+                                     b'MainPID=1234\n'
+                                     b'KillMode=control-group\n')
+        self.assertFalse(services.graceful_shutdown('swift-object'))
+        check_output.return_value = (b'Id=swift-object.service\n'
+                                     b'MainPID=0\nKillMode=process\n')
+        self.assertFalse(services.graceful_shutdown('swift-object'))
+        self.assertFalse(call.called)
+        self.init_is_systemd.return_value = False
+        self.assertFalse(services.graceful_shutdown('swift-object'))
+
+    @patch.object(services, 'wait_for')
+    @patch.object(services, 'connection_count')
+    @patch.object(services, 'graceful_shutdown')
+    def test_stop_services(self, graceful_shutdown, connection_count,
+                           wait_for):
+        calls = []
+
+        def stop(service):
+            calls.append(('stop', service))
+            return True
+
+        graceful_shutdown.side_effect = \
+            lambda s: calls.append(('hup', s)) or True
+        wait_for.side_effect = lambda f, t: calls.append(('wait', t)) or True
+        self.assertEqual(services.stop_services(SERVICES, 10, stop), [])
+        self.assertEqual(
+            sorted(calls[:3]),
+            [('stop', 'swift-account-replicator'),
+             ('stop', 'swift-object-auditor'),
+             ('stop', 'swift-object-replicator')])
+        self.assertEqual(sorted(calls[3:5]),
+                         [('hup', 'swift-account'), ('hup', 'swift-object')])
+        self.assertEqual(calls[5], ('wait', 10))
+        self.assertEqual(sorted(calls[6:]),
+                         [('stop', 'swift-account'), ('stop', 'swift-object')])
+
+    @patch.object(services, 'graceful_shutdown')
+    def test_stop_services_background_failure(self, graceful_shutdown):
+        stopped = []
+
+        def stop(service):
+            stopped.append(service)
+            return service != 'swift-object-auditor'
+
+        self.assertEqual(services.stop_services(SERVICES, 10, stop),
+                         ['swift-object-auditor'])
+        self.assertNotIn('swift-account', stopped)
+        self.assertNotIn('swift-object', stopped)
+        self.assertFalse(graceful_shutdown.called)
+
+    @patch.object(services, 'listening_ports')
+    def test_start_services(self, listening_ports):
+        started = []
+        listening_ports.side_effect = lambda: set(
+            {'swift-account': 6002, 'swift-object': 6000}[s]
+            for s in started if s in ('swift-account', 'swift-object'))
+
+        def start(service):
+            started.append(service)
+            return True
+
+        self.assertEqual(services.start_services(SERVICES, 10, start), [])
+        self.assertEqual(sorted(started[:2]),
+                         ['swift-account', 'swift-object'])
+        self.assertEqual(len(started), len(SERVICES))
+
+    @patch.object(services, 'wait_for')
+    @patch.object(services, 'listening_ports')
+    def test_start_services_not_listening(self, listening_ports, wait_for):
+        started = []
+        listening_ports.return_value = set([6002])
+        wait_for.return_value = False
+
+        def start(service):
+            started.append(service)
+            return True
+
+        self.assertEqual(services.start_services(SERVICES, 10, start),
+                         ['swift-object'])
+        self.assertEqual(sorted(started), ['swift-account', 'swift-object'])
+
+    @patch.object(services, 'service_start')
+    @patch.object(services, 'service_stop')
+    @patch.object(services, 'graceful_shutdown')
+    @patch.object(services, 'listening_ports')
+    def test_rolling_restart(self, listening_ports, graceful_shutdown,
+                             service_stop, service_start):
+        calls = []
+        running = set()
+        listening_ports.side_effect = lambda: set(
+            {'swift-account': 6002, 'swift-object': 6000}[s]
+            for s in running if s in ('swift-account', 'swift-object'))
+        graceful_shutdown.return_value = False
+
+        def stop(service):
+            calls.append(('stop', service))
+            running.discard(service)
+            return True
+
+        def start(service):
+            calls.append(('start', service))
+            running.add(service)
+            return True
+
+        service_stop.side_effect = stop
+        service_start.side_effect = start
+        self.assertEqual(services.rolling_restart(SERVICES, 1, 1), [])
+        background = [s for s in SERVICES
+                      if s not in ('swift-account', 'swift-object')]
+        self.assertEqual(sorted(calls[:3]),
+                         sorted(('stop', s) for s in background))
+        self.assertEqual(calls[3:7], [('stop', 'swift-account'),
+                                      ('start', 'swift-account'),
+                                      ('stop', 'swift-object'),
+                                      ('start', 'swift-object')])
+        self.assertEqual(sorted(calls[7:]),
+                         sorted(('start', s) for s in background))
+
+        # A server which does not come back stops the restart.
+        calls[:] = []
+        listening_ports.side_effect = None
+        listening_ports.return_value = set([6002])
+        self.assertEqual(services.rolling_restart(SERVICES, 0, 0),
+                         ['swift-object'])
+        self.assertNotIn(('start', 'swift-account-replicator'), calls)
+
+    @patch.object(services, 'kv')
+    def test_server_ports_per_port(self, kv):
+        kv.return_value.get.return_value = {'sdb': 6010, 'sdc': 6011}
+        self.assertEqual(services.server_ports(SERVICES),
+                         {'swift-account': [6002], 'swift-object': [6000]})
+        self.config.side_effect = {'account-server-port': 6002,
+                                   'object-server-port': 6000,
+                                   'object-servers-per-port': 2}.get
+        self.assertEqual(services.server_ports(SERVICES),
+                         {'swift-account': [6002],
+                          'swift-object': [6010, 6011]})
+
+    @patch.object(services, 'server_ports')
+    @patch.object(services, 'listening_ports')
+    def test_start_services_per_port(self, listening_ports, server_ports):
+        # devices not in the rings yet have no listener
+        server_ports.return_value = {'swift-account': [6002],
+                                     'swift-object': [6010, 6011]}
+        listening_ports.return_value = set([6002, 6011])
+        self.assertEqual(services.start_services(SERVICES, 0,
+                                                 lambda s: True), [])
@@ -0,0 +1,139 @@
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import lib.swift_storage_tuning as tuning
+
+
+class SwiftStorageTuningTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def write(self, path, content):
+        path = os.path.join(self.tmpdir, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_nic_speed(self):
+        # bond0 is virtual, eth1 is down
+        for name, speed in (('eth0', '1000\n'), ('eth1', '-1\n'),
+                            ('eth2', '25000\n'), ('bond0', '50000\n')):
+            self.write(os.path.join('net', name, 'speed'), speed)
+            if name != 'bond0':
+                self.write(os.path.join('net', name, 'device', 'uevent'), '')
+        os.makedirs(os.path.join(self.tmpdir, 'net', 'eth3', 'device'))
+        self.assertEqual(
+            tuning.nic_speed(os.path.join(self.tmpdir, 'net')), 25000)
+        self.assertEqual(
+            tuning.nic_speed(os.path.join(self.tmpdir, 'none')),
+            tuning.DEFAULT_NIC_SPEED)
+
+    def test_rotational(self):
+        self.write('devices/sdb/queue/rotational', '1\n')
+        self.write('devices/nvme0n1/queue/rotational', '0\n')
+        os.makedirs(os.path.join(self.tmpdir, 'devices', 'sdb', 'sdb1'))
+        os.makedirs(os.path.join(self.tmpdir, 'class'))
+        for name, target in (('sdb', 'sdb'), ('sdb1', 'sdb/sdb1'),
+                             ('nvme0n1', 'nvme0n1')):
+            os.symlink(os.path.join(self.tmpdir, 'devices', target),
+                       os.path.join(self.tmpdir, 'class', name))
+        sysfs = os.path.join(self.tmpdir, 'class')
+        self.assertEqual(tuning.rotational('/dev/sdb', sysfs), 1)
+        self.assertEqual(tuning.rotational('/dev/sdb1', sysfs), 1)
+        self.assertEqual(tuning.rotational('/dev/nvme0n1', sysfs), 0)
+        self.assertIsNone(tuning.rotational('/dev/sdz', sysfs))
+
+    def test_device_size(self):
+        self.write('devices/sdb/size', '15628053168\n')
+        os.makedirs(os.path.join(self.tmpdir, 'class'))
+        os.symlink(os.path.join(self.tmpdir, 'devices', 'sdb'),
+                   os.path.join(self.tmpdir, 'class', 'sdb'))
+        sysfs = os.path.join(self.tmpdir, 'class')
+        self.assertEqual(tuning.device_size('/dev/sdb', sysfs),
+                         8001563222016)
+        self.assertIsNone(tuning.device_size('/dev/sdc', sysfs))
+
+    def test_daemon_tuning_small_node(self):
+        self.assertEqual(tuning.daemon_tuning(4, False, 1000), {
+            'object-auditor-concurrency': 1,
+            'object-auditor-files-per-second': 20,
+            'object-auditor-bytes-per-second': 10000000,
+            'object-auditor-zero-byte-files-per-second': 50,
+            'object-updater-concurrency': 8,
+            'object-updater-objects-per-second': 50,
+            'object-replicator-run-pause': 30,
+            'object-replicator-node-timeout': 10,
+            'object-replicator-workers': 0,
+            'object-reconstructor-concurrency': 1,
+            'object-reconstructor-workers': 0,
+            'container-replicator-per-diff': 1000,
+            'container-replicator-max-diffs': 100,
+            'account-replicator-per-diff': 1000,
+            'account-replicator-max-diffs': 100,
+        })
+
+    def test_daemon_tuning_large_node(self):
+        settings = tuning.daemon_tuning(60, False, 25000)
+        self.assertEqual(settings['object-auditor-concurrency'], 8)
+        self.assertEqual(settings['object-updater-concurrency'], 30)
+        self.assertEqual(settings['object-replicator-workers'], 5)
+        self.assertEqual(settings['object-reconstructor-workers'], 5)
+        self.assertEqual(settings['object-reconstructor-concurrency'], 8)
+        self.assertEqual(settings['object-replicator-node-timeout'], 10)
+        self.assertEqual(settings['container-replicator-per-diff'], 10000)
+        settings = tuning.daemon_tuning(60, True, 10000)
+        self.assertEqual(settings['object-updater-concurrency'], 30)
+        self.assertEqual(settings['object-auditor-bytes-per-second'],
+                         50000000)
+        self.assertEqual(settings['object-replicator-node-timeout'], 10)
+        self.assertEqual(settings['account-replicator-max-diffs'], 1000)
+
+    def test_object_server_tuning(self):
+        GiB = tuning.GiB
+        TiB = tuning.TiB
+        # 60 8TiB disks with 128GiB of RAM, keeping swift's keep_cache_size
+        self.assertEqual(
+            tuning.object_server_tuning(128 * GiB, 10000, [8 * TiB] * 60,
+                                        False),
+            {'object-server-disk-chunk-size': 262144,
+             'object-server-network-chunk-size': 262144,
+             'object-server-keep-cache-size': 5 * 1024 * 1024,
+             'object-server-keep-cache-private': False,
+             'object-server-mb-per-sync': 512,
+             'object-server-max-upload-time': 86400,
+             'object-server-fallocate-reserve': '1%',
+             'object-server-client-timeout': 60,
+             'object-server-max-clients': 1024})
+        # 4 2TiB SSDs with 64GiB of RAM
+        settings = tuning.object_server_tuning(64 * GiB, 25000,
+                                               [2 * TiB] * 4, True)
+        self.assertEqual(settings['object-server-disk-chunk-size'], 65536)
+        self.assertEqual(settings['object-server-network-chunk-size'],
+                         1048576)
+        self.assertEqual(settings['object-server-keep-cache-size'],
+                         40 * 1024 * 1024)
+        self.assertTrue(settings['object-server-keep-cache-private'])
+        self.assertEqual(settings['object-server-max-clients'], 2500)
+        settings = tuning.object_server_tuning(8 * GiB, 1000, [], False)
+        self.assertEqual(settings['object-server-mb-per-sync'], 64)
+        self.assertEqual(settings['object-server-fallocate-reserve'], '1%')
+        self.assertEqual(settings['object-server-client-timeout'], 120)
@@ -14,11 +14,15 @@
 
 from collections import namedtuple
 from mock import call, patch, MagicMock
+import json
+import os
 import shutil
+import subprocess
 import tempfile
 
 from unit_tests.test_utils import CharmTestCase, TestKV, patch_open
 
+import lib.swift_storage_context as swift_context
 import lib.swift_storage_utils as swift_utils
 
 
@@ -52,6 +56,8 @@ TO_PATCH = [
     'relation_ids',
     'vaultlocker',
     'kv',
+    'replication_servers_enabled',
+    'statsd_aggregator_enabled',
 ]
 
 
@@ -100,6 +106,8 @@ major minor  #blocks  name
    8       16  119454720 sdb1
 """
 
+CHARM_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
 FINDMNT_FOUND_TEMPLATE = """
 TARGET        SOURCE   FSTYPE OPTIONS
 {}           /dev/{} xfs    rw,relatime,attr2,inode64,noquota
@@ -112,6 +120,12 @@ class SwiftStorageUtilsTests(CharmTestCase):
     def setUp(self):
         super(SwiftStorageUtilsTests, self).setUp(swift_utils, TO_PATCH)
         self.config.side_effect = self.test_config.get
+        self.get_os_codename_package.return_value = 'rocky'
+        self.replication_servers_enabled.side_effect = lambda: bool(
+            self.test_config.get('replication-servers'))
+        self.statsd_aggregator_enabled.side_effect = lambda: bool(
+            self.test_config.get('statsd-local-aggregator') and
+            self.test_config.get('statsd-host'))
         self.test_kv = TestKV()
         self.kv.return_value = self.test_kv
 
@@ -134,6 +148,47 @@ class SwiftStorageUtilsTests(CharmTestCase):
         swift_utils.swift_init('all', 'start', fatal=True)
         self.check_call.assert_called_with(['swift-init', 'all', 'start'])
 
+    def test_fetch_swift_rings_storage_policies(self):
+        url = 'http://someproxynode/rings'
+        with patch.object(swift_utils, 'SWIFT_CONF_DIR', tempfile.mkdtemp()), \
+                patch.object(swift_utils.os, 'rename') as rename:
+            self.addCleanup(shutil.rmtree, swift_utils.SWIFT_CONF_DIR)
+            swift_utils.fetch_swift_rings(url, [2, 0, 1])
+            self.assertEqual(
+                [c[0][0][1] for c in self.check_call.call_args_list],
+                ['%s/%s.ring.gz' % (url, r) for r in (
+                    'account', 'object', 'container', 'object-1',
+                    'object-2')])
+            self.assertEqual(rename.call_count, 5)
+
+    def test_swift_services_release(self):
+        self.assertIn('swift-object-reconstructor',
+                      swift_utils.swift_services())
+        self.assertIn('swift-container-sharder',
+                      swift_utils.swift_services())
+        self.get_os_codename_package.return_value = 'queens'
+        self.assertNotIn('swift-container-sharder',
+                         swift_utils.swift_services())
+        self.get_os_codename_package.return_value = 'kilo'
+        self.assertNotIn('swift-object-reconstructor',
+                         swift_utils.swift_services())
+
+    def test_restart_map(self):
+        self.get_os_codename_package.return_value = 'kilo'
+        _map = swift_utils.restart_map()
+        for services in _map.values():
+            self.assertNotIn('swift-object-reconstructor', services)
+            self.assertNotIn('swift-container-sharder', services)
+        self.assertNotIn('/etc/swift/internal-client.conf', _map)
+        self.assertNotIn('swift-account-replication',
+                         _map['/etc/swift/swift.conf'])
+        self.assertEqual(_map['/etc/rsync-juju.d/050-swift-storage.conf'],
+                         ['rsync'])
+        self.get_os_codename_package.return_value = 'rocky'
+        self.assertIn('swift-container-sharder',
+                      swift_utils.restart_map()[
+                          '/etc/swift/container-server.conf'])
+
     def test_fetch_swift_rings(self):
         url = 'http://someproxynode/rings'
         swift_utils.SWIFT_CONF_DIR = tempfile.mkdtemp()
@@ -426,7 +481,9 @@ class SwiftStorageUtilsTests(CharmTestCase):
         renderer.assert_called_with(templates_dir=swift_utils.TEMPLATES,
                                     openstack_release='essex')
 
-    @patch('charmhelpers.contrib.openstack.context.WorkerConfigContext')
+    @patch.object(swift_utils, 'ObjectServerTuningContext')
+    @patch.object(swift_utils, 'DaemonTuningContext')
+    @patch.object(swift_utils, 'ServerWorkerContext')
     @patch('charmhelpers.contrib.openstack.context.BindHostContext')
     @patch.object(swift_utils, 'SwiftStorageContext')
     @patch.object(swift_utils, 'RsyncContext')
@@ -434,12 +491,15 @@ class SwiftStorageUtilsTests(CharmTestCase):
     @patch('charmhelpers.contrib.openstack.templating.OSConfigRenderer')
     def test_register_configs_post_install(self, renderer,
                                            swift, rsync, server,
-                                           bind_context, worker_context):
+                                           bind_context, worker_context,
+                                           tuning_context, object_context):
         swift.return_value = 'swift_context'
         rsync.return_value = 'rsync_context'
         server.return_value = 'swift_server_context'
         bind_context.return_value = 'bind_host_context'
-        worker_context.return_value = 'worker_context'
+        worker_context.side_effect = lambda s: '{}_worker_context'.format(s)
+        tuning_context.return_value = 'tuning_context'
+        object_context.return_value = 'object_tuning_context'
         self.vaultlocker.VaultKVContext.return_value = 'vl_context'
         self.get_os_codename_package.return_value = 'grizzly'
         configs = MagicMock()
@@ -454,19 +514,254 @@ class SwiftStorageUtilsTests(CharmTestCase):
                  ['rsync_context', 'swift_context']),
             call('/etc/swift/account-server.conf', ['swift_context',
                                                     'bind_host_context',
-                                                    'worker_context',
+                                                    'account_worker_context',
+                                                    'tuning_context',
                                                     'vl_context']),
             call('/etc/swift/object-server.conf', ['swift_context',
                                                    'bind_host_context',
-                                                   'worker_context',
+                                                   'object_worker_context',
+                                                   'tuning_context',
+                                                   'object_tuning_context',
                                                    'vl_context']),
-            call('/etc/swift/container-server.conf', ['swift_context',
-                                                      'bind_host_context',
-                                                      'worker_context',
-                                                      'vl_context'])
+            call('/etc/swift/container-server.conf',
+                 ['swift_context', 'bind_host_context',
+                  'container_worker_context', 'tuning_context',
+                  'vl_context'])
         ]
         self.assertEqual(ex, configs.register.call_args_list)
 
+    def test_devstore_devices(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        db_path = os.path.join(tmpdir, 'kv.db')
+        with patch.object(swift_utils, 'KV_DB_PATH', db_path):
+            self.assertEqual(swift_utils.devstore_devices(), [])
+            kvstore = swift_utils.KVStore(db_path)
+            kvstore.set(key='devices', value=json.dumps({
+                'sdb@uuid1': {'blkid': 'a', 'status': 'active'},
+                'sdc@uuid1': {'blkid': 'b', 'status': 'deactivated'},
+                'sdd@uuid2': {'blkid': 'c', 'status': 'active'}}))
+            kvstore.flush()
+            kvstore.close()
+            self.assertEqual(swift_utils.devstore_devices(), ['sdb', 'sdd'])
+            self.assertEqual(swift_utils.devstore_devices(status=None),
+                             ['sdb', 'sdc', 'sdd'])
+
+    @patch.object(swift_utils.time, 'time', lambda: 1550000000)
+    def test_remember_benchmarks(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        db_path = os.path.join(tmpdir, 'kv.db')
+        kvstore = swift_utils.KVStore(db_path)
+        kvstore.set(key='devices', value=json.dumps({
+            'sdb@uuid1': {'blkid': 'a', 'status': 'active'},
+            'sdc@uuid1': {'blkid': 'b', 'status': 'active'}}))
+        kvstore.flush()
+        kvstore.close()
+        with patch.object(swift_utils, 'KV_DB_PATH', db_path):
+            swift_utils.remember_benchmarks(
+                {'sdb': {'seq-read-mbps': 10.0},
+                 'sdc': {'error': 'I/O error'}},
+                {'sdb': ['seq-read-mbps']})
+        kvstore = swift_utils.KVStore(db_path)
+        devstore = json.loads(kvstore.get(key='devices'))
+        kvstore.close()
+        self.assertEqual(devstore['sdb@uuid1']['benchmark'],
+                         {'seq-read-mbps': 10.0, 'timestamp': 1550000000,
+                          'outlier': ['seq-read-mbps']})
+        self.assertNotIn('benchmark', devstore['sdc@uuid1'])
+
+    def test_device_metadata(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        sysfs = os.path.join(tmpdir, 'sys')
+        files = {'sdb/size': '15628053168\n',
+                 'sdb/queue/rotational': '1\n',
+                 'sdb/sdb1/size': '2048\n',
+                 'nvme0n1/size': '1000\n',
+                 'nvme0n1/queue/rotational': '0\n'}
+        for path, content in files.items():
+            path = os.path.join(sysfs, 'devices', path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(content)
+        os.makedirs(os.path.join(sysfs, 'class'))
+        for name, target in (('sdb', 'sdb'), ('sdb1', 'sdb/sdb1'),
+                             ('nvme0n1', 'nvme0n1')):
+            os.symlink(os.path.join(sysfs, 'devices', target),
+                       os.path.join(sysfs, 'class', name))
+        db_path = os.path.join(tmpdir, 'kv.db')
+        kvstore = swift_utils.KVStore(db_path)
+        kvstore.set(key='devices', value=json.dumps({
+            'nvme0n1@uuid1': {'status': 'active', 'benchmark': {
+                'seq-read-mbps': 2000.0, 'seq-write-mbps': 1500.0}}}))
+        kvstore.flush()
+        kvstore.close()
+
+        with patch.object(swift_utils, 'SYSFS_BLOCK',
+                          os.path.join(sysfs, 'class')), \
+                patch.object(swift_utils, 'KV_DB_PATH', db_path):
+            metadata = swift_utils.device_metadata(
+                ['/dev/sdb', '/dev/sdb1', '/dev/nvme0n1', '/dev/sdz'])
+        self.assertEqual(metadata, {'sdb': [8001563222016, 1, None],
+                                    'sdb1': [1048576, 1, None],
+                                    'nvme0n1': [512000, 0, 1750.0],
+                                    'sdz': [None, None, None]})
+        self.assertEqual(
+            swift_utils.encode_device_metadata(metadata),
+            '{"nvme0n1":[512000,0,1750.0],"sdb":[8001563222016,1,null],'
+            '"sdb1":[1048576,1,null],"sdz":[null,null,null]}')
+
+    def test_parse_device_class_overrides(self):
+        self.assertEqual(swift_utils.parse_device_class_overrides(None), {})
+        self.assertEqual(
+            swift_utils.parse_device_class_overrides('sdb:ssd /dev/sdc:hdd'),
+            {'sdb': 'ssd', 'sdc': 'hdd'})
+        for invalid in ('sdb', 'sdb:nvme', ':ssd'):
+            self.assertRaises(ValueError,
+                              swift_utils.parse_device_class_overrides,
+                              invalid)
+
+    @patch.object(swift_utils, 'rotational')
+    def test_device_classes(self, rotational):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        db_path = os.path.join(tmpdir, 'kv.db')
+        kvstore = swift_utils.KVStore(db_path)
+        kvstore.set(key='devices', value=json.dumps({
+            'sdb@uuid1': {'blkid': 'a', 'status': 'active'},
+            'sdc@uuid1': {'blkid': 'b', 'status': 'active', 'class': 'ssd'},
+            'sdd@uuid1': {'blkid': 'c', 'status': 'active'}}))
+        kvstore.flush()
+        kvstore.close()
+        rotational.side_effect = lambda dev, sysfs: {
+            '/dev/sdb': 0, '/dev/sdc': 1, '/dev/sde': 0}.get(dev)
+        devices = ['/dev/sdb', '/dev/sdc', '/dev/sdd', '/dev/sde']
+        with patch.object(swift_utils, 'KV_DB_PATH', db_path):
+            # sdc keeps its remembered class, sdd is of unknown class
+            self.assertEqual(swift_utils.device_classes(devices),
+                             {'sdb': 'ssd', 'sdc': 'ssd', 'sdd': 'hdd',
+                              'sde': 'ssd'})
+            self.test_config.set('device-class-overrides', 'sdc:hdd')
+            rotational.side_effect = lambda dev, sysfs: 1
+            self.assertEqual(swift_utils.device_classes(devices),
+                             {'sdb': 'ssd', 'sdc': 'hdd', 'sdd': 'hdd',
+                              'sde': 'hdd'})
+            kvstore = swift_utils.KVStore(db_path)
+            devstore = json.loads(kvstore.get(key='devices'))
+            kvstore.close()
+        self.assertEqual({k: v['class'] for k, v in devstore.items()},
+                         {'sdb@uuid1': 'ssd', 'sdc@uuid1': 'hdd',
+                          'sdd@uuid1': 'hdd'})
+
+    def test_ring_devices(self):
+        classes = {'sdb': 'ssd', 'sdc': 'hdd', 'sdd': 'hdd'}
+        # off by default, so that upgrades do not move data
+        self.assertEqual(swift_utils.ring_devices(classes)['account'],
+                         ['sdb', 'sdc', 'sdd'])
+        self.test_config.set('separate-db-devices', True)
+        self.assertEqual(swift_utils.ring_devices(classes),
+                         {'account': ['sdb'], 'container': ['sdb'],
+                          'object': ['sdc', 'sdd']})
+        self.assertEqual(swift_utils.ring_devices({'sdc': 'hdd',
+                                                   'sdd': 'hdd'}),
+                         {'account': ['sdc', 'sdd'],
+                          'container': ['sdc', 'sdd'],
+                          'object': ['sdc', 'sdd']})
+        self.test_config.set('separate-db-devices', False)
+        self.assertEqual(swift_utils.ring_devices(classes)['account'],
+                         ['sdb', 'sdc', 'sdd'])
+
+    @patch.object(swift_utils, 'umount')
+    def test_drain_device(self, umount):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        node = os.path.join(tmpdir, 'node')
+        for data_dir in ('objects', 'objects-1', 'containers'):
+            for part in range(4):
+                os.makedirs(os.path.join(node, 'sdb', data_dir, str(part)))
+        os.makedirs(os.path.join(node, 'sdb', 'tmp'))
+        db_path = os.path.join(tmpdir, 'kv.db')
+        kvstore = swift_utils.KVStore(db_path)
+        kvstore.set(key='devices', value=json.dumps({
+            'sdb@uuid1': {'blkid': 'a', 'status': 'active'},
+            'sdc@uuid1': {'blkid': 'b', 'status': 'active'}}))
+        kvstore.flush()
+        kvstore.close()
+
+        def move(count):
+            for data_dir in ('objects', 'objects-1', 'containers'):
+                for part in os.listdir(os.path.join(node, 'sdb',
+                                                    data_dir))[:count]:
+                    os.rmdir(os.path.join(node, 'sdb', data_dir, part))
+
+        with patch.object(swift_utils, 'KV_DB_PATH', db_path), \
+                patch.object(swift_utils, 'STORAGE_MOUNT_PATH', node):
+            self.assertEqual(swift_utils.count_partitions('sdb'), 12)
+            self.assertRaises(ValueError, swift_utils.start_drain, 'sdd')
+            entry = swift_utils.start_drain('sdb', 0.5)
+            self.assertEqual(entry['status'], 'draining')
+            self.assertEqual(entry['drain-weight'], 0.5)
+            self.assertEqual(swift_utils.drain_weights(), {'sdb': 0.5})
+            # draining devices are still in the rings, so never reformatted
+            with patch.object(swift_utils, 'get_device_blkid',
+                              lambda dev: 'a'), \
+                    patch.dict(os.environ, {'JUJU_MODEL_UUID': 'uuid1'}):
+                self.assertTrue(swift_utils.is_device_in_ring(
+                    'sdb', skip_rel_check=True))
+
+            # the weight only drops once half the partitions have moved
+            move(1)
+            self.assertFalse(swift_utils.update_drains())
+            self.assertEqual(swift_utils.draining_devices(),
+                             [('sdb', 9, 0.5)])
+            move(1)
+            self.assertTrue(swift_utils.update_drains())
+            self.assertEqual(swift_utils.drain_weights(), {'sdb': 0.0})
+
+            move(2)
+            # a busy device stays draining until it can be unmounted
+            umount.return_value = False
+            self.assertFalse(swift_utils.update_drains())
+            self.assertEqual(swift_utils.draining_devices(),
+                             [('sdb', 0, 0.0)])
+            umount.reset_mock()
+            umount.return_value = True
+            self.assertTrue(swift_utils.update_drains())
+            umount.assert_called_once_with(os.path.join(node, 'sdb'),
+                                           persist=True)
+            self.assertEqual(swift_utils.drain_weights(), {})
+            self.assertEqual(swift_utils.devstore_devices(status='inactive'),
+                             ['sdb'])
+            self.assertFalse(swift_utils.update_drains())
+
+    @patch.object(swift_utils, 'worker_plan')
+    @patch.object(swift_utils, 'status_set')
+    @patch.object(swift_utils, 'status_get')
+    def test_report_worker_plan(self, status_get, status_set, worker_plan):
+        worker_plan.return_value = {'account': 2, 'container': 2,
+                                    'object': 6, 'memory-limited': False}
+        status_get.return_value = ('active', 'Unit is ready')
+        swift_utils.report_worker_plan()
+        self.assertFalse(status_set.called)
+        self.log.assert_called_once_with(
+            'workers account=2 container=2 object=6', level='INFO')
+        # unchanged plans are not logged again
+        swift_utils.report_worker_plan()
+        self.assertEqual(self.log.call_count, 1)
+
+        worker_plan.return_value = {'account': 1, 'container': 1,
+                                    'object': 2, 'memory-limited': True}
+        status_get.return_value = ('blocked', 'Slow devices: sdb')
+        swift_utils.report_worker_plan()
+        self.assertFalse(status_set.called)
+        status_get.return_value = ('active', 'Unit is ready')
+        swift_utils.report_worker_plan()
+        status_set.assert_called_once_with(
+            'active', 'Unit is ready, workers account=1 container=1 '
+            'object=2 (memory limited)')
+
     def test_do_upgrade(self):
         self.is_paused.return_value = False
         self.test_config.set('openstack-origin', 'cloud:precise-grizzly')
@@ -489,6 +784,64 @@ class SwiftStorageUtilsTests(CharmTestCase):
         for service in services:
             self.assertIn(call(service), self.service_restart.call_args_list)
 
+    @patch.object(swift_utils, 'rolling_restart')
+    def test_do_upgrade_staged(self, rolling_restart):
+        self.is_paused.return_value = False
+        self.test_config.set('openstack-origin', 'cloud:bionic-stein')
+        self.test_config.set('staged-openstack-upgrade', True)
+        self.get_os_codename_install_source.return_value = 'stein'
+        rolling_restart.return_value = []
+        policy_rc = os.path.join(tempfile.mkdtemp(), 'policy-rc.d')
+        self.addCleanup(shutil.rmtree, os.path.dirname(policy_rc))
+        held = []
+
+        def upgrade(options, fatal, dist):
+            held.append(os.path.exists(policy_rc))
+
+        self.apt_upgrade.side_effect = upgrade
+        configs = MagicMock()
+        with patch.object(swift_utils, 'POLICY_RC', policy_rc):
+            timings = swift_utils.do_openstack_upgrade(configs)
+        dpkg_opts = [
+            '--option', 'Dpkg::Options::=--force-confnew',
+            '--option', 'Dpkg::Options::=--force-confdef',
+        ]
+        self.assertEqual(self.apt_upgrade.call_args_list, [
+            call(options=dpkg_opts + ['--download-only'], fatal=True,
+                 dist=True),
+            call(options=dpkg_opts, fatal=True, dist=True)])
+        # services are only held during the install
+        self.assertEqual(held, [False, True])
+        self.assertFalse(os.path.exists(policy_rc))
+        configs.write_all.assert_called_once_with()
+        rolling_restart.assert_called_once_with(swift_utils.SWIFT_SVCS)
+        self.assertFalse(self.service_restart.called)
+        self.assertEqual(sorted(timings), ['download', 'install', 'restart'])
+
+        rolling_restart.return_value = ['swift-object']
+        with patch.object(swift_utils, 'POLICY_RC', policy_rc):
+            self.assertRaises(Exception, swift_utils.do_openstack_upgrade,
+                              configs)
+
+    def test_services_held(self):
+        policy_rc = os.path.join(tempfile.mkdtemp(), 'policy-rc.d')
+        self.addCleanup(shutil.rmtree, os.path.dirname(policy_rc))
+        with swift_utils.services_held(policy_rc):
+            # only the swift services are held
+            self.assertEqual(subprocess.call(
+                [policy_rc, 'swift-object', 'restart']), 101)
+            self.assertEqual(subprocess.call(
+                [policy_rc, 'rsync', 'restart']), 0)
+        self.assertFalse(os.path.exists(policy_rc))
+
+        with open(policy_rc, 'w') as f:
+            f.write('exit 0\n')
+        with swift_utils.services_held(policy_rc):
+            pass
+        self.assertTrue(self.log.called)
+        with open(policy_rc) as f:
+            self.assertEqual(f.read(), 'exit 0\n')
+
     @patch.object(swift_utils.charmhelpers.core.fstab, "Fstab")
     @patch.object(swift_utils, "is_device_in_ring")
     @patch.object(swift_utils, "mkfs_xfs")
@@ -629,3 +982,303 @@ class SwiftStorageUtilsTests(CharmTestCase):
                 else:
                     calls.append(call(addr, port))
         mock_grant_access.assert_has_calls(calls)
+
+    @patch.object(swift_utils.ufw, 'modify_access')
+    @patch.object(swift_utils, 'RsyncContext')
+    @patch.object(swift_utils, 'grant_access')
+    def test_setup_ufw_servers_per_port(self, grant_access, rsync,
+                                        modify_access):
+        self.test_config.set('object-servers-per-port', 2)
+        self.test_kv.set('object-device-ports',
+                         {'sdb': 6010, 'sdc': 6011, 'sdd': 6013})
+        self.iter_units_for_relation_name.return_value = []
+        rsync.return_value.return_value = {'allowed_hosts': '10.1.1.1'}
+        swift_utils.setup_ufw()
+        self.assertEqual(grant_access.call_args_list,
+                         [call('10.1.1.1', port)
+                          for port in (6000, 6001, 6002, '6010:6011',
+                                       '6013')])
+
+    @patch.object(swift_utils.ufw, 'modify_access')
+    @patch.object(swift_utils, 'grant_access')
+    @patch.object(swift_context.RsyncContext, 'enable_rsyncd')
+    @patch.object(swift_context, 'resolve_network_cidr')
+    @patch.object(swift_context, 'get_relation_ip')
+    @patch.object(swift_context, 'relation_get')
+    @patch.object(swift_context, 'related_units')
+    @patch.object(swift_context, 'relation_ids')
+    @patch.object(swift_context, 'unit_private_ip', MagicMock())
+    @patch.object(swift_context, 'config')
+    def test_setup_ufw_replication_network(self, config, relation_ids,
+                                           related_units, relation_get,
+                                           get_relation_ip,
+                                           resolve_network_cidr,
+                                           enable_rsyncd, grant_access,
+                                           modify_access):
+        config.side_effect = self.test_config.get
+        relation_ids.return_value = ['swift-storage:0']
+        related_units.return_value = ['swift-proxy/0']
+        relation_get.return_value = {'timestamp': '1',
+                                     'rsync_allowed_hosts': '10.1.1.1'}
+        get_relation_ip.side_effect = lambda i, **kwargs: {
+            'swift-storage': '10.1.1.5', 'replication': '10.20.0.5'}[i]
+        resolve_network_cidr.return_value = '10.20.0.0/24'
+        self.iter_units_for_relation_name.return_value = []
+        swift_utils.setup_ufw()
+        # peers replicate from their replication addresses
+        self.assertEqual(grant_access.call_args_list,
+                         [call(host, port)
+                          for host in ('10.1.1.1', '10.20.0.0/24')
+                          for port in (6000, 6001, 6002)])
+
+    def test_object_device_ports(self):
+        self.test_config.set('object-server-port-base', 6010)
+        self.assertEqual(swift_utils.object_device_ports(['sdb', 'sdc']),
+                         {'sdb': 6010, 'sdc': 6011})
+        # existing devices keep their ports
+        self.assertEqual(swift_utils.object_device_ports(['sdc', 'sdd']),
+                         {'sdc': 6011, 'sdd': 6012})
+        self.assertEqual(swift_utils.object_device_ports(['sdb', 'sde']),
+                         {'sdb': 6010, 'sde': 6013})
+        self.test_config.set('object-server-port-base', 7000)
+        self.assertEqual(swift_utils.object_device_ports(['sdc', 'sdb']),
+                         {'sdc': 7000, 'sdb': 7001})
+
+    def test_port_ranges(self):
+        self.assertEqual(swift_utils.port_ranges([6012, 6010, 6011, 6020]),
+                         ['6010:6012', '6020'])
+        self.assertEqual(swift_utils.port_ranges([]), [])
+
+    def test_record_hook_duration(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'hook-stats.json')
+        with patch.object(swift_utils, 'HOOK_STATS_PATH', path), \
+                patch.object(swift_utils.time, 'time') as mock_time:
+            mock_time.return_value = 1500000000.5
+            swift_utils.record_hook_duration('config-changed', 12.34567)
+            swift_utils.record_hook_duration('update-status', 0.5)
+        with open(path) as f:
+            self.assertEqual(json.load(f), {
+                'config-changed': {'duration': 12.346,
+                                   'timestamp': 1500000000},
+                'update-status': {'duration': 0.5,
+                                  'timestamp': 1500000000}})
+
+    @patch.object(swift_utils, 'service_restart')
+    @patch.object(swift_utils, 'render')
+    @patch.object(swift_utils, 'rsync')
+    @patch.object(swift_utils, 'charm_dir')
+    @patch.object(swift_utils, 'init_is_systemd')
+    def test_configure_prometheus_exporter(self, init_is_systemd, charm_dir,
+                                           rsync, render, service_restart):
+        init_is_systemd.return_value = True
+        charm_dir.return_value = CHARM_DIR
+        self.test_config.set('prometheus-textfile-dir', '/var/lib/prom')
+        swift_utils.configure_prometheus_exporter()
+        self.mkdir.assert_any_call('/var/lib/prom', perms=0o755)
+        rsync.assert_called_with(
+            os.path.join(CHARM_DIR,
+                         'files/prometheus/swift_storage_exporter.py'),
+            swift_utils.EXPORTER_BIN)
+        ctxt = {'exporter_bin': swift_utils.EXPORTER_BIN,
+                'output_dir': '/var/lib/prom',
+                'port': 6000,
+                'interval': 60}
+        render.assert_has_calls([
+            call('swift-storage-exporter.service',
+                 '/etc/systemd/system/swift-storage-exporter.service',
+                 ctxt, perms=0o644),
+            call('swift-storage-exporter.timer',
+                 '/etc/systemd/system/swift-storage-exporter.timer',
+                 ctxt, perms=0o644)])
+        self.check_call.assert_called_with(
+            ['systemctl', 'enable', 'swift-storage-exporter.timer'])
+        service_restart.assert_called_with('swift-storage-exporter.timer')
+
+    @patch.object(swift_utils, 'service_restart')
+    @patch.object(swift_utils, 'render')
+    @patch.object(swift_utils, 'rsync')
+    @patch.object(swift_utils, 'charm_dir')
+    @patch.object(swift_utils, 'init_is_systemd')
+    def test_configure_statsd_aggregator(self, init_is_systemd, charm_dir,
+                                         rsync, render, service_restart):
+        init_is_systemd.return_value = True
+        charm_dir.return_value = CHARM_DIR
+        self.test_config.set('statsd-host', '10.0.0.10')
+        self.test_config.set('statsd-local-aggregator', True)
+        swift_utils.configure_statsd_aggregator()
+        render.assert_called_once_with(
+            'swift-statsd-aggregator.service',
+            '/etc/systemd/system/swift-statsd-aggregator.service',
+            {'aggregator_bin': swift_utils.STATSD_AGGREGATOR_BIN,
+             'listen_port': 8125,
+             'upstream_host': '10.0.0.10',
+             'upstream_port': 3125,
+             'flush_interval': 10},
+            perms=0o644)
+        service_restart.assert_called_with('swift-statsd-aggregator.service')
+
+    @patch.object(swift_utils, 'remove_systemd_units')
+    @patch.object(swift_utils, 'render')
+    @patch.object(swift_utils, 'init_is_systemd')
+    def test_configure_statsd_aggregator_no_systemd(self, init_is_systemd,
+                                                    render,
+                                                    remove_systemd_units):
+        init_is_systemd.return_value = False
+        self.test_config.set('statsd-host', '10.0.0.10')
+        self.test_config.set('statsd-local-aggregator', True)
+        self.statsd_aggregator_enabled.side_effect = None
+        self.statsd_aggregator_enabled.return_value = False
+        swift_utils.configure_statsd_aggregator()
+        self.assertFalse(render.called)
+        self.log.assert_any_call('Local statsd aggregator requires systemd',
+                                 level='WARNING')
+        remove_systemd_units.assert_called_once_with(
+            swift_utils.STATSD_AGGREGATOR_UNIT)
+
+    @patch.object(swift_utils, 'service_stop')
+    @patch('os.remove')
+    @patch('os.path.exists')
+    def test_configure_statsd_aggregator_disabled(self, exists, remove,
+                                                  service_stop):
+        exists.return_value = True
+        swift_utils.configure_statsd_aggregator()
+        service_stop.assert_has_calls([
+            call('swift-statsd-aggregator.timer'),
+            call('swift-statsd-aggregator.service')])
+        remove.assert_has_calls([
+            call('/etc/systemd/system/swift-statsd-aggregator.timer'),
+            call('/etc/systemd/system/swift-statsd-aggregator.service')])
+        self.check_call.assert_called_with(['systemctl', 'daemon-reload'])
+
+    @patch.object(swift_utils, 'render')
+    def test_configure_replication_servers(self, render):
+        self.test_config.set('replication-servers', True)
+        swift_utils.configure_replication_servers()
+        render.assert_has_calls([
+            call('swift-replication-server.service',
+                 '/etc/systemd/system/swift-%s-replication.service' % server,
+                 {'server': server}, perms=0o644)
+            for server in ('account', 'container', 'object')])
+        self.check_call.assert_called_with(
+            ['systemctl', 'enable', 'swift-account-replication.service',
+             'swift-container-replication.service',
+             'swift-object-replication.service'])
+        self.assertEqual(swift_utils.swift_services(),
+                         swift_utils.SWIFT_SVCS +
+                         swift_utils.REPLICATION_SVCS)
+
+    @patch.object(swift_utils, 'service_stop')
+    @patch('os.remove')
+    @patch('os.path.exists')
+    def test_configure_replication_servers_disabled(self, exists, remove,
+                                                    service_stop):
+        exists.side_effect = lambda p: p.endswith('.service') or \
+            p.endswith('object-replication-server.conf')
+        swift_utils.configure_replication_servers()
+        service_stop.assert_has_calls([
+            call('swift-account-replication.service'),
+            call('swift-container-replication.service'),
+            call('swift-object-replication.service')])
+        remove.assert_called_with(
+            '/etc/swift/object-replication-server.conf')
+        self.assertEqual(swift_utils.swift_services(), swift_utils.SWIFT_SVCS)
+
+    @patch.object(swift_utils, 'remove_systemd_units')
+    @patch.object(swift_utils, 'render')
+    def test_configure_replication_servers_no_systemd(self, render,
+                                                      remove_systemd_units):
+        self.test_config.set('replication-servers', True)
+        self.replication_servers_enabled.side_effect = None
+        self.replication_servers_enabled.return_value = False
+        swift_utils.configure_replication_servers()
+        self.assertFalse(render.called)
+        self.log.assert_any_call('Replication servers require systemd',
+                                 level='WARNING')
+        self.assertEqual(swift_utils.swift_services(), swift_utils.SWIFT_SVCS)
+
+    @patch.object(swift_utils, 'get_relation_ip')
+    @patch.object(swift_utils, 'replication_ip')
+    @patch.object(swift_utils, 'mkdir')
+    def test_setup_rsync_replication_address(self, mkdir, replication_ip,
+                                             get_relation_ip):
+        get_relation_ip.return_value = '10.10.0.5'
+        replication_ip.return_value = '10.10.0.5'
+        with patch_open() as (_open, _file):
+            swift_utils.setup_rsync()
+            self.assertNotIn('address', _file.write.call_args[0][0])
+        replication_ip.return_value = '10.20.0.5'
+        with patch_open() as (_open, _file):
+            swift_utils.setup_rsync()
+            self.assertIn('address = 10.20.0.5\n',
+                          _file.write.call_args[0][0])
+
+    @patch.object(swift_utils, 'status_set')
+    @patch.object(swift_utils, 'status_get')
+    @patch.object(swift_utils, 'read_diskstats')
+    @patch.object(swift_utils.time, 'time')
+    def test_report_slow_devices(self, mock_time, read_diskstats, status_get,
+                                 status_set):
+        status_get.return_value = ('active', 'Unit is ready')
+        self.test_kv.set('prepared-devices', ['/dev/sdb', '/dev/sdc',
+                                              '/dev/sdd'])
+        mock_time.return_value = 100.0
+        read_diskstats.return_value = {
+            'sda': (0, 0, 0, 0), 'sdb': (0, 0, 0, 0),
+            'sdc': (0, 0, 0, 0), 'sdd': (0, 0, 0, 0)}
+        # the first sample is only recorded
+        swift_utils.report_slow_devices()
+        self.assertFalse(status_set.called)
+        self.assertEqual(sorted(self.test_kv.get('diskstats-sample')['stats']),
+                         ['sdb', 'sdc', 'sdd'])
+
+        mock_time.return_value = 110.0
+        read_diskstats.return_value = {
+            'sdb': (100, 500, 1000, 500), 'sdc': (100, 600, 1000, 600),
+            'sdd': (100, 9000, 10000, 9000)}
+        # a slow device degrades the unit without blocking it
+        swift_utils.report_slow_devices()
+        status_set.assert_called_once_with(
+            'active', 'Unit is ready, Slow devices: sdd (await 90ms, '
+            'peers 6ms)')
+
+        status_set.reset_mock()
+        status_get.return_value = ('blocked', 'Services not running')
+        mock_time.return_value = 120.0
+        read_diskstats.return_value = {
+            'sdb': (200, 1000, 2000, 1000), 'sdc': (200, 1200, 2000, 1200),
+            'sdd': (200, 18000, 20000, 18000)}
+        swift_utils.report_slow_devices()
+        self.assertFalse(status_set.called)
+
+    @patch.object(swift_utils, 'status_set')
+    def test_report_slow_devices_disabled(self, status_set):
+        self.test_config.set('slow-disk-factor', 0)
+        self.test_kv.set('prepared-devices', ['/dev/sdb', '/dev/sdc'])
+        swift_utils.report_slow_devices()
+        self.assertFalse(status_set.called)
+        self.assertIsNone(self.test_kv.get('diskstats-sample'))
+
+    def test_assess_status_invalid_device_class_overrides(self):
+        self.is_paused.return_value = False
+        self.test_config.set('device-class-overrides', 'sdb:fast')
+        self.assertEqual(swift_utils.assess_status(None),
+                         ('blocked', "Invalid device class override "
+                                     "'sdb:fast', expected device:ssd|hdd"))
+
+    @patch.object(swift_utils, 'check_services')
+    @patch('os.path.exists')
+    def test_assess_status_services(self, exists, check_services):
+        self.is_paused.return_value = False
+        exists.return_value = False
+        self.assertEqual(swift_utils.assess_status(None),
+                         ('active', 'Unit is ready'))
+        self.assertFalse(check_services.called)
+
+        exists.return_value = True
+        check_services.return_value = ('blocked', 'Services not running')
+        self.assertEqual(swift_utils.assess_status(None),
+                         ('blocked', 'Services not running'))
+        check_services.assert_called_once_with(swift_utils.SWIFT_SVCS,
+                                               [6000, 6001, 6002])
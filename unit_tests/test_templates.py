@@ -85,3 +85,34 @@ class StorageServerTemplateTestCase(unittest.TestCase):
                 self.assertNotIn("log_statsd_host", result)
                 self.assertNotIn("log_statsd_port", result)
                 self.assertNotIn("log_statsd_default_sample_rate", result)
+
+    def test_container_sharder_config(self):
+        """The container sharder section is only rendered on releases
+        with the sharder."""
+        template = self.get_template_for_release_and_server('rocky',
+                                                            'container')
+        result = template.render(
+            container_sharding=True,
+            container_sharder_shard_container_threshold=1000000,
+            container_sharder_concurrency=8,
+            container_sharder_cleave_batch_size=2)
+        self.assertIn("[container-sharder]\n"
+                      "shard_container_threshold = 1000000\n"
+                      "concurrency = 8\n"
+                      "cleave_batch_size = 2\n", result)
+
+        result = template.render(container_sharding=False)
+        self.assertNotIn("[container-sharder]", result)
+
+    def test_object_worker_options_by_release(self):
+        """Replicator and reconstructor workers are only rendered when the
+        release supports them."""
+        template = self.get_template_for_release_and_server('queens',
+                                                            'object')
+        result = template.render()
+        self.assertNotIn("replicator_workers", result)
+        self.assertNotIn("reconstructor_workers", result)
+        result = template.render(object_replicator_workers=0,
+                                 object_reconstructor_workers=2)
+        self.assertIn("replicator_workers = 0\n", result)
+        self.assertIn("reconstructor_workers = 2\n", result)